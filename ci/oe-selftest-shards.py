@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+# SPDX-License-Identifier: MIT
+#
+# Sharding helper of ci/oe-selftest.sh.
+#
+#   oe-selftest-shards.py plan CASES_DIR WORKERS DURATIONS TEST...
+#
+# Expands the test modules among TEST into their OESelftestTestCase
+# classes and balances the classes over WORKERS shards by the test
+# durations recorded in DURATIONS (longest first, each to the least loaded
+# shard). Prints one line of space-separated tests per shard.
+#
+#   oe-selftest-shards.py merge JUNIT DURATIONS RESULTS...
+#
+# Merges the oe-selftest testresults.json files RESULTS into the JUnit XML
+# report JUNIT and records the test durations in DURATIONS for the next
+# plan. A missing RESULTS file, left by a shard that did not get to write
+# it, is reported as an error test case and fails the merge.
+
+import json
+import os
+import re
+import sys
+import xml.etree.ElementTree as ET
+
+# Assumed duration of tests without history, in seconds
+DEFAULT_DURATION = 60.0
+
+CLASS_RE = re.compile(r"^class\s+(\w+)\((?:\w+\.)*OESelftestTestCase\)", re.M)
+
+
+def load_durations(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def expand(cases_dir, tests):
+    """Return the test classes of the modules among *tests*; classes and
+    single tests are kept as they are."""
+    items = []
+    for test in tests:
+        module = os.path.join(cases_dir, test + ".py")
+        if "." in test or not os.path.isfile(module):
+            items.append(test)
+            continue
+        with open(module) as f:
+            classes = CLASS_RE.findall(f.read())
+        items += [f"{test}.{cls}" for cls in classes] or [test]
+    return items
+
+
+def plan(cases_dir, workers, durations_path, tests):
+    durations = load_durations(durations_path)
+
+    def duration(item):
+        known = [d for t, d in durations.items() if t == item or t.startswith(item + ".")]
+        return sum(known) if known else DEFAULT_DURATION
+
+    shards = [[0.0, []] for _ in range(max(1, workers))]
+    for item in sorted(expand(cases_dir, tests), key=duration, reverse=True):
+        shard = min(shards, key=lambda s: s[0])
+        shard[0] += duration(item)
+        shard[1].append(item)
+    for load, items in shards:
+        if items:
+            print(" ".join(items))
+            print(f"shard: {load:.0f}s {' '.join(items)}", file=sys.stderr)
+
+
+def merge(junit_path, durations_path, results):
+    durations = load_durations(durations_path)
+    suites = {}
+    missing = []
+    for path in results:
+        if not os.path.isfile(path):
+            missing.append(path)
+            continue
+        with open(path) as f:
+            data = json.load(f)
+        for run in data.values():
+            for test, result in run.get("result", {}).items():
+                cls, _, name = test.rpartition(".")
+                suites.setdefault(cls, []).append((name, result))
+                if "duration" in result:
+                    durations[test] = float(result["duration"])
+
+    root = ET.Element("testsuites")
+    for cls in sorted(suites):
+        cases = suites[cls]
+        suite = ET.SubElement(root, "testsuite", name=cls, tests=str(len(cases)))
+        counts = {"failures": 0, "errors": 0, "skipped": 0}
+        seconds = 0.0
+        for name, result in sorted(cases, key=lambda c: c[0]):
+            duration = float(result.get("duration", 0))
+            seconds += duration
+            case = ET.SubElement(suite, "testcase", classname=cls, name=name,
+                                 time="%.3f" % duration)
+            status = result.get("status", "")
+            kind = {"FAILED": "failure", "UNEXPECTEDSUCCESS": "failure",
+                    "ERROR": "error", "SKIPPED": "skipped"}.get(status)
+            if kind:
+                counts["skipped" if kind == "skipped" else kind + "s"] += 1
+                ET.SubElement(case, kind, message=status).text = result.get("log", "")
+        suite.set("time", "%.3f" % seconds)
+        for key, value in counts.items():
+            suite.set(key, str(value))
+    if missing:
+        suite = ET.SubElement(root, "testsuite", name="oe-selftest-shards",
+                              tests=str(len(missing)), failures="0",
+                              errors=str(len(missing)), skipped="0", time="0.000")
+        for path in missing:
+            shard = os.path.basename(os.path.dirname(path))
+            case = ET.SubElement(suite, "testcase", classname="oe-selftest-shards",
+                                 name=shard, time="0.000")
+            ET.SubElement(case, "error", message="MISSING").text = \
+                f"{path} not found, see {shard}.log"
+            print(f"{shard}: {path} not found", file=sys.stderr)
+    ET.ElementTree(root).write(junit_path, encoding="utf-8", xml_declaration=True)
+
+    with open(durations_path + ".tmp", "w") as f:
+        json.dump(durations, f, indent=2, sort_keys=True)
+    os.replace(durations_path + ".tmp", durations_path)
+    return 1 if missing else 0
+
+
+def main():
+    if len(sys.argv) > 4 and sys.argv[1] == "plan":
+        plan(sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5:])
+    elif len(sys.argv) > 3 and sys.argv[1] == "merge":
+        return merge(sys.argv[2], sys.argv[3], sys.argv[4:])
+    else:
+        print(f"usage: {sys.argv[0]} plan CASES_DIR WORKERS DURATIONS TEST...\n"
+              f"       {sys.argv[0]} merge JUNIT DURATIONS RESULTS...", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,6 +18,19 @@
 #   MACHINE     Machine to use for selftest (default: rb3gen2-core-kit)
 #   SSTATE_DIR  Shared-state cache directory (passed to bitbake via local.conf)
 #   DL_DIR      Download directory (passed to bitbake via local.conf)
+#   OE_SELFTEST_WORKERS
+#               Number of parallel shards, a positive integer (default: 1).
+#               The test modules are split into their test classes, which
+#               are balanced over the shards by the durations of previous
+#               runs. Each shard runs in its own build directory, sharing
+#               SSTATE_DIR and DL_DIR.
+#   OE_SELFTEST_DURATIONS
+#               Test durations recorded by previous runs
+#               (default: WORK_DIR/oe-selftest-durations.json)
+#   OE_SELFTEST_RESULTS
+#               Directory receiving the shard logs, the oe-selftest JSON
+#               results and the merged JUnit report junit.xml
+#               (default: WORK_DIR/oe-selftest-results)
 
 if [ -z "$1" ] || [ -z "$2" ] ; then
     echo "The REPO_DIR or WORK_DIR is empty and it needs to point to the corresponding directories."
@@ -58,25 +71,90 @@ fi
 
 echo "Test modules to run: $TEST_CASES"
 
+WORKERS="${OE_SELFTEST_WORKERS:-1}"
+DURATIONS="${OE_SELFTEST_DURATIONS:-$WORK_DIR/oe-selftest-durations.json}"
+RESULTS_DIR="${OE_SELFTEST_RESULTS:-$WORK_DIR/oe-selftest-results}"
+SHARDS="$REPO_DIR/ci/oe-selftest-shards.py"
+
+case "$WORKERS" in
+    ''|*[!0-9]*|0*)
+        echo "OE_SELFTEST_WORKERS must be a positive integer, got '$WORKERS'."
+        exit 1
+        ;;
+esac
+
+rm -rf "$RESULTS_DIR"
+mkdir -p "$RESULTS_DIR"
+python3 "$SHARDS" plan "$REPO_DIR/lib/oeqa/selftest/cases" "$WORKERS" "$DURATIONS" \
+    $TEST_CASES > "$RESULTS_DIR/shards"
+
+# Split the bitbake threads between the shards
+THREADS=$(( $(nproc) / WORKERS ))
+[ "$THREADS" -ge 1 ] || THREADS=1
+
 # Create a temporary build directory (same pattern as yocto-check-layer.sh)
-BUILDDIR="$(mktemp -p "$WORK_DIR" -d -t build-oe-selftest-XXXX)"
-cd "$WORK_DIR/oe-core"
-. ./oe-init-build-env "$BUILDDIR"
+# and enter its build environment.
+setup_builddir(){
+    cd "$WORK_DIR/oe-core"
+    . ./oe-init-build-env "$1"
 
-# Add the meta-qcom layer
-bitbake-layers add-layer "$REPO_DIR"
+    # Add the meta-qcom layer
+    bitbake-layers add-layer "$REPO_DIR"
 
-# Configure for selftest
-cat >> conf/local.conf << EOF
+    # Configure for selftest
+    cat >> conf/local.conf << EOF
 MACHINE = "${MACHINE:-rb3gen2-core-kit}"
 EOF
 
-# Use shared sstate/download caches when available
-if [ -n "$SSTATE_DIR" ]; then
-    echo "SSTATE_DIR = \"$SSTATE_DIR\"" >> conf/local.conf
-fi
-if [ -n "$DL_DIR" ]; then
-    echo "DL_DIR = \"$DL_DIR\"" >> conf/local.conf
-fi
+    # Use shared sstate/download caches when available
+    if [ -n "$SSTATE_DIR" ]; then
+        echo "SSTATE_DIR = \"$SSTATE_DIR\"" >> conf/local.conf
+    fi
+    if [ -n "$DL_DIR" ]; then
+        echo "DL_DIR = \"$DL_DIR\"" >> conf/local.conf
+    fi
+    if [ "$WORKERS" -gt 1 ]; then
+        echo "BB_NUMBER_THREADS = \"$THREADS\"" >> conf/local.conf
+    fi
+}
+
+# Run the tests $2 in shard $1
+run_shard(){
+    (
+        setup_builddir "$(mktemp -p "$WORK_DIR" -d -t build-oe-selftest-XXXX)"
+        oe-selftest --json-result-dir "$RESULTS_DIR/shard-$1" --run-tests $2
+    ) > "$RESULTS_DIR/shard-$1.log" 2>&1
+}
+
+n=0
+pids=""
+while read -r tests; do
+    n=$((n + 1))
+    echo "Shard $n: $tests"
+    run_shard "$n" "$tests" &
+    pids="$pids $!"
+done < "$RESULTS_DIR/shards"
+
+status=0
+n=0
+for pid in $pids; do
+    n=$((n + 1))
+    if wait "$pid"; then
+        echo "Shard $n passed"
+    else
+        echo "Shard $n failed"
+        status=1
+    fi
+    cat "$RESULTS_DIR/shard-$n.log"
+done
 
-oe-selftest --run-tests "$TEST_CASES"
+# Pass the results of every shard, a shard without results is reported
+# as an error
+set --
+i=0
+while [ $i -lt $n ]; do
+    i=$((i + 1))
+    set -- "$@" "$RESULTS_DIR/shard-$i/testresults.json"
+done
+python3 "$SHARDS" merge "$RESULTS_DIR/junit.xml" "$DURATIONS" "$@" || status=1
+exit $status
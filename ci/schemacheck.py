@@ -1,33 +1,159 @@
 # Copyright (c) 2025 Qualcomm Innovation Center, Inc. All rights reserved.
 # SPDX-License-Identifier: MIT
+#
+# Validate the LAVA job definitions (*.yaml) found under a directory.
+#
+#   schemacheck.py [-j JOBS] [--cache FILE] [--json FILE] [--junit FILE] DIR
+#
+# Files are loaded with the C YAML loader when available and validated in
+# a process pool. With --cache, results are kept keyed by the sha256 of the
+# file content and by the version of the LAVA schemas, so only new or
+# changed jobs are validated again. The exit code is the number of invalid
+# files.
 
+import argparse
+import hashlib
+import json
 import os
 import sys
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
 import yaml
 import voluptuous
+import lava_common.schemas
 from lava_common.schemas import validate
 
-exitcode = 0
-
-for root, dirs, files in os.walk(sys.argv[1]):
-    for fname in files:
-        if fname.endswith(".yaml"):
-            filename = os.path.join(root, fname)
-
-            try:
-                f = open(filename, "rb")
-                y = yaml.safe_load(f)
-                f.close()
-                validate(y)
-                print(f"{filename} is valid")
-            except voluptuous.Invalid as e1:
-                print(f"{filename} is invalid")
-                print(e1.msg)
-                print(e1.path)
-                exitcode += 1
-            except yaml.error.MarkedYAMLError as e2:
-                print(f"{filename} is invalid")
-                print(e2.problem)
-                print(e2.problem_mark)
-                exitcode += 1
-sys.exit(exitcode)
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def schema_version():
+    """Return a digest of the lava_common.schemas sources."""
+    h = hashlib.sha256()
+    top = os.path.dirname(lava_common.schemas.__file__)
+    for root, dirs, files in os.walk(top):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith(".py"):
+                path = os.path.join(root, fname)
+                h.update(os.path.relpath(path, top).encode() + b"\0")
+                with open(path, "rb") as f:
+                    h.update(f.read())
+    return h.hexdigest()
+
+
+def find_jobs(top):
+    for root, dirs, files in os.walk(top):
+        for fname in files:
+            if fname.endswith(".yaml"):
+                yield os.path.join(root, fname)
+
+
+def check_file(filename):
+    """Validate one job, return (valid, messages, seconds)."""
+    start = time.monotonic()
+    try:
+        with open(filename, "rb") as f:
+            y = yaml.load(f, Loader=Loader)
+        validate(y)
+        return True, [], time.monotonic() - start
+    except voluptuous.Invalid as e1:
+        return False, [str(e1.msg), str(e1.path)], time.monotonic() - start
+    except yaml.error.MarkedYAMLError as e2:
+        return False, [str(e2.problem), str(e2.problem_mark)], time.monotonic() - start
+
+
+def load_cache(path, version):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if cache.get("schema") == version:
+            return cache["results"]
+    except (OSError, ValueError, KeyError):
+        pass
+    return {}
+
+
+def save_cache(path, version, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"schema": version, "results": results}, f, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def write_junit(path, reports, seconds):
+    failures = sum(1 for r in reports if not r["valid"])
+    suite = ET.Element("testsuite", name="schemacheck", tests=str(len(reports)),
+                       failures=str(failures), time="%.3f" % seconds)
+    for r in reports:
+        case = ET.SubElement(suite, "testcase", classname="schemacheck",
+                             name=r["file"], time="%.3f" % r["seconds"])
+        if not r["valid"]:
+            failure = ET.SubElement(case, "failure", message=r["messages"][0])
+            failure.text = "\n".join(r["messages"])
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate LAVA job definitions")
+    parser.add_argument("directory")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="number of validation processes")
+    parser.add_argument("--cache", help="file caching the results of unchanged jobs")
+    parser.add_argument("--json", help="write a JSON report to this file")
+    parser.add_argument("--junit", help="write a JUnit XML report to this file")
+    args = parser.parse_args()
+
+    start = time.monotonic()
+    version = schema_version()
+    cache = load_cache(args.cache, version) if args.cache else {}
+
+    jobs = []
+    for filename in find_jobs(args.directory):
+        with open(filename, "rb") as f:
+            jobs.append((filename, hashlib.sha256(f.read()).hexdigest()))
+
+    todo = [filename for filename, digest in jobs if digest not in cache]
+    results = {}
+    if todo:
+        workers = max(1, min(args.jobs, len(todo)))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(todo) // (workers * 4))
+            results = dict(zip(todo, pool.map(check_file, todo, chunksize=chunksize)))
+
+    exitcode = 0
+    reports = []
+    for filename, digest in jobs:
+        if filename in results:
+            valid, messages, seconds = results[filename]
+            cache[digest] = {"valid": valid, "messages": messages}
+            cached = False
+        else:
+            valid, messages, seconds = cache[digest]["valid"], cache[digest]["messages"], 0.0
+            cached = True
+        if valid:
+            print(f"{filename} is valid")
+        else:
+            print(f"{filename} is invalid")
+            for message in messages:
+                print(message)
+            exitcode += 1
+        reports.append({"file": filename, "valid": valid, "cached": cached,
+                        "seconds": seconds, "messages": messages})
+
+    if args.cache:
+        # Drop the results of jobs that no longer exist
+        save_cache(args.cache, version, {digest: cache[digest] for _, digest in jobs})
+
+    seconds = time.monotonic() - start
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"schema": version, "seconds": seconds, "files": reports}, f, indent=2)
+    if args.junit:
+        write_junit(args.junit, reports, seconds)
+    return exitcode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,6 +10,8 @@
 # the right device tree at runtime.
 #
 
+import hashlib
+import json
 import os
 import re
 import shutil
@@ -21,10 +23,10 @@ from oeqa.utils.commands import runCmd, bitbake, get_bb_vars
 class QcomFitImageTests(OESelftestTestCase):
     """Unit tests for the QCOM DTB-only FIT image generator.
 
-    Each test instantiates QcomItsNodeRoot directly, replicates the
-    overlay-group processing from dtb-fit-image.bbclass, writes an ITS
-    file, parses it back and asserts structural invariants that the UEFI
-    firmware relies on.
+    Each test instantiates QcomItsNodeRoot directly, resolves the
+    FIT_DTB_COMPATIBLE map with the same FitCompatIndex used by
+    dtb-fit-image.bbclass, writes an ITS file, parses it back and asserts
+    structural invariants that the UEFI firmware relies on.
     """
 
     # Valid metadata suffixes extracted from qcom-metadata.dts.
@@ -71,8 +73,10 @@ class QcomFitImageTests(OESelftestTestCase):
         os.makedirs(d, exist_ok=True)
         return d
 
-    def _build_qcom_fitimage(self, kernel_devicetree, fit_dtb_compatible):
-        """Replicate dtb-fit-image.bbclass logic and produce an ITS file.
+    def _build_qcom_fitimage(self, kernel_devicetree, fit_dtb_compatible,
+                             fit_name=None, mkimage_extra_opts=None,
+                             timestamp=None):
+        """Run the dtb-fit-image.bbclass logic and produce an ITS file.
 
         Args:
             kernel_devicetree: Space-separated DTB/DTBO filenames
@@ -81,6 +85,12 @@ class QcomFitImageTests(OESelftestTestCase):
                 (commas replaced with underscores, e.g. ``"qcom_board-iot"``)
                 to DTB+overlay combo strings (e.g. ``"board"`` or
                 ``"board overlay"``). (the FIT_DTB_COMPATIBLE flags)
+            fit_name: When set, also assemble the FIT blob in-process
+                (FIT_DTB_ASSEMBLER = "python") into this file next to
+                the ITS.
+            mkimage_extra_opts: FIT_DTB_MKIMAGE_EXTRA_OPTS for the
+                in-process writer.
+            timestamp: FIT timestamp for the in-process writer.
 
         Returns:
             (its_path, parsed) where *parsed* is the dict returned by
@@ -89,6 +99,7 @@ class QcomFitImageTests(OESelftestTestCase):
         # Lazy import: layer lib paths are only on sys.path after
         # _add_layer_libs() which runs *after* test module discovery.
         from qcom.dtb_only_fitimage import QcomItsNodeRoot
+        from qcom.fit_compat import FitCompatIndex, dt_id
 
         test_dir = self._get_test_dir()
         dtb_dir = os.path.join(test_dir, 'dtbs')
@@ -107,56 +118,29 @@ class QcomFitImageTests(OESelftestTestCase):
             "qcom-metadata.dtb", meta_path,
             compatible_str=None, dtb_type="qcom_metadata")
 
-        # ---- replicate bbclass overlay-group parsing ----
-        files_set = {os.path.basename(x)
-                     for x in kernel_devicetree.split()}
-        dtb_keys_list = {os.path.splitext(f)[0].replace(',', '_')
-                         for f in files_set}
-
-        base_compats = {}   # base_dtb_id -> space-separated compat string(s)
-        overlay_groups = {}
-        overlay_compats = {}
-        seen_combos = set()  # track overlay combos already added to overlay_groups
-        for encoded_key, combo_val in fit_dtb_compatible.items():
-            compat_str = encoded_key.replace('_', ',')
-            parts = [os.path.basename(p) for p in combo_val.split()]
-            if not parts:
-                continue
-            if not all(dtb in dtb_keys_list for dtb in parts):
-                continue
-            base = parts[0] + ".dtb"
-            base_dtb_id = base.replace(',', '_')
-            overlays = [ovl + ".dtbo" for ovl in parts[1:]]
-            if overlays:
-                # Mirror the bbclass: encode commas so combo_key/overlay_groups
-                # keys match the lookup_key in fitimage_emit_section_qcomconfig.
-                combo_key = " ".join(p.replace(',', '_') for p in parts)
-                if combo_key not in seen_combos:
-                    overlay_groups.setdefault(base_dtb_id, []).append(overlays)
-                    seen_combos.add(combo_key)
-                existing = overlay_compats.get(combo_key, "")
-                overlay_compats[combo_key] = (existing + " " + compat_str).strip()
-            else:
-                existing = base_compats.get(base_dtb_id, "")
-                base_compats[base_dtb_id] = (existing + " " + compat_str).strip()
+        compat_index = FitCompatIndex(
+            kernel_devicetree.split(), fit_dtb_compatible)
 
         # ---- emit image nodes (sorted for deterministic output) ----
-        for fname in sorted(files_set):
+        for fname in sorted(compat_index.files):
             fpath = os.path.join(dtb_dir, fname)
             self._create_dummy_file(fpath)
-            dtb_id = fname.replace(',', '_')
+            dtb_id = dt_id(fname)
             compatible = ""
             if fname.endswith(".dtb"):
-                compatible = base_compats.get(dtb_id, "")
+                compatible = " ".join(compat_index.base_compatibles(dtb_id))
             root_node.fitimage_emit_section_dtb(
                 dtb_id, fpath,
                 compatible_str=compatible, dtb_type="flat_dt")
 
         # ---- emit configuration nodes ----
-        root_node.fitimage_emit_section_qcomconfig(
-            overlay_groups, overlay_compats)
+        root_node.fitimage_emit_section_qcomconfig(compat_index)
 
         root_node.write_its_file(its_path)
+        if fit_name:
+            root_node.set_extra_opts(mkimage_extra_opts)
+            root_node.write_fit_file(its_path, os.path.join(test_dir, fit_name),
+                                     timestamp=timestamp)
         parsed = self._parse_its_file(its_path)
         return its_path, parsed
 
@@ -512,6 +496,23 @@ class QcomFitImageTests(OESelftestTestCase):
         self._assert_fdt_linkage(p)
         self._assert_metadata_excluded_from_configs(p)
 
+    def test_reference_cases(self):
+        """Configurations of the cases shared with the plain pytest tier."""
+        from qcom.tests.fitimage_cases import CASES
+
+        for name, (dtbs, compats, expected) in CASES.items():
+            with self.subTest(case=name):
+                _, p = self._build_qcom_fitimage(dtbs, compats)
+                configs = []
+                for conf in p['configurations'].values():
+                    fdt = conf['fdt']
+                    configs.append((conf['compatible'],
+                                    tuple(fdt) if isinstance(fdt, list) else (fdt,)))
+                self.assertEqual(configs, expected)
+                self.assertEqual(len(p['images']), 1 + len(dtbs.split()))
+                self._assert_fdt_linkage(p)
+                self._assert_metadata_excluded_from_configs(p)
+
     def test_mkimage_compile(self):
         """Compile the ITS with mkimage and verify with dumpimage."""
         its_path, p = self._build_qcom_fitimage(
@@ -559,6 +560,50 @@ class QcomFitImageTests(OESelftestTestCase):
         self.assertGreaterEqual(conf_count, 2,
             "Expected at least 2 configuration entries in dumpimage output")
 
+    def test_python_assemble_matches_mkimage(self):
+        """In-process FIT writer output is byte-identical to mkimage's."""
+        timestamp = 1700000000
+        test_dtbs = ("boardA.dtb boardA-cam.dtbo boardA-el2.dtbo "
+                     "boardB.dtb boardB-cam.dtbo")
+        test_compats = {
+            "qcom_boardA-iot": "boardA",
+            "qcom_boardA-idp": "boardA",
+            "qcom_boardA-iot-subtype2": "boardA boardA-cam",
+            "qcom_boardA-iot-camx-el2kvm": "boardA boardA-cam boardA-el2",
+            "qcom_boardB-iot": "boardB",
+            "qcom_boardB-iot-subtype2": "boardB boardB-cam",
+        }
+
+        bitbake("u-boot-tools-native dtc-native -c addto_recipe_sysroot")
+        uboot_vars = get_bb_vars(
+            ['RECIPE_SYSROOT_NATIVE', 'bindir'], 'u-boot-tools-native')
+        mkimage = os.path.join(
+            uboot_vars['RECIPE_SYSROOT_NATIVE'], uboot_vars['bindir'], 'mkimage')
+        dtc_vars = get_bb_vars(
+            ['RECIPE_SYSROOT_NATIVE', 'bindir'], 'dtc-native')
+
+        for opts in ("-E -B 8", "-E"):
+            with self.subTest(opts=opts):
+                its_path, _ = self._build_qcom_fitimage(
+                    test_dtbs, test_compats,
+                    fit_name='python.bin', mkimage_extra_opts=opts,
+                    timestamp=timestamp)
+                py_fit = its_path.replace('qclinux-fit-image.its', 'python.bin')
+                mk_fit = its_path.replace('qclinux-fit-image.its', 'mkimage.bin')
+
+                runCmd(f"SOURCE_DATE_EPOCH={timestamp} {mkimage} {opts} "
+                       f"-f {its_path} {mk_fit}",
+                       native_sysroot=dtc_vars['RECIPE_SYSROOT_NATIVE'])
+
+                with open(mk_fit, 'rb') as f:
+                    mk_data = f.read()
+                with open(py_fit, 'rb') as f:
+                    py_data = f.read()
+                self.assertEqual(len(py_data), len(mk_data),
+                    "In-process FIT size differs from mkimage output")
+                self.assertEqual(py_data, mk_data,
+                    "In-process FIT differs from mkimage output")
+
 
 class QcomFitImageIntegrationTests(OESelftestTestCase):
     """Integration tests that build a real FIT image from the kernel recipe.
@@ -841,7 +886,11 @@ class QcomFitImageMatrixTests(OESelftestTestCase):
     """Matrix tests validating DTB/FIT coverage across machines/providers.
 
     These tests avoid full image builds by using bitbake metadata expansion
-    (bitbake -e via get_bb_vars) plus kernel source unpack. This validates:
+    plus an index of the DTS/DTSO files in the kernel git mirrors. The
+    kernel recipes of every MACHINE/provider pair are expanded in a single
+    tinfoil session (one multiconfig per MACHINE, recipe parsing restricted
+    to the kernel recipes) and the result is cached on disk, keyed by the
+    revisions of the configured layers. This validates:
       - KERNEL_DEVICETREE values resolve for each MACHINE/provider pair
       - DTBs/DTBOs declared by machine metadata exist in kernel source trees
       - LINUX_QCOM_KERNEL_DEVICETREE entries are present in qcom kernels
@@ -851,23 +900,32 @@ class QcomFitImageMatrixTests(OESelftestTestCase):
     KERNEL_PROVIDER_YOCTO = "linux-yocto"
     KERNEL_PROVIDERS_QCOM = ("linux-qcom-next", "linux-qcom")
 
+    # Prefix of the multiconfigs used to expand each MACHINE
+    MC_PREFIX = "qcomfit-"
+
+    # Only the kernel recipes are parsed by the resolver
+    KERNEL_RECIPES_BBMASK = r"/(?!linux-(yocto|qcom)[^/]*$)[^/]+\.bb(append)?$"
+
     _provider_outputs_cache = {}
-    _provider_machine_cache = {}
-    _available_providers_cache = None
     _matrix_cache = None
-    _layer_dir_cache = None
+    _resolved_cache = None
+    _config_vars_cache = None
+
+    @classmethod
+    def _config_vars(cls):
+        """Return the configuration variables used by the resolver."""
+        if cls._config_vars_cache is None:
+            cls._config_vars_cache = get_bb_vars(
+                ["LAYERDIR_qcom", "BBLAYERS", "DL_DIR", "PERSISTENT_DIR", "TOPDIR"])
+        return cls._config_vars_cache
 
     @classmethod
     def _layer_dir(cls):
         """Return the meta-qcom layer directory using LAYERDIR_qcom from bitbake."""
-        if cls._layer_dir_cache is not None:
-            return cls._layer_dir_cache
-        bb_vars = get_bb_vars(["LAYERDIR_qcom"], "virtual/kernel")
-        layerdir = bb_vars.get("LAYERDIR_qcom")
+        layerdir = cls._config_vars().get("LAYERDIR_qcom")
         if not layerdir:
             raise AssertionError("LAYERDIR_qcom is not defined")
-        cls._layer_dir_cache = layerdir
-        return cls._layer_dir_cache
+        return layerdir
 
     @staticmethod
     def _dt_files(var_value):
@@ -939,6 +997,9 @@ class QcomFitImageMatrixTests(OESelftestTestCase):
                     return True
         return False
 
+    # Kernel source directories holding DTS/DTSO files
+    DTS_DIRS = ("arch/arm64/boot/dts", "arch/arm/boot/dts")
+
     def _provider_output_files(self, provider):
         """Return set of DTB/DTBO output filenames available in provider source."""
         if provider in self.__class__._provider_outputs_cache:
@@ -947,88 +1008,200 @@ class QcomFitImageMatrixTests(OESelftestTestCase):
         machine = self._provider_machine(provider)
         self.assertIsNotNone(machine,
             f"Could not find a MACHINE compatible with provider {provider}")
-        postconfig = '\n'.join([
-            f'MACHINE = "{machine}"',
-            f'PREFERRED_PROVIDER_virtual/kernel = "{provider}"',
-        ])
-
-        # Lightweight: unpack kernel source once (no compile/image build).
-        bitbake("virtual/kernel -c unpack", postconfig=postconfig)
-        bb_vars = get_bb_vars(["S"], "virtual/kernel", postconfig=postconfig)
-        src_dir = bb_vars.get("S") or ""
-        self.assertTrue(src_dir and os.path.isdir(src_dir),
-            f"Could not resolve source directory (S) for {provider}")
-
-        # Search in architecture-specific directories for DTS/DTSO files.
-        arch_paths = (
-            os.path.join(src_dir, "arch", "arm64", "boot", "dts"),
-            os.path.join(src_dir, "arch", "arm", "boot", "dts"),
-        )
+        sources = self._resolved()[machine][provider]["git"]
+        self.assertTrue(sources, f"No git repository in SRC_URI of {provider}")
 
         outputs = set()
-        for dts_dir in arch_paths:
-            if not os.path.isdir(dts_dir):
-                continue
-            for _, _, files in os.walk(dts_dir):
-                for fname in files:
-                    if fname.endswith(".dts"):
-                        outputs.add(os.path.splitext(fname)[0] + ".dtb")
-                    elif fname.endswith(".dtso"):
-                        outputs.add(os.path.splitext(fname)[0] + ".dtbo")
+        for mirror, rev in sources:
+            outputs |= self._dt_index(mirror, rev, machine, provider)
 
         self.__class__._provider_outputs_cache[provider] = outputs
         return outputs
 
-    def _provider_machine(self, provider):
-        if provider in self.__class__._provider_machine_cache:
-            return self.__class__._provider_machine_cache[provider]
+    def _dt_index(self, mirror, rev, machine, provider):
+        """Return the DTB/DTBO outputs of the DTS/DTSO files in revision *rev*
+        of the git mirror *mirror* (relative to DL_DIR).
 
-        for machine in self._machine_list():
-            try:
-                self._resolve_machine_provider(machine, provider)
-                self.__class__._provider_machine_cache[provider] = machine
-                return machine
-            except AssertionError:
+        The names are listed from the mirror objects, without a checkout,
+        and the index is kept in DL_DIR per mirror and revision, so it is
+        shared by test runs and build directories using the same DL_DIR.
+        """
+        dl_dir = self._config_vars()["DL_DIR"]
+        index_file = os.path.join(dl_dir, "qcom-dts-index",
+                                  f"{os.path.basename(mirror)}-{rev}.json")
+        try:
+            with open(index_file) as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+        clonedir = os.path.join(dl_dir, mirror)
+        has_rev = os.path.isdir(clonedir) and runCmd(
+            f"git --git-dir={clonedir} cat-file -e {rev}^{{commit}}",
+            ignore_status=True, assert_error=False).status == 0
+        if not has_rev:
+            postconfig = '\n'.join([
+                f'MACHINE = "{machine}"',
+                f'PREFERRED_PROVIDER_virtual/kernel = "{provider}"',
+            ])
+            bitbake("virtual/kernel -c fetch", postconfig=postconfig)
+        self.assertTrue(os.path.isdir(clonedir),
+            f"Git mirror {clonedir} of {provider} not found after do_fetch")
+
+        result = runCmd(f"git --git-dir={clonedir} ls-tree -r --name-only {rev} -- "
+                        + " ".join(self.DTS_DIRS))
+        outputs = set()
+        for path in result.output.splitlines():
+            fname = os.path.basename(path)
+            if fname.endswith(".dts"):
+                outputs.add(os.path.splitext(fname)[0] + ".dtb")
+            elif fname.endswith(".dtso"):
+                outputs.add(os.path.splitext(fname)[0] + ".dtbo")
+
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        with open(index_file + ".tmp", "w") as f:
+            json.dump(sorted(outputs), f)
+        os.replace(index_file + ".tmp", index_file)
+        return outputs
+
+    @staticmethod
+    def _git_sources(rd):
+        """Return [mirror, revision] of the git repositories in SRC_URI,
+        the mirror relative to DL_DIR."""
+        import bb.fetch2
+
+        src_uri = (rd.getVar("SRC_URI") or "").split()
+        fetcher = bb.fetch2.Fetch(src_uri, rd)
+        sources = []
+        for url in src_uri:
+            ud = fetcher.ud[url]
+            if ud.type not in ("git", "gitsm"):
                 continue
+            rev = getattr(ud, "revision", None) or ud.revisions[ud.names[0]]
+            sources.append([os.path.relpath(ud.clonedir, rd.getVar("DL_DIR")), rev])
+        return sources
+
+    def _providers(self):
+        return (self.KERNEL_PROVIDER_YOCTO,) + self.KERNEL_PROVIDERS_QCOM
+
+    def _resolver_key(self):
+        """Return the cache key of the resolved matrix: the machines, the
+        providers and the revision (and local changes) of every layer."""
+        h = hashlib.sha256()
+        h.update(json.dumps([self._machine_list(), self._providers()]).encode())
+        for layer in sorted((self._config_vars().get("BBLAYERS") or "").split()):
+            h.update(layer.encode() + b"\0")
+            for args in ("rev-parse HEAD", "status --porcelain", "diff HEAD"):
+                result = runCmd(f"git -C {layer} {args}", ignore_status=True,
+                                assert_error=False)
+                h.update(result.output.encode() + b"\0")
+        return h.hexdigest()
+
+    def _resolver_cache_file(self):
+        """Return the on-disk cache of the resolved matrix.
+
+        QCOM_FIT_MATRIX_CACHE in the environment overrides the default
+        location, e.g. to keep it across oe-selftest build directories.
+        """
+        return os.environ.get("QCOM_FIT_MATRIX_CACHE") or os.path.join(
+            self._config_vars()["PERSISTENT_DIR"], "qcom-fit-matrix.json")
+
+    def _resolve_all(self, machines, providers):
+        """Expand the kernel recipe of every MACHINE/provider pair.
+
+        Returns {machine: {provider: {"dt_files": [...], "extra_files": [...],
+        "git": [[mirror, revision], ...]}}}, leaving out the pairs the
+        provider is not compatible with.
+        """
+        import bb.providers
+        import bb.tinfoil
+
+        topdir = self._config_vars()["TOPDIR"]
+        mcdir = os.path.join(topdir, "conf", "multiconfig")
+        os.makedirs(mcdir, exist_ok=True)
+        mcs = {}
+        for machine in machines:
+            mc = self.MC_PREFIX + machine
+            mcs[mc] = machine
+            with open(os.path.join(mcdir, f"{mc}.conf"), "w") as f:
+                f.write(f'MACHINE = "{machine}"\n')
+        postconfig = os.path.join(topdir, "conf", "qcomfit-matrix.conf")
+        with open(postconfig, "w") as f:
+            f.write(f'BBMULTICONFIG += "{" ".join(mcs)}"\n')
+            f.write(f'BBMASK += "{self.KERNEL_RECIPES_BBMASK}"\n')
+            f.write('BB_DANGLINGAPPENDS_WARNONLY = "1"\n')
+
+        resolved = {}
+        try:
+            with bb.tinfoil.Tinfoil() as tinfoil:
+                tinfoil.prepare(config_only=False, config_params=bb.tinfoil.TinfoilConfigParameters(
+                    config_only=False, postfile=[postconfig], quiet=2))
+                for mc, machine in mcs.items():
+                    resolved[machine] = {}
+                    for provider in providers:
+                        try:
+                            rd = tinfoil.parse_recipe(f"mc:{mc}:{provider}")
+                        except bb.providers.NoProvider:
+                            continue
+                        resolved[machine][provider] = {
+                            "dt_files": sorted(self._dt_files(
+                                rd.getVar("KERNEL_DEVICETREE"))),
+                            "extra_files": sorted(self._dt_files(
+                                rd.getVar("LINUX_QCOM_KERNEL_DEVICETREE"))),
+                            "git": self._git_sources(rd),
+                        }
+        finally:
+            os.unlink(postconfig)
+            for mc in mcs:
+                os.unlink(os.path.join(mcdir, f"{mc}.conf"))
+        return resolved
+
+    def _resolved(self):
+        """Return the resolved matrix, from the on-disk cache when the
+        layers did not change since it was written."""
+        if self.__class__._resolved_cache is not None:
+            return self.__class__._resolved_cache
+
+        key = self._resolver_key()
+        cache_file = self._resolver_cache_file()
+        try:
+            with open(cache_file) as f:
+                cached = json.load(f)
+            if cached.get("key") == key:
+                self.__class__._resolved_cache = cached["resolved"]
+                return cached["resolved"]
+        except (OSError, ValueError):
+            pass
+
+        resolved = self._resolve_all(self._machine_list(), self._providers())
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump({"key": key, "resolved": resolved}, f, indent=2, sort_keys=True)
+        os.replace(cache_file + ".tmp", cache_file)
+        self.__class__._resolved_cache = resolved
+        return resolved
 
-        self.__class__._provider_machine_cache[provider] = None
+    def _provider_machine(self, provider):
+        """Return the first MACHINE the provider is compatible with."""
+        for machine in self._machine_list():
+            if provider in self._resolved().get(machine, {}):
+                return machine
         return None
 
     def _available_providers(self):
-        if self.__class__._available_providers_cache is not None:
-            return self.__class__._available_providers_cache
-
-        providers = []
-        for provider in (self.KERNEL_PROVIDER_YOCTO,) + self.KERNEL_PROVIDERS_QCOM:
-            result = runCmd(
-                f"bitbake-layers show-recipes {provider}",
-                ignore_status=True,
-                assert_error=False,
-            )
-            if f"{provider}:" in result.output:
-                providers.append(provider)
-
-        self.__class__._available_providers_cache = providers
-        return providers
+        return [p for p in self._providers() if self._provider_machine(p)]
 
     def _resolve_machine_provider(self, machine, provider):
-        postconfig = '\n'.join([
-            f'MACHINE = "{machine}"',
-            f'PREFERRED_PROVIDER_virtual/kernel = "{provider}"',
-        ])
-        bb_vars = get_bb_vars(
-            ["KERNEL_DEVICETREE", "LINUX_QCOM_KERNEL_DEVICETREE"],
-            "virtual/kernel",
-            postconfig=postconfig,
-        )
-        dt_files = self._dt_files(bb_vars.get("KERNEL_DEVICETREE"))
-        extra_files = self._dt_files(bb_vars.get("LINUX_QCOM_KERNEL_DEVICETREE"))
+        entry = self._resolved().get(machine, {}).get(provider)
+        if entry is None:
+            raise AssertionError(f"{provider} does not provide virtual/kernel for {machine}")
+        dt_files = set(entry["dt_files"])
         return {
             "machine": machine,
             "provider": provider,
             "dt_files": dt_files,
             "dt_keys": self._dt_keys_from_files(dt_files),
-            "extra_files": extra_files,
+            "extra_files": set(entry["extra_files"]),
         }
 
     def _resolve_qcom_provider(self, machine):
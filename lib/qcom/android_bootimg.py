@@ -0,0 +1,185 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains an in-process writer for Android boot images with
+# header version 0 or 1, as produced by the skales/AOSP mkbootimg tool:
+#
+#   header page | kernel pages | ramdisk pages
+#
+# Each section is made of segments (source files or in-memory data) that
+# are streamed into the image, so a kernel with an appended DTB never needs
+# to exist as a file of its own. The image id is the SHA-1 mkbootimg
+# computes over every section followed by its size. Since many images
+# share the same kernel, the hash state after each segment can be memoized
+# in a DigestCache shared between images.
+
+import hashlib
+import os
+import struct
+import threading
+from typing import Optional, Sequence, Union
+
+from qcom.file_copy import append_file
+
+BOOT_MAGIC = b'ANDROID!'
+BOOT_NAME_SIZE = 16
+BOOT_ARGS_SIZE = 512
+BOOT_EXTRA_ARGS_SIZE = 1024
+BOOT_IMAGE_HEADER_V1_SIZE = 1648
+
+# mkbootimg defaults, relative to --base
+KERNEL_OFFSET = 0x00008000
+RAMDISK_OFFSET = 0x01000000
+SECOND_OFFSET = 0x00f00000
+TAGS_OFFSET = 0x00000100
+
+PAGE_SIZES = (2048, 4096, 8192, 16384)
+
+Segment = Union[str, bytes]
+
+
+def _segment_size(segment):
+    if isinstance(segment, bytes):
+        return len(segment)
+    return os.path.getsize(segment)
+
+
+def _segment_key(segment):
+    if isinstance(segment, bytes):
+        return ('data', hashlib.sha1(segment).hexdigest())
+    return ('file', os.path.realpath(segment))
+
+
+def _hash_segment(sha, segment):
+    if isinstance(segment, bytes):
+        sha.update(segment)
+        return
+    with open(segment, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+
+
+class DigestCache:
+    """Thread-safe memo of the image id SHA-1 state after section prefixes.
+
+    Each prefix is hashed once; concurrent writers needing the same prefix
+    wait for it instead of hashing the shared kernel image in parallel.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}      # prefix key -> [lock, sha1 state]
+
+    def extend(self, key, sha, segment):
+        """Return a copy of *sha* extended with *segment*, memoized by *key*."""
+        with self._lock:
+            entry = self._entries.setdefault(key, [threading.Lock(), None])
+        with entry[0]:
+            if entry[1] is None:
+                state = sha.copy()
+                _hash_segment(state, segment)
+                entry[1] = state
+            return entry[1].copy()
+
+
+class _Hasher:
+    """SHA-1 over the image sections, optionally reusing a DigestCache."""
+
+    def __init__(self, cache):
+        self._cache = cache
+        self._sha = hashlib.sha1()
+        self._key = ()
+
+    def update_segment(self, segment):
+        self._key += (_segment_key(segment),)
+        if self._cache is None:
+            _hash_segment(self._sha, segment)
+        else:
+            self._sha = self._cache.extend(self._key, self._sha, segment)
+
+    def update_size(self, size):
+        self._key += (('size', size),)
+        self._sha.update(struct.pack('<I', size))
+
+    def digest(self):
+        return self._sha.digest()
+
+
+def _pad(f, pagesize):
+    pad = -f.tell() % pagesize
+    if pad:
+        f.write(b'\0' * pad)
+
+
+def write_boot_image(path, kernel: Sequence[Segment], ramdisk: Sequence[Segment],
+                     cmdline="", pagesize=2048, base=0x10000000, board="",
+                     header_version=0, digest_cache: Optional[DigestCache] = None):
+    """Write an Android boot image (header version 0 or 1) to *path*.
+
+    Args:
+        path: Output image path.
+        kernel: Segments making up the kernel section, e.g. the kernel
+            image followed by the appended DTB. A segment is either a file
+            path or bytes.
+        ramdisk: Segments making up the ramdisk section.
+        cmdline: Kernel command line, split across the cmdline and
+            extra_cmdline header fields like mkbootimg does.
+        pagesize: Flash page size (QCOM_BOOTIMG_PAGE_SIZE).
+        base: Base address the load addresses are relative to
+            (QCOM_BOOTIMG_KERNEL_BASE).
+        board: Product name stored in the header.
+        header_version: 0 or 1.
+        digest_cache: Optional DigestCache shared between calls, so common
+            section prefixes such as the kernel image are hashed once.
+
+    Returns:
+        The 20-byte image id.
+    """
+    if pagesize not in PAGE_SIZES:
+        raise ValueError(f"Unsupported boot image page size {pagesize}")
+    if header_version not in (0, 1):
+        raise ValueError(f"Unsupported boot image header version {header_version}")
+    cmdline = cmdline.encode()
+    if len(cmdline) > BOOT_ARGS_SIZE + BOOT_EXTRA_ARGS_SIZE - 1:
+        raise ValueError(f"Kernel command line too long ({len(cmdline)} bytes)")
+    board = board.encode()
+    if len(board) > BOOT_NAME_SIZE - 1:
+        raise ValueError(f"Board name '{board.decode()}' too long")
+
+    sections = [list(kernel), list(ramdisk)]
+    sizes = [sum(_segment_size(s) for s in section) for section in sections]
+
+    hasher = _Hasher(digest_cache)
+    for section, size in zip(sections, sizes):
+        for segment in section:
+            hasher.update_segment(segment)
+        hasher.update_size(size)
+    # Empty second stage, and recovery DTBO for version 1
+    hasher.update_size(0)
+    if header_version > 0:
+        hasher.update_size(0)
+    img_id = hasher.digest()
+
+    header = struct.pack('<8s10I16s512s32s1024s', BOOT_MAGIC,
+                         sizes[0], base + KERNEL_OFFSET,
+                         sizes[1], base + RAMDISK_OFFSET,
+                         0, base + SECOND_OFFSET,
+                         base + TAGS_OFFSET, pagesize, header_version, 0,
+                         board, cmdline[:BOOT_ARGS_SIZE], img_id,
+                         cmdline[BOOT_ARGS_SIZE:])
+    if header_version > 0:
+        # recovery_dtbo_size, recovery_dtbo_offset, header_size
+        header += struct.pack('<IQI', 0, 0, BOOT_IMAGE_HEADER_V1_SIZE)
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        _pad(f, pagesize)
+        for section in sections:
+            for segment in section:
+                if isinstance(segment, bytes):
+                    f.write(segment)
+                else:
+                    append_file(f, segment)
+            _pad(f, pagesize)
+    return img_id
@@ -0,0 +1,181 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains a converter from raw partition images to the Android
+# sparse image format understood by qdl (program entries with
+# sparse="true") and fastboot, equivalent to img2simg:
+#
+#   - holes of the raw image become DONT_CARE chunks, never transferred
+#   - blocks repeating a single 32-bit value become FILL chunks
+#   - everything else is stored in RAW chunks
+#
+# Only the data extents of the source are read, so converting a mostly
+# empty rootfs image costs as much as its used blocks.
+
+import os
+import re
+import struct
+from typing import NamedTuple
+
+from qcom.file_copy import data_extents
+
+SPARSE_HEADER_MAGIC = 0xed26ff3a
+SPARSE_MAJOR_VERSION = 1
+SPARSE_MINOR_VERSION = 0
+
+CHUNK_TYPE_RAW = 0xcac1
+CHUNK_TYPE_FILL = 0xcac2
+CHUNK_TYPE_DONT_CARE = 0xcac3
+
+_FILE_HEADER = struct.Struct('<IHHHHIIII')
+_CHUNK_HEADER = struct.Struct('<HHII')
+
+# Largest RAW chunk written at once, in bytes
+_MAX_RAW_CHUNK = 64 * 1024 * 1024
+
+
+class SparseStats(NamedTuple):
+    blocks: int
+    raw_blocks: int
+    fill_blocks: int
+    dont_care_blocks: int
+    size: int
+
+    @property
+    def dont_care_ratio(self):
+        return self.dont_care_blocks / self.blocks if self.blocks else 0.0
+
+
+class _SparseWriter:
+    def __init__(self, f, block_size):
+        self._f = f
+        self._block_size = block_size
+        self.chunks = 0
+        self.counts = {CHUNK_TYPE_RAW: 0, CHUNK_TYPE_FILL: 0, CHUNK_TYPE_DONT_CARE: 0}
+        self._raw = bytearray()
+        self._fill = None       # (value, blocks)
+
+    def _chunk(self, chunk_type, blocks, payload=b''):
+        self._f.write(_CHUNK_HEADER.pack(chunk_type, 0, blocks,
+                                         _CHUNK_HEADER.size + len(payload)))
+        self._f.write(payload)
+        self.chunks += 1
+        self.counts[chunk_type] += blocks
+
+    def _flush_raw(self):
+        if self._raw:
+            self._chunk(CHUNK_TYPE_RAW, len(self._raw) // self._block_size, self._raw)
+            self._raw = bytearray()
+
+    def _flush_fill(self):
+        if self._fill:
+            value, blocks = self._fill
+            self._chunk(CHUNK_TYPE_FILL, blocks, value)
+            self._fill = None
+
+    def raw(self, block):
+        self._flush_fill()
+        self._raw += block
+        if len(self._raw) >= _MAX_RAW_CHUNK:
+            self._flush_raw()
+
+    def fill(self, value):
+        self._flush_raw()
+        if self._fill and self._fill[0] == value:
+            self._fill = (value, self._fill[1] + 1)
+            return
+        self._flush_fill()
+        self._fill = (value, 1)
+
+    def dont_care(self, blocks):
+        self._flush_raw()
+        self._flush_fill()
+        if blocks:
+            self._chunk(CHUNK_TYPE_DONT_CARE, blocks)
+
+    def close(self):
+        self._flush_raw()
+        self._flush_fill()
+
+
+def _data_blocks(fd, size, block_size):
+    """Return merged [(first block, block count)] covering the data extents."""
+    ranges = []
+    for offset, length in data_extents(fd, size):
+        first = offset // block_size
+        end = -(-(offset + length) // block_size)
+        if ranges and first <= sum(ranges[-1]):
+            prev_first, _ = ranges[-1]
+            ranges[-1] = (prev_first, max(end, sum(ranges[-1])) - prev_first)
+        else:
+            ranges.append((first, end - first))
+    return ranges
+
+
+def write_sparse_image(src, dst, block_size=4096) -> SparseStats:
+    """Convert the raw image *src* into the Android sparse image *dst*.
+
+    A trailing partial block is padded with zeros.
+    """
+    if block_size % 4:
+        raise ValueError(f"Invalid sparse block size {block_size}")
+
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        size = os.fstat(fin.fileno()).st_size
+        total = -(-size // block_size)
+        fout.write(b'\0' * _FILE_HEADER.size)
+        writer = _SparseWriter(fout, block_size)
+
+        # Read the data extents a batch of blocks at a time
+        batch = max(1, (1024 * 1024) // block_size)
+        next_block = 0
+        for first, count in _data_blocks(fin.fileno(), size, block_size):
+            writer.dont_care(first - next_block)
+            for blk in range(first, first + count, batch):
+                n = min(batch, first + count - blk)
+                data = os.pread(fin.fileno(), n * block_size, blk * block_size)
+                data += b'\0' * (n * block_size - len(data))
+                for off in range(0, len(data), block_size):
+                    block = data[off:off + block_size]
+                    value = block[:4]
+                    if block == value * (block_size // 4):
+                        writer.fill(value)
+                    else:
+                        writer.raw(block)
+            next_block = first + count
+        writer.dont_care(total - next_block)
+        writer.close()
+
+        fout.seek(0)
+        fout.write(_FILE_HEADER.pack(SPARSE_HEADER_MAGIC, SPARSE_MAJOR_VERSION,
+                                     SPARSE_MINOR_VERSION, _FILE_HEADER.size,
+                                     _CHUNK_HEADER.size, block_size, total,
+                                     writer.chunks, 0))
+        fout.seek(0, os.SEEK_END)
+        return SparseStats(total, writer.counts[CHUNK_TYPE_RAW],
+                           writer.counts[CHUNK_TYPE_FILL],
+                           writer.counts[CHUNK_TYPE_DONT_CARE], fout.tell())
+
+
+def mark_sparse_programs(xml, filenames):
+    """Return rawprogram XML text with sparse="true" set on the <program>
+    entries flashing one of *filenames*, and the number of entries changed.
+
+    The text is edited in place rather than re-serialized, so the layout
+    and comments of the generated partition files are kept.
+    """
+    changed = 0
+
+    def fix(m):
+        nonlocal changed
+        tag = m.group(0)
+        fname = re.search(r'\bfilename="([^"]*)"', tag)
+        if not fname or fname.group(1) not in filenames:
+            return tag
+        changed += 1
+        if re.search(r'\bsparse="[^"]*"', tag):
+            return re.sub(r'\bsparse="[^"]*"', 'sparse="true"', tag)
+        return tag.replace('<program', '<program sparse="true"', 1)
+
+    return re.sub(r'<program\b[^>]*>', fix, xml), changed
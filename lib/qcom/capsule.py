@@ -0,0 +1,107 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the UEFI FMP capsule build pipeline used by
+# qcom-capsule.bbclass:
+#
+#   sysfw-version  - SYSFW_VERSION.bin from the firmware version and LSV
+#   fv-create      - firmware.fv from FvUpdate.xml and the staged boot binaries
+#   update-json    - config.json for the capsule signing
+#   capsule        - <name>.cap, EDK2 GenerateCapsule.py
+#
+# The stages are described as data and run by capsule_driver.py in a
+# single python3-native interpreter, instead of one process per stage that
+# re-imports the tool, and each stage is timed.
+
+import json
+import os
+import subprocess
+from typing import List, NamedTuple, Optional
+
+import bb
+
+TOOL = "qcom-capsule-tool"
+DRIVER = os.path.join(os.path.dirname(__file__), "capsule_driver.py")
+
+
+class Stage(NamedTuple):
+    """A pipeline stage: a qcom-capsule-tool subcommand, or *script* run
+    as a Python program, with the arguments *argv*."""
+    name: str
+    argv: List[str]
+    script: Optional[str] = None
+
+
+class StageResult(NamedTuple):
+    name: str
+    seconds: float
+    returncode: int
+
+
+class CapsuleConfig(NamedTuple):
+    name: str               # capsule file name, without .cap
+    fvupdate_xml: str
+    bootbins: str           # staged boot binaries
+    fw_version: str
+    lowest_version: str
+    fv_type: str
+    cert_pem: str
+    root_pub: str
+    sub_pub: str
+    guid: str
+    edk2_basetools: str     # directory holding GenerateCapsule.py
+
+
+def capsule_stages(config: CapsuleConfig) -> List[Stage]:
+    """Return the stages building <config.name>.cap in the current directory."""
+    return [
+        Stage("sysfw-version", ["sysfw-version-create", "-Gen",
+                                "-FwVer", config.fw_version,
+                                "-LFwVer", config.lowest_version,
+                                "-O", "SYSFW_VERSION.bin"]),
+        Stage("fv-create", ["fv-create", "firmware.fv", "-FvType", config.fv_type,
+                            config.fvupdate_xml, "SYSFW_VERSION.bin", config.bootbins]),
+        Stage("update-json", ["update-json", "-j", "config.json",
+                              "-f", config.fv_type,
+                              "-b", "SYSFW_VERSION.bin",
+                              "-pf", "firmware.fv",
+                              "-p", config.cert_pem,
+                              "-x", config.root_pub,
+                              "-oc", config.sub_pub,
+                              "-g", config.guid]),
+        Stage("capsule", ["-e", "-j", "config.json", "-o", f"{config.name}.cap",
+                          "--capflag", "PersistAcrossReset", "-v"],
+              script=os.path.join(config.edk2_basetools, "GenerateCapsule.py")),
+    ]
+
+
+def run_pipeline(stages, cwd, python="python3", env=None) -> List[StageResult]:
+    """Run *stages* in order in *cwd*, in a single *python* interpreter.
+
+    The tool output is logged with bb.note(). A failing stage is fatal.
+    """
+    spec = os.path.join(cwd, "capsule-stages.json")
+    results_path = os.path.join(cwd, "capsule-results.json")
+    with open(spec, 'w') as f:
+        json.dump([{"name": s.name, "tool": TOOL, "argv": s.argv, "script": s.script}
+                   for s in stages], f, indent=2)
+    if os.path.exists(results_path):
+        os.unlink(results_path)
+
+    proc = subprocess.run([python, DRIVER, spec, results_path], cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if proc.stdout:
+        bb.note(proc.stdout.rstrip())
+
+    results = []
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            results = [StageResult(r["name"], r["seconds"], r["returncode"])
+                       for r in json.load(f)]
+    failed = [r for r in results if r.returncode]
+    if proc.returncode or failed or len(results) != len(stages):
+        stage = failed[0].name if failed else "driver"
+        bb.fatal(f"Capsule stage '{stage}' failed (exit status {proc.returncode})\n"
+                 f"{proc.stdout}")
+    return results
@@ -0,0 +1,99 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file is the driver of the capsule pipeline of qcom.capsule. It is
+# not imported by BitBake but run as a script by python3-native, the
+# interpreter qcom-capsule-tool is installed for:
+#
+#   python3 capsule_driver.py <stages.json> <results.json>
+#
+# Every stage runs in this single interpreter, so the tool and the EDK2
+# BaseTools are imported once for the whole pipeline: qcom-capsule-tool
+# subcommands through the tool's console_scripts entry point, Python
+# scripts such as GenerateCapsule.py through runpy. The wall time and exit
+# status of each stage are written to the results file. The pipeline
+# stops at the first failing stage.
+
+import json
+import os
+import runpy
+import subprocess
+import sys
+import time
+import traceback
+
+
+def _tool_entry_point(name):
+    try:
+        from importlib import metadata
+        for ep in metadata.entry_points().select(group='console_scripts', name=name):
+            return ep.load()
+    except Exception:
+        traceback.print_exc()
+    return None
+
+
+def _exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    print(code, file=sys.stderr)
+    return 1
+
+
+def _run_stage(stage, entry_points):
+    argv = stage["argv"]
+    script = stage.get("script")
+    if script:
+        sys.argv = [script] + argv
+        runpy.run_path(script, run_name="__main__")
+        return 0
+
+    tool = stage["tool"]
+    if tool not in entry_points:
+        entry_points[tool] = _tool_entry_point(tool)
+    main = entry_points[tool]
+    if main is None:
+        # Not installed as a Python distribution, run it on its own
+        return subprocess.run([tool] + argv).returncode
+    sys.argv = [tool] + argv
+    return _exit_code(main())
+
+
+def main():
+    with open(sys.argv[1]) as f:
+        stages = json.load(f)
+    results_path = sys.argv[2]
+
+    results = []
+    entry_points = {}
+    saved_argv = sys.argv
+    cwd = os.getcwd()
+    for stage in stages:
+        start = time.monotonic()
+        try:
+            ret = _run_stage(stage, entry_points)
+        except SystemExit as e:
+            ret = _exit_code(e.code)
+        except Exception:
+            traceback.print_exc()
+            ret = 1
+        finally:
+            sys.argv = saved_argv
+            os.chdir(cwd)
+            sys.stdout.flush()
+            sys.stderr.flush()
+        results.append({"name": stage["name"], "seconds": time.monotonic() - start,
+                        "returncode": ret})
+        if ret:
+            break
+
+    with open(results_path, 'w') as f:
+        json.dump(results, f)
+    return 1 if results and results[-1]["returncode"] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains a persistent, content-addressed cache of generated
+# files, shared between builds through PERSISTENT_DIR.
+#
+# Entries are keyed on a manifest describing every input that affects the
+# generated bytes, e.g. the DTB digests, compatible map and assembler
+# options of qclinuxfitImage (dtb-fit-image.bbclass) or the ELF, root
+# certificate and tool of the patched xbl_config.elf (qcom-capsule.bbclass).
+# Rebuilds with the same inputs then reuse the cached files instead of
+# running the generator again. The cache is bounded in size and evicts the
+# least recently used entries first.
+#
+# Files are always copied in and out of the cache, never hardlinked, so an
+# in-place write to a build output cannot corrupt a cache entry.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import bb
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_digest(path):
+    """Return the sha256 hex digest of a file."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_key(manifest):
+    """Return the cache key (sha256) of a JSON-serializable manifest."""
+    data = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class ContentCache:
+    """Size-bounded LRU cache of generated files stored under *cache_dir*.
+
+    Each entry is a directory named after its manifest key that holds the
+    cached files and the manifest they were produced from. The directory
+    mtime records the last use and drives eviction.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self._cache_dir, key)
+
+    def _lock(self, shared=False):
+        return bb.utils.lockfile(os.path.join(self._cache_dir, "cache.lock"),
+                                 shared=shared)
+
+    @staticmethod
+    def _copy(src, dst):
+        tmp = dst + ".tmp"
+        try:
+            shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+        finally:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+
+    def fetch(self, key, dest_files):
+        """Populate *dest_files* from the entry *key*.
+
+        *dest_files* maps cached file names to destination paths. Returns
+        True on a hit, False when the entry is missing or incomplete, in
+        which case none of the destinations are left behind.
+        """
+        entry = self._entry_dir(key)
+        done = []
+        # evict() removes entries under the exclusive lock
+        lock = self._lock(shared=True)
+        try:
+            for name, dst in dest_files.items():
+                self._copy(os.path.join(entry, name), dst)
+                done.append(dst)
+            # Mark the entry as recently used
+            os.utime(entry)
+        except OSError as e:
+            bb.debug(1, f"Cache entry {key} not usable: {e}")
+            for dst in done:
+                os.unlink(dst)
+            return False
+        finally:
+            bb.utils.unlockfile(lock)
+        return True
+
+    def store(self, key, src_files, manifest):
+        """Store *src_files* ({name: path}) under *key* and evict old entries."""
+        entry = self._entry_dir(key)
+        if os.path.isdir(entry):
+            return
+
+        # Populate a private directory first and rename it into place, so
+        # concurrent builds sharing the cache never see a partial entry.
+        tmpdir = tempfile.mkdtemp(prefix=".tmp-", dir=self._cache_dir)
+        try:
+            for name, src in src_files.items():
+                self._copy(src, os.path.join(tmpdir, name))
+            with open(os.path.join(tmpdir, MANIFEST_NAME), 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.rename(tmpdir, entry)
+        except OSError as e:
+            bb.debug(1, f"Not caching entry {key}: {e}")
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_size."""
+        if self._max_size <= 0:
+            return
+
+        lock = self._lock()
+        try:
+            entries = []
+            total = 0
+            for name in os.listdir(self._cache_dir):
+                path = os.path.join(self._cache_dir, name)
+                if name.startswith('.') or not os.path.isdir(path):
+                    continue
+                try:
+                    size = sum(os.path.getsize(os.path.join(path, f))
+                               for f in os.listdir(path))
+                    entries.append((os.path.getmtime(path), size, path))
+                except FileNotFoundError:
+                    continue
+                total += size
+
+            for _, size, path in sorted(entries):
+                if total <= self._max_size:
+                    break
+                bb.debug(1, f"Evicting cache entry {os.path.basename(path)}")
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+        finally:
+            bb.utils.unlockfile(lock)
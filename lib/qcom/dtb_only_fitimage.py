@@ -16,6 +16,7 @@ import subprocess
 import bb
 from typing import Tuple, List, Dict
 from oe.fitimage import ItsNodeRootKernel, ItsNodeConfiguration
+from qcom.fdt_blob import FitBlobWriter, MKIMAGE_DEFAULT_ALIGN
 
 # Custom extension of ItsNodeRootKernel to inject compatible strings
 class QcomItsNodeRoot(ItsNodeRootKernel):
@@ -88,7 +89,8 @@ class QcomItsNodeRoot(ItsNodeRootKernel):
                 dtb_node.compatible = compatible
                 self._fitimage_emit_one_section_config(conf_name, dtb_node)
 
-    def fitimage_emit_section_qcomconfig(self, overlay_groups, overlay_compats):
+    def fitimage_emit_section_qcomconfig(self, compat_index):
+        """Emit config nodes from a qcom.fit_compat.FitCompatIndex"""
         counter = 1
         for (dtb_node, compatible_str, dtb_id) in self._dtbs:
             # qcom-metadata doesn't need any config entry
@@ -100,22 +102,15 @@ class QcomItsNodeRoot(ItsNodeRootKernel):
                 continue
 
             # Base-only configs
-            base_compats = str(compatible_str or "").split()
-            for compatible in base_compats:
+            for compatible in compat_index.base_compatibles(dtb_id):
                 conf_name = f"{self._conf_prefix}{counter}"
                 dtb_node.compatible = compatible
                 self._fitimage_emit_one_section_config(conf_name, dtb_node)
                 counter += 1
 
             # Overlay configs
-            for ovl_list in (overlay_groups or {}).get(dtb_id, []):
-                dt_list = [dtb_id] + ovl_list
-
-                fdtentries = [f"fdt-{dt}" for dt in dt_list]
-                lookup_key = " ".join([os.path.splitext(dt)[0].replace(',', '_') for dt in dt_list])
-                bb.note(lookup_key)
-
-                ovl_compats = str(((overlay_compats or {}).get(lookup_key, "")) or "").split()
+            for ovl_ids, ovl_compats in compat_index.overlay_combos(dtb_id):
+                fdtentries = [f"fdt-{dt}" for dt in (dtb_id,) + ovl_ids]
                 for compat in ovl_compats:
                     conf_name = f"{self._conf_prefix}{counter}"
                     dtb_node.compatible = compat
@@ -143,3 +138,33 @@ class QcomItsNodeRoot(ItsNodeRootKernel):
                 f"stderr: {e.stderr.decode()}\n"
                 f"itsfile: {os.path.abspath(itsfile)}"
             )
+
+    def _python_assemble_align(self):
+        """Return the external data alignment if the in-process writer can
+        reproduce the configured mkimage options, None otherwise."""
+        align = MKIMAGE_DEFAULT_ALIGN
+        external = False
+        opts = iter(self._mkimage_extra_opts)
+        for opt in opts:
+            if opt == '-E':
+                external = True
+            elif opt == '-B':
+                # mkimage parses the -B argument as hex
+                align = int(next(opts, '4'), 16)
+            else:
+                return None
+        return align if external else None
+
+    # Serialize the node tree straight into a FIT blob, bypassing the
+    # ITS -> dtc -> mkimage round trip. Falls back to mkimage for options
+    # the in-process writer does not implement.
+    def write_fit_file(self, itsfile, fitfile, timestamp=None):
+        align = self._python_assemble_align()
+        if align is None:
+            bb.note("mkimage options '%s' not supported by the in-process FIT "
+                    "writer, falling back to mkimage" % ' '.join(self._mkimage_extra_opts))
+            self.run_mkimage_assemble(itsfile, fitfile)
+            return
+
+        bb.note(f"Writing {fitfile} in-process (external data, {align}-byte alignment)")
+        FitBlobWriter(self, align=align, timestamp=timestamp).write(fitfile)
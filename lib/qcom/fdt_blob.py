@@ -0,0 +1,216 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains an in-process flattened device tree (FDT) writer for
+# FIT images built from oe.fitimage ItsNode trees. It emulates what
+# `mkimage -E [-B <align>] -f <its> <fit>` produces (dtc compilation,
+# timestamp injection and external data extraction) without writing the
+# ITS text back out, forking mkimage/dtc or re-parsing the DTB payloads.
+#
+# The layout mirrors dtc/libfdt so the output is byte-identical to mkimage:
+#   - header, empty memory reservation map, structure block, strings block
+#   - strings are de-duplicated with the dtc/libfdt suffix-sharing rule
+#   - properties added by mkimage (timestamp, data-size, data-offset) are
+#     inserted at the start of their node, as libfdt fdt_setprop() does
+#   - external payloads follow the FDT, each aligned to <align> bytes
+
+import os
+import re
+import shutil
+import struct
+import time
+
+FDT_MAGIC = 0xd00dfeed
+FDT_VERSION = 17
+FDT_LAST_COMP_VERSION = 16
+FDT_HEADER_SIZE = 40
+
+FDT_BEGIN_NODE = 0x1
+FDT_END_NODE = 0x2
+FDT_PROP = 0x3
+FDT_END = 0x9
+
+# Default external data alignment used by mkimage when -B is not given
+MKIMAGE_DEFAULT_ALIGN = 4
+
+_INCBIN_RE = re.compile(r'^/incbin/\("(.*)"\)$')
+
+
+def _align(value, alignment):
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+def _pad4(data):
+    return data + b'\0' * (_align(len(data), 4) - len(data))
+
+
+class Payload:
+    """Image data streamed into the FIT, either from a file or from memory."""
+
+    def __init__(self, path=None, data=None):
+        self.path = path
+        self.data = data
+        self.size = os.path.getsize(path) if path else len(data)
+
+    def write_to(self, f):
+        if self.path is None:
+            f.write(self.data)
+            return
+        with open(self.path, 'rb') as src:
+            shutil.copyfileobj(src, f)
+
+
+def encode_value(value):
+    """Encode an ItsNode property value the way dtc would compile it.
+
+    Returns either bytes or a Payload for /incbin/ references.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, int):
+        return struct.pack('>I', value)
+    if isinstance(value, (list, tuple)):
+        return b''.join(str(v).encode() + b'\0' for v in value)
+    value = str(value)
+    m = _INCBIN_RE.match(value)
+    if m:
+        return Payload(m.group(1))
+    if value.startswith('<') and value.endswith('>'):
+        return b''.join(struct.pack('>I', int(c, 0)) for c in value[1:-1].split())
+    return value.encode() + b'\0'
+
+
+class StringTable:
+    """FDT strings block with dtc/libfdt de-duplication semantics.
+
+    Both dtc (stringtable_insert) and libfdt (fdt_find_add_string_) reuse
+    any existing NUL-terminated match, including suffixes of longer names.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+
+    def add(self, name):
+        needle = name.encode() + b'\0'
+        off = self._data.find(needle)
+        if off < 0:
+            off = len(self._data)
+            self._data += needle
+        return off
+
+    def __bytes__(self):
+        return bytes(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class FitBlobWriter:
+    """Serialize an ItsNode tree into an external-data FIT blob.
+
+    Equivalent to `mkimage -E -B <align> -f <its> <fit>` for ITS trees that
+    carry no hash or signature nodes.
+    """
+
+    def __init__(self, root, align=MKIMAGE_DEFAULT_ALIGN, timestamp=None):
+        self._root = root
+        self._align = align
+        if timestamp is None:
+            timestamp = int(os.environ.get('SOURCE_DATE_EPOCH', time.time()))
+        self._timestamp = timestamp
+        self._data_size = 0
+
+    def _collect_strings(self, strings, node):
+        # dtc flattens each node's properties first, then its children.
+        for key in node.properties:
+            strings.add(key)
+        for sub_node in node.sub_nodes:
+            self._collect_strings(strings, sub_node)
+
+    @staticmethod
+    def _is_image(depth, parent_name):
+        # mkimage only extracts "data" from direct children of /images
+        return depth == 2 and parent_name == 'images'
+
+    def _has_external_data(self, node, depth=0, parent_name=None):
+        if self._is_image(depth, parent_name) and 'data' in node.properties:
+            return True
+        return any(self._has_external_data(sub_node, depth + 1, node.name)
+                   for sub_node in node.sub_nodes)
+
+    def _emit_node(self, chunks, strings, payloads, node, depth, parent_name=None):
+        name = '' if depth == 0 else node.name
+        chunks.append(struct.pack('>I', FDT_BEGIN_NODE) + _pad4(name.encode() + b'\0'))
+
+        props = []
+        for key, value in node.properties.items():
+            encoded = encode_value(value)
+            if key == 'data' and self._is_image(depth, parent_name):
+                if not isinstance(encoded, Payload):
+                    encoded = Payload(data=encoded)
+                offset = self._data_size
+                self._data_size += _align(encoded.size, self._align)
+                payloads.append(encoded)
+                # libfdt inserts new properties at the start of the node, so
+                # the property mkimage sets last (data-size) ends up first.
+                props[:0] = [('data-size', struct.pack('>I', encoded.size)),
+                             ('data-offset', struct.pack('>I', offset))]
+                continue
+            if isinstance(encoded, Payload):
+                with open(encoded.path, 'rb') as f:
+                    encoded = f.read()
+            props.append((key, encoded))
+
+        if depth == 0:
+            props.insert(0, ('timestamp', struct.pack('>I', self._timestamp)))
+
+        for key, data in props:
+            chunks.append(struct.pack('>III', FDT_PROP, len(data), strings.add(key))
+                          + _pad4(data))
+
+        for sub_node in node.sub_nodes:
+            self._emit_node(chunks, strings, payloads, sub_node, depth + 1, node.name)
+
+        chunks.append(struct.pack('>I', FDT_END_NODE))
+
+    def write(self, fitfile):
+        strings = StringTable()
+        # dtc builds the strings block from the ITS first; mkimage then adds
+        # its own property names in the order libfdt sets them.
+        self._collect_strings(strings, self._root)
+        strings.add('timestamp')
+        if self._has_external_data(self._root):
+            strings.add('data-offset')
+            strings.add('data-size')
+
+        chunks = []
+        payloads = []
+        self._data_size = 0
+        self._emit_node(chunks, strings, payloads, self._root, 0)
+        chunks.append(struct.pack('>I', FDT_END))
+
+        rsvmap = struct.pack('>QQ', 0, 0)
+        off_rsvmap = _align(FDT_HEADER_SIZE, 8)
+        off_struct = off_rsvmap + len(rsvmap)
+        size_struct = sum(len(c) for c in chunks)
+        off_strings = off_struct + size_struct
+        size_strings = len(strings)
+        totalsize = _align(off_strings + size_strings, self._align)
+
+        header = struct.pack('>10I', FDT_MAGIC, totalsize, off_struct,
+                             off_strings, off_rsvmap, FDT_VERSION,
+                             FDT_LAST_COMP_VERSION, 0, size_strings,
+                             size_struct)
+
+        with open(fitfile, 'wb') as f:
+            f.write(header)
+            f.write(b'\0' * (off_rsvmap - FDT_HEADER_SIZE))
+            f.write(rsvmap)
+            for chunk in chunks:
+                f.write(chunk)
+            f.write(bytes(strings))
+            f.write(b'\0' * (totalsize - off_strings - size_strings))
+            for payload in payloads:
+                payload.write_to(f)
+                f.write(b'\0' * (_align(payload.size, self._align) - payload.size))
@@ -0,0 +1,163 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains helpers to copy file contents without pulling them
+# through user space. os.copy_file_range() lets filesystems such as btrfs
+# and XFS share the extents (reflink) and lets every other filesystem copy
+# inside the kernel. When the call is not supported for a pair of files
+# (older kernels, copies across filesystems) the helpers fall back to a
+# buffered copy. Whole-file copies only transfer the data extents of the
+# source, so sparse images stay sparse.
+#
+# stage_tree() mirrors a directory as links, for consumers that need a
+# private view of a deploy directory but only modify a few of its files.
+
+import errno
+import os
+import shutil
+from typing import NamedTuple
+
+# Errors meaning "copy_file_range() cannot handle these files"
+_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                    errno.EBADF, errno.EPERM}
+
+
+def data_extents(fd, size):
+    """Return [(offset, length)] of the data regions of a (sparse) file."""
+    extents = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                start = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                # Only a hole is left up to the end of the file
+                break
+            end = os.lseek(fd, start, os.SEEK_HOLE)
+            extents.append((start, end - start))
+            offset = end
+    except (AttributeError, OSError):
+        # No SEEK_DATA support (EINVAL, EOPNOTSUPP, ...): treat the file
+        # as fully allocated
+        return [(0, size)] if size else []
+    return extents
+
+
+def _copy_range(src, dst, size, src_off, dst_off):
+    """Copy *size* bytes inside the kernel, return how many were copied."""
+    if not hasattr(os, 'copy_file_range'):
+        return 0
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), size - copied,
+                                   src_off + copied, dst_off + copied)
+            if n == 0:
+                break
+            copied += n
+    except OSError as e:
+        if e.errno not in _FALLBACK_ERRNOS:
+            raise
+    return copied
+
+
+def append_file(dst, src_path):
+    """Append the contents of *src_path* to the open binary file *dst*.
+
+    The data lands at the current position of *dst*, which is left at the
+    end of the appended data. Returns the number of bytes appended.
+    """
+    with open(src_path, 'rb') as src:
+        size = os.fstat(src.fileno()).st_size
+        dst.flush()
+        dst_off = dst.tell()
+        copied = _copy_range(src, dst, size, 0, dst_off)
+        dst.seek(dst_off + copied)
+        if copied < size:
+            src.seek(copied)
+            shutil.copyfileobj(src, dst)
+        return dst.tell() - dst_off
+
+
+def copy_file(src_path, dst_path):
+    """Copy *src_path* to *dst_path* (mode 0644), keeping holes as holes."""
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        size = os.fstat(src.fileno()).st_size
+        dst.truncate(size)
+        for offset, length in data_extents(src.fileno(), size):
+            copied = _copy_range(src, dst, length, offset, offset)
+            if copied < length:
+                src.seek(offset + copied)
+                dst.seek(offset + copied)
+                remaining = length - copied
+                while remaining:
+                    buf = src.read(min(remaining, 1024 * 1024))
+                    if not buf:
+                        break
+                    dst.write(buf)
+                    remaining -= len(buf)
+    os.chmod(dst_path, 0o644)
+
+
+def link_file(src, dst):
+    """Hardlink *src* (following symlinks) as *dst*, or symlink it when a
+    hardlink is not possible. Returns True for a hardlink."""
+    src = os.path.realpath(src)
+    try:
+        os.link(src, dst)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    os.symlink(src, dst)
+    return False
+
+
+class StageStats(NamedTuple):
+    files: int
+    size: int
+    linked: int
+    symlinked: int
+    copied: int
+    copied_size: int
+
+
+def stage_tree(src_dir, dst_dir, copy=()) -> StageStats:
+    """Mirror *src_dir* into *dst_dir* without duplicating file data.
+
+    Files are hardlinked, or symlinked when *dst_dir* is on another
+    filesystem, so they must only be read. The files named in *copy*
+    (paths relative to *src_dir*) are copied instead, as they are about to
+    be modified. Symlinks of *src_dir* are recreated as they are.
+    """
+    copy = {os.path.normpath(c) for c in copy}
+    files = size = linked = symlinked = copied = copied_size = 0
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        rel_dir = os.path.relpath(dirpath, src_dir)
+        out_dir = os.path.normpath(os.path.join(dst_dir, rel_dir))
+        os.makedirs(out_dir, exist_ok=True)
+        for name in filenames + [n for n in dirnames
+                                 if os.path.islink(os.path.join(dirpath, n))]:
+            src = os.path.join(dirpath, name)
+            dst = os.path.join(out_dir, name)
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            files += 1
+            st_size = os.path.getsize(src)
+            size += st_size
+            if os.path.normpath(os.path.join(rel_dir, name)) in copy:
+                copy_file(src, dst)
+                copied += 1
+                copied_size += st_size
+                continue
+            if link_file(src, dst):
+                linked += 1
+            else:
+                symlinked += 1
+    return StageStats(files, size, linked, symlinked, copied, copied_size)
@@ -0,0 +1,95 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the resolver for the declarative FIT_DTB_COMPATIBLE
+# map used by dtb-fit-image.bbclass:
+#
+#   FIT_DTB_COMPATIBLE[<encoded-compat>] = "<dtb-stem> [<overlay-stem>...]"
+#
+# Flag keys encode commas as underscores (BitBake syntax constraint). The
+# resolver decodes them once, drops combinations whose files are not part
+# of KERNEL_DEVICETREE and builds an index from each base DTB id to its
+# own compatibles and to its overlay combinations, so FIT generation never
+# re-splits or re-joins compatible strings.
+
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Mapping, Tuple
+
+
+def dt_id(fname):
+    """Return the FIT image id of a DTB/DTBO file name (commas encoded)."""
+    return sys.intern(fname.replace(',', '_'))
+
+
+@dataclass
+class BaseDtb:
+    """A base DTB with its standalone and overlay-combination compatibles."""
+    dtb_id: str
+    compatibles: List[str] = field(default_factory=list)
+    # (overlay id, ...) -> compatibles, in FIT_DTB_COMPATIBLE order
+    overlays: Dict[Tuple[str, ...], List[str]] = field(default_factory=dict)
+
+
+class FitCompatIndex:
+    """Index of FIT_DTB_COMPATIBLE restricted to a KERNEL_DEVICETREE set.
+
+    Args:
+        kernel_devicetree: Iterable of DTB/DTBO paths or file names.
+        compat_flags: Mapping of encoded compatible strings to DTB+overlay
+            combo strings (the FIT_DTB_COMPATIBLE flags).
+    """
+
+    def __init__(self, kernel_devicetree: Iterable[str],
+                 compat_flags: Mapping[str, str]):
+        self.files = {os.path.basename(x) for x in kernel_devicetree}
+        self.bases: Dict[str, BaseDtb] = {}
+
+        # Map every available file stem to the id of the file it names
+        stems = {}
+        for fname in self.files:
+            stem, ext = os.path.splitext(fname)
+            stems[(dt_id(stem), ext)] = dt_id(fname)
+
+        for encoded_key, combo_val in compat_flags.items():
+            parts = [dt_id(os.path.basename(p)) for p in combo_val.split()]
+            if not parts:
+                continue
+
+            # Skip combinations not present in KERNEL_DEVICETREE to avoid
+            # generating invalid FIT configs from declarative metadata.
+            base_id = stems.get((parts[0], ".dtb"))
+            overlay_ids = tuple(stems.get((p, ".dtbo")) for p in parts[1:])
+            if base_id is None or None in overlay_ids:
+                continue
+
+            compat = sys.intern(encoded_key.replace('_', ','))
+            base = self.bases.get(base_id)
+            if base is None:
+                base = self.bases[base_id] = BaseDtb(base_id)
+            if overlay_ids:
+                base.overlays.setdefault(overlay_ids, []).append(compat)
+            else:
+                base.compatibles.append(compat)
+
+    @classmethod
+    def from_datastore(cls, d):
+        """Build the index from KERNEL_DEVICETREE and FIT_DTB_COMPATIBLE."""
+        return cls((d.getVar('KERNEL_DEVICETREE') or "").split(),
+                   d.getVarFlags('FIT_DTB_COMPATIBLE') or {})
+
+    def base_compatibles(self, dtb_id):
+        """Return the standalone compatibles of a base DTB id."""
+        base = self.bases.get(dtb_id)
+        return base.compatibles if base else []
+
+    def overlay_combos(self, dtb_id):
+        """Return [(overlay ids, compatibles)] for a base DTB id."""
+        base = self.bases.get(dtb_id)
+        return list(base.overlays.items()) if base else []
+
+    def covers(self, dtb_id):
+        """Return True if any FIT configuration uses the base DTB id."""
+        return dtb_id in self.bases
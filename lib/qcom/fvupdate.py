@@ -0,0 +1,183 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the FvUpdate.xml generator used by qcom-capsule.bbclass
+# for CAPSULE_ENTRIES.
+#
+# Entries are parsed from the CAPSULE_ENTRY_<name> flags into FwEntry
+# records and validated before anything is staged: required fields, GUID
+# syntax, duplicate destinations and the presence of every input binary in
+# the boot binaries about to be staged. The XML is then streamed to the
+# output file, element by element.
+#
+# The digests of the input binaries are computed in parallel while the
+# XML is written and saved as a JSON index keyed by path and file
+# identity, so later steps (and caches keyed on input digests) can look
+# them up instead of reading the binaries again.
+
+import concurrent.futures
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple
+from xml.sax.saxutils import escape
+
+from qcom.content_cache import file_digest
+
+GUID_RE = re.compile(r"^\{?[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-"
+                     r"[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}\}?$")
+
+REQUIRED_FLAGS = ("binary", "dest_disk", "dest_partition")
+
+
+class FwEntry(NamedTuple):
+    name: str
+    binary: str
+    dest_disk: str
+    dest_partition: str
+    dest_guid: str = ""
+    backup_disk: str = ""
+    backup_partition: str = ""
+    backup_guid: str = ""
+
+    @classmethod
+    def from_flags(cls, name, flag):
+        """Build the entry *name* from the accessor *flag* (flag name -> value)."""
+        return cls(name, *(flag(f) or "" for f in cls._fields[1:]))
+
+
+def validate(entries, resolve) -> List[str]:
+    """Return the configuration errors of *entries*.
+
+    *resolve* maps a file name relative to the staged boot binaries to the
+    file it is staged from, or None when there is none.
+    """
+    errors = []
+    dests = {}
+    for entry in entries:
+        var = f"CAPSULE_ENTRY_{entry.name}"
+        missing = [f for f in REQUIRED_FLAGS if not getattr(entry, f)]
+        if missing:
+            errors.append(f"{var}: missing {', '.join('[%s]' % f for f in missing)}")
+        if entry.binary and not resolve(entry.binary):
+            errors.append(f"{var}: binary '{entry.binary}' is not among the boot binaries")
+        for field in ("dest_guid", "backup_guid"):
+            value = getattr(entry, field)
+            if value and not GUID_RE.match(value):
+                errors.append(f"{var}: [{field}] '{value}' is not a GUID")
+        if entry.backup_partition and not entry.backup_disk:
+            errors.append(f"{var}: [backup_partition] set without [backup_disk]")
+        dest = (entry.dest_disk, entry.dest_partition)
+        if entry.dest_partition and dest in dests:
+            errors.append(f"{var}: destination {dest[0]}/{dest[1]} is also used by "
+                          f"CAPSULE_ENTRY_{dests[dest]}")
+        dests.setdefault(dest, entry.name)
+    return errors
+
+
+class _Writer:
+    """Line oriented XML writer producing the FvUpdate.xml layout."""
+
+    def __init__(self, f):
+        self._f = f
+        self._first = True
+
+    def line(self, text=""):
+        if not self._first:
+            self._f.write("\n")
+        self._first = False
+        self._f.write(text)
+
+    def element(self, indent, tag, text):
+        self.line(f"{' ' * indent}<{tag}>{escape(text)}</{tag}>")
+
+
+def write_fvupdate(path, flash_type, entries):
+    """Write FvUpdate.xml for *entries* to *path*."""
+    with open(path, 'w') as f:
+        w = _Writer(f)
+        w.line('<?xml version="1.0" encoding="utf-8"?>')
+        w.line('<FVItems>')
+        w.line('    <Metadata>')
+        w.element(6, 'BreakingChangeNumber', '0')
+        w.element(6, 'FlashType', flash_type)
+        w.line('    </Metadata>')
+        w.line()
+        for entry in entries:
+            w.line('  <FwEntry>')
+            w.element(4, 'InputBinary', entry.binary)
+            w.element(4, 'InputPath', 'Images')
+            w.element(4, 'Operation', 'UPDATE')
+            w.element(4, 'UpdateType', 'UPDATE_PARTITION')
+            w.element(4, 'BackupType', 'BACKUP_PARTITION')
+            w.line('    <Dest>')
+            w.element(6, 'DiskType', entry.dest_disk)
+            w.element(6, 'PartitionName', entry.dest_partition)
+            w.element(6, 'PartitionTypeGUID', entry.dest_guid)
+            w.line('    </Dest>')
+            if entry.backup_partition:
+                w.line('    <Backup>')
+                w.element(6, 'DiskType', entry.backup_disk)
+                w.element(6, 'PartitionName', entry.backup_partition)
+                w.element(6, 'PartitionTypeGUID', entry.backup_guid)
+                w.line('    </Backup>')
+            w.line('  </FwEntry>')
+            w.line()
+        w.line('</FVItems>')
+
+
+def _identity(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def _digest(path):
+    st = os.stat(path)
+    return path, {"sha256": file_digest(path), "identity": _identity(st)}
+
+
+def start_digests(pool, paths):
+    """Submit the digests of *paths* to *pool*, return the futures."""
+    return [pool.submit(_digest, os.path.realpath(p)) for p in sorted(set(paths))]
+
+
+def save_digests(path, futures):
+    """Wait for *futures* and write the digest index to *path*."""
+    index = dict(f.result() for f in futures)
+    with open(path, 'w') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    return index
+
+
+def lookup_digest(index_path, path) -> str:
+    """Return the sha256 of *path* from the digest index at *index_path*,
+    or None if it is not recorded there or the file changed since."""
+    try:
+        with open(index_path) as f:
+            index: Dict = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.realpath(path)
+    entry = index.get(path)
+    try:
+        if entry and entry["identity"] == _identity(os.stat(path)):
+            return entry["sha256"]
+    except OSError:
+        pass
+    return None
+
+
+def generate_fvupdate(path, flash_type, entries, resolve, digests_path, threads=1):
+    """Validate *entries*, write FvUpdate.xml to *path* and the digests of
+    their input binaries to *digests_path*.
+
+    Returns the validation errors; nothing is written when there are any.
+    """
+    errors = validate(entries, resolve)
+    if errors:
+        return errors
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = start_digests(pool, [resolve(e.binary) for e in entries])
+        write_fvupdate(path, flash_type, entries)
+        save_digests(digests_path, futures)
+    return []
@@ -0,0 +1,566 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the archive writer for the qcomflash package built by
+# image_types_qcom.bbclass.
+#
+# QCOMFLASH_DIR only holds hardlinks (or reflinks) of the deployed files,
+# so the archive is produced by reading every source file exactly once and
+# streaming it through a parallel compressor. The archive is reproducible:
+# members are sorted, owned by 0:0 and use fixed permissions and a fixed
+# mtime (REPRODUCIBLE_TIMESTAMP_ROOTFS). Files that are hardlinks of each other, such as
+# dtb.bin and its dtb-*-image.vfat source, are stored once and referenced
+# as tar hard links. Sparse files (DTB VFAT images, rootfs) are stored in
+# the PAX GNU sparse 1.0 format, so their holes are never read or
+# compressed.
+#
+# The archive is compressed either by a filter command (pigz, zstd) or as
+# a seekable zstd archive: independently compressed frames of a fixed
+# uncompressed size followed by a seek table in a skippable frame, as
+# defined by the zstd seekable format. Any zstd decoder extracts it as
+# usual, while seekable-aware tools can decompress single members.
+#
+# For developer builds the archive can also be written incrementally: runs
+# of members are compressed independently (gzip members, zstd frames) and
+# kept in a cache keyed by their content, so the next archive splices the
+# unchanged ones in and only compresses what changed, typically the rootfs.
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import tarfile
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+from qcom.file_copy import append_file, data_extents
+
+FILE_MODE = 0o644
+DIR_MODE = 0o755
+
+# Seek past holes in chunks of this size at most when reading data extents
+_READ_SIZE = 1024 * 1024
+
+# Runs of members compressed with all the threads by the incremental writer
+_LARGE_RUN = 64 * 1024 * 1024
+
+ZSTD_SKIPPABLE_MAGIC = 0x184d2a5e
+ZSTD_SEEKABLE_MAGIC = 0x8f92eab1
+
+
+class Member(NamedTuple):
+    """A file system object of the qcomflash tree, relative to its root."""
+    name: str
+    path: str
+    stat: os.stat_result
+
+
+def collect_tree(root) -> List[Member]:
+    """Return the members below *root* (including it as '.'), sorted by name."""
+    members = [Member('.', root, os.lstat(root))]
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root)
+            members.append(Member(rel, path, os.lstat(path)))
+    # Sort by path components so a directory always precedes its content
+    members.sort(key=lambda m: m.name.split(os.sep) if m.name != '.' else [])
+    return members
+
+
+class _SparseReader:
+    """File-like object returning a GNU sparse 1.0 member body."""
+
+    def __init__(self, fd, sparse_map, extents):
+        self._fd = fd
+        self._pending = sparse_map
+        self._extents = list(reversed(extents))
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            if not self._pending:
+                if not self._extents:
+                    break
+                offset, length = self._extents.pop()
+                n = min(length, _READ_SIZE)
+                self._pending = os.pread(self._fd, n, offset)
+                if len(self._pending) < n:
+                    raise OSError(f"Short read at offset {offset}")
+                if n < length:
+                    self._extents.append((offset + n, length - n))
+            chunk = self._pending[:size]
+            self._pending = self._pending[size:]
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+def _sparse_map(extents, size):
+    # Decimal entry count and offset/length pairs, padded to a block. A
+    # trailing empty extent marks a file ending in a hole, as GNU tar does.
+    if not extents or sum(extents[-1]) < size:
+        extents = extents + [(size, 0)]
+    text = f"{len(extents)}\n" + ''.join(f"{o}\n{n}\n" for o, n in extents)
+    data = text.encode()
+    return data + b'\0' * (-len(data) % tarfile.BLOCKSIZE), extents
+
+
+def _tarinfo(name, mtime):
+    info = tarfile.TarInfo(name)
+    info.mtime = mtime
+    info.uid = info.gid = 0
+    info.uname = info.gname = ''
+    return info
+
+
+class ArchiveStats(NamedTuple):
+    files: int
+    links: int
+    size: int
+    stored: int
+    reused: int = 0     # tar stream bytes reused from the member cache
+
+
+class TarMember(NamedTuple):
+    """A planned tar member: its header blocks and a body read from *path*.
+
+    The body of a sparse member is *sparse_map* followed by the *extents*
+    of the file; a dense member has a single extent covering the file.
+    """
+    header: bytes
+    path: Optional[str] = None
+    sparse_map: bytes = b''
+    extents: Tuple[Tuple[int, int], ...] = ()
+    size: int = 0
+
+    @property
+    def stream_size(self):
+        return len(self.header) + self.size + (-self.size % tarfile.BLOCKSIZE)
+
+
+def _header(info):
+    # Same as TarFile.addfile() with the tarfile.open() defaults
+    return info.tobuf(tarfile.PAX_FORMAT, tarfile.ENCODING, 'surrogateescape')
+
+
+def plan_tar(root, prefix, mtime) -> Tuple[List[TarMember], ArchiveStats]:
+    """Return the members of the tar archive of the tree below *root*.
+
+    Member names are prefixed with *prefix* (e.g. "<image>-<machine>").
+    """
+    files = links = size = stored = 0
+    seen = {}
+    members = []
+    for member in collect_tree(root):
+        name = prefix if member.name == '.' else f"{prefix}/{member.name}"
+        st = member.stat
+        info = _tarinfo(name, mtime)
+
+        if os.path.islink(member.path):
+            info.type = tarfile.SYMTYPE
+            info.linkname = os.readlink(member.path)
+            info.mode = 0o777
+            members.append(TarMember(_header(info)))
+            continue
+        if os.path.isdir(member.path):
+            info.type = tarfile.DIRTYPE
+            info.mode = DIR_MODE
+            members.append(TarMember(_header(info)))
+            continue
+
+        info.mode = FILE_MODE
+        key = (st.st_dev, st.st_ino)
+        if key in seen:
+            info.type = tarfile.LNKTYPE
+            info.linkname = seen[key]
+            members.append(TarMember(_header(info)))
+            links += 1
+            continue
+        seen[key] = name
+        files += 1
+        size += st.st_size
+
+        fd = os.open(member.path, os.O_RDONLY)
+        try:
+            extents = data_extents(fd, st.st_size)
+        finally:
+            os.close(fd)
+        data_size = sum(n for _, n in extents)
+        if data_size == st.st_size:
+            info.size = st.st_size
+            members.append(TarMember(_header(info), member.path, b'',
+                                     ((0, st.st_size),), st.st_size))
+        else:
+            sparse_map, extents = _sparse_map(extents, st.st_size)
+            dirname, basename = os.path.split(name)
+            info.name = f"{dirname}/GNUSparseFile.0/{basename}"
+            info.size = len(sparse_map) + data_size
+            info.pax_headers = {
+                "GNU.sparse.major": "1",
+                "GNU.sparse.minor": "0",
+                "GNU.sparse.name": name,
+                "GNU.sparse.realsize": str(st.st_size),
+            }
+            members.append(TarMember(_header(info), member.path, sparse_map,
+                                     tuple(extents), info.size))
+        stored += data_size
+    return members, ArchiveStats(files, links, size, stored)
+
+
+def _member_body(member):
+    """Yield the body of *member* in chunks."""
+    fd = os.open(member.path, os.O_RDONLY)
+    try:
+        body = _SparseReader(fd, member.sparse_map, list(member.extents))
+        remaining = member.size
+        while remaining:
+            chunk = body.read(min(remaining, _READ_SIZE))
+            if not chunk:
+                raise OSError(f"{member.path} changed while it was archived")
+            yield chunk
+            remaining -= len(chunk)
+    finally:
+        os.close(fd)
+
+
+def write_member(out, member):
+    """Write *member* (header, body and padding) to *out*."""
+    out.write(member.header)
+    if member.path is not None:
+        for chunk in _member_body(member):
+            out.write(chunk)
+    pad = -member.size % tarfile.BLOCKSIZE
+    if pad:
+        out.write(b'\0' * pad)
+
+
+def tar_trailer(offset):
+    """Return the end of archive blocks of a tar stream of *offset* bytes,
+    padded to a full record like tarfile does."""
+    size = 2 * tarfile.BLOCKSIZE
+    return b'\0' * (size + (-(offset + size) % tarfile.RECORDSIZE))
+
+
+def write_tar(fileobj, root, prefix, mtime) -> ArchiveStats:
+    """Write the tree below *root* as an uncompressed tar stream to *fileobj*.
+
+    Member names are prefixed with *prefix* (e.g. "<image>-<machine>").
+    """
+    members, stats = plan_tar(root, prefix, mtime)
+    offset = 0
+    for member in members:
+        write_member(fileobj, member)
+        offset += member.stream_size
+    fileobj.write(tar_trailer(offset))
+    return stats
+
+
+def write_archive(output, root, prefix, mtime, compressor) -> ArchiveStats:
+    """Stream the tree below *root* through *compressor* into *output*.
+
+    *compressor* is the argument list of a filter reading the tar stream on
+    stdin and writing the compressed archive to stdout, e.g.
+    ["pigz", "-p", "8", "-9", "-n", "--rsyncable"].
+    """
+    with open(output, 'wb') as out:
+        proc = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=out)
+        try:
+            stats = write_tar(proc.stdin, root, prefix, mtime)
+        finally:
+            proc.stdin.close()
+            ret = proc.wait()
+    if ret:
+        raise subprocess.CalledProcessError(ret, compressor)
+    return stats
+
+
+def seek_table(frames):
+    """Return the seek table skippable frame for *frames*, a list of
+    (compressed size, decompressed size)."""
+    table = b''.join(struct.pack('<II', c, d) for c, d in frames)
+    # Number of frames, descriptor (no checksums), seekable magic
+    table += struct.pack('<IBI', len(frames), 0, ZSTD_SEEKABLE_MAGIC)
+    return struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(table)) + table
+
+
+class SeekableZstdWriter:
+    """Write-only file object producing a seekable zstd stream on *out*.
+
+    Every *frame_size* bytes of input are compressed as an independent
+    frame by *compressor* (a zstd command line reading stdin and writing
+    stdout). Up to *threads* frames are compressed concurrently and
+    written in order; the seek table is appended by close().
+    """
+
+    def __init__(self, out, compressor, frame_size, threads):
+        self._out = out
+        self._compressor = compressor
+        self._frame_size = frame_size
+        self._buf = bytearray()
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+        self._max_pending = 2 * threads
+        self._pending = collections.deque()
+        self._frames = []       # (compressed size, decompressed size)
+
+    def _compress(self, data):
+        return subprocess.run(self._compressor, input=data, stdout=subprocess.PIPE,
+                              check=True).stdout
+
+    def _submit(self, data):
+        self._pending.append((len(data), self._pool.submit(self._compress, data)))
+        # Bound the memory held by frames waiting to be written out
+        while len(self._pending) > self._max_pending:
+            self._write_frame()
+
+    def _write_frame(self):
+        size, future = self._pending.popleft()
+        frame = future.result()
+        self._out.write(frame)
+        self._frames.append((len(frame), size))
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= self._frame_size:
+            self._submit(bytes(self._buf[:self._frame_size]))
+            del self._buf[:self._frame_size]
+        return len(data)
+
+    def flush_frames(self):
+        """Write out all the frames, without the seek table, and return their
+        (compressed size, decompressed size)."""
+        if self._buf:
+            self._submit(bytes(self._buf))
+            self._buf = bytearray()
+        while self._pending:
+            self._write_frame()
+        self._pool.shutdown()
+        return self._frames
+
+    def close(self):
+        self._out.write(seek_table(self.flush_frames()))
+
+    def abort(self):
+        self._pool.shutdown(cancel_futures=True)
+
+
+def write_seekable_archive(output, root, prefix, mtime, compressor, frame_size,
+                           threads) -> ArchiveStats:
+    """Write the tree below *root* as a seekable zstd tar archive.
+
+    *compressor* is the zstd command line used for every frame, e.g.
+    ["zstd", "-q", "-c", "-10"], and *frame_size* the uncompressed size
+    of each frame.
+    """
+    with open(output, 'wb') as out:
+        writer = SeekableZstdWriter(out, compressor, frame_size, threads)
+        try:
+            stats = write_tar(writer, root, prefix, mtime)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.close()
+    return stats
+
+
+class MemberCache:
+    """Compressed tar members of the previous archive, keyed by content.
+
+    Every entry of *cache_dir* is a file holding the compressed frames (gzip
+    members or zstd frames) of a run of tar members: the directories, links
+    and symlinks preceding a file, and the file itself. Its key covers the
+    compression *settings*, the member headers and the digest of the file
+    body. index.json records the frames of each entry and the body digests
+    by file identity, so unchanged deployed files are not hashed again.
+    """
+
+    INDEX = "index.json"
+
+    def __init__(self, cache_dir, settings):
+        self._dir = cache_dir
+        self._settings = settings
+        self._entries = {}      # key -> [(compressed size, decompressed size)]
+        self._digests = {}      # file identity -> body digest
+        self._used = set()
+        self._used_digests = set()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(os.path.join(cache_dir, self.INDEX)) as f:
+                index = json.load(f)
+            if index.get("settings") == settings:
+                self._entries = {k: [tuple(fr) for fr in v]
+                                 for k, v in index["entries"].items()}
+                self._digests = index["digests"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def path(self, key):
+        return os.path.join(self._dir, key)
+
+    def body_digest(self, member):
+        """Return the sha256 hex digest of the body of *member*."""
+        st = os.stat(member.path)
+        ident = f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+        with self._lock:
+            digest = self._digests.get(ident)
+        if digest is None:
+            h = hashlib.sha256(member.sparse_map)
+            for chunk in _member_body(member):
+                h.update(chunk)
+            digest = h.hexdigest()
+        with self._lock:
+            self._digests[ident] = digest
+            self._used_digests.add(ident)
+        return digest
+
+    def key(self, members):
+        h = hashlib.sha256(json.dumps(self._settings, sort_keys=True).encode())
+        for member in members:
+            h.update(member.header)
+            if member.path is not None:
+                h.update(self.body_digest(member).encode())
+        return h.hexdigest()
+
+    def get(self, key):
+        """Return the frames of entry *key*, or None if it is not cached."""
+        with self._lock:
+            frames = self._entries.get(key)
+        if frames is None or not os.path.isfile(self.path(key)):
+            return None
+        with self._lock:
+            self._used.add(key)
+        return frames
+
+    def put(self, key, frames):
+        with self._lock:
+            self._entries[key] = frames
+            self._used.add(key)
+
+    def save(self):
+        """Write the index and drop the entries and file digests not used by
+        this archive."""
+        with self._lock:
+            entries = {k: v for k, v in self._entries.items() if k in self._used}
+            digests = {k: v for k, v in self._digests.items() if k in self._used_digests}
+            index = {"settings": self._settings, "entries": entries,
+                     "digests": digests}
+        for name in os.listdir(self._dir):
+            if name != self.INDEX and name not in entries:
+                os.unlink(os.path.join(self._dir, name))
+        tmp = os.path.join(self._dir, self.INDEX + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, os.path.join(self._dir, self.INDEX))
+
+
+def _group_members(members):
+    """Split *members* into runs ending with a member having a body."""
+    runs = []
+    run = []
+    for member in members:
+        run.append(member)
+        if member.path is not None:
+            runs.append(run)
+            run = []
+    if run:
+        runs.append(run)
+    return runs
+
+
+def _compress_members(path, members, data, compressor, frame_size, threads):
+    """Compress *members* followed by *data* into *path*, return the frames."""
+    size = sum(m.stream_size for m in members) + len(data)
+    # Small runs are compressed concurrently with each other, large ones
+    # (rootfs) use all the threads themselves
+    n = threads if size >= _LARGE_RUN else 1
+    with open(path, 'wb') as out:
+        if frame_size:
+            writer = SeekableZstdWriter(out, compressor(1), frame_size, n)
+            try:
+                for member in members:
+                    write_member(writer, member)
+                writer.write(data)
+            except BaseException:
+                writer.abort()
+                raise
+            return list(writer.flush_frames())
+
+        cmd = compressor(n)
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+        try:
+            for member in members:
+                write_member(proc.stdin, member)
+            proc.stdin.write(data)
+        finally:
+            proc.stdin.close()
+            ret = proc.wait()
+        if ret:
+            raise subprocess.CalledProcessError(ret, cmd)
+        return [(out.tell(), size)]
+
+
+def write_incremental_archive(output, root, prefix, mtime, compressor, cache_dir,
+                              threads, frame_size=0) -> ArchiveStats:
+    """Write the tree below *root* as a compressed tar archive, reusing the
+    compressed members of the previous archive from *cache_dir*.
+
+    The archive is a concatenation of independently compressed runs of
+    members, which any gzip or zstd decoder reads as a single stream, so
+    only new or changed files are compressed again. *compressor* returns
+    the filter command line for a number of threads, e.g.
+    lambda n: ["zstd", "-q", "-c", "-10", "-T%d" % n]. With *frame_size*,
+    runs are split in zstd frames of that uncompressed size and a seek
+    table is appended, as write_seekable_archive() does.
+    """
+    members, stats = plan_tar(root, prefix, mtime)
+    runs = _group_members(members)
+    cache = MemberCache(cache_dir, {"compressor": compressor(1), "frame_size": frame_size})
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        keys = list(pool.map(cache.key, runs))
+
+        def compress(key, run):
+            tmp = cache.path(key) + ".tmp"
+            frames = _compress_members(tmp, run, b'', compressor, frame_size, threads)
+            os.replace(tmp, cache.path(key))
+            cache.put(key, frames)
+            return frames
+
+        frames = {}
+        reused = 0
+        futures = {}
+        for key, run in zip(keys, runs):
+            if key in frames or key in futures:
+                continue
+            cached = cache.get(key)
+            if cached is not None:
+                frames[key] = cached
+                reused += sum(m.stream_size for m in run)
+            else:
+                futures[key] = pool.submit(compress, key, run)
+        for key, future in futures.items():
+            frames[key] = future.result()
+
+    # The end of archive blocks depend on the archive size, never cache them
+    offset = sum(m.stream_size for m in members)
+    trailer = cache.path("trailer.tmp")
+    trailer_frames = _compress_members(trailer, [], tar_trailer(offset), compressor,
+                                       frame_size, threads)
+
+    all_frames = []
+    with open(output, 'wb') as out:
+        for key in keys:
+            append_file(out, cache.path(key))
+            all_frames += frames[key]
+        append_file(out, trailer)
+        all_frames += trailer_frames
+        if frame_size:
+            out.write(seek_table(all_frames))
+    os.unlink(trailer)
+    cache.save()
+    return stats._replace(reused=reused)
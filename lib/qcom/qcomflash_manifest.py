@@ -0,0 +1,293 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the file selection of the qcomflash package built by
+# image_types_qcom.bbclass.
+#
+# The selection is a declarative manifest: an ordered list of rules, each
+# mapping deployed files to a path inside QCOMFLASH_DIR.
+#
+#   Select - every file of a directory matching some patterns
+#   Pick   - the first existing file out of a list of candidates
+#
+# Rules are evaluated against a DirIndex, which lists every directory at
+# most once, so resolving the whole manifest costs a handful of scandir()
+# calls instead of one find/test per rule. As with the install commands the
+# manifest replaces, a later rule overrides the file an earlier rule
+# selected for the same destination, unless it is marked not to replace.
+#
+# The resolved selection is then materialized in bulk as hardlinks, or
+# sparse-preserving copies when the deploy directory is on another
+# filesystem.
+
+import concurrent.futures
+import errno
+import fnmatch
+import os
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from qcom.file_copy import copy_file
+
+PARTITION_FILES = ('gpt_main*.bin', 'gpt_backup*.bin', 'gpt_both*.bin',
+                   'zeros_*.bin', 'rawprogram[0-9].xml', 'patch*.xml',
+                   'contents.xml')
+# Without these the package cannot be flashed
+PARTITION_FILES_REQUIRED = ('gpt_main*.bin', 'rawprogram[0-9].xml', 'patch*.xml')
+
+
+class Select(NamedTuple):
+    """Install every file of *src_dir* matching one of *include* and none of
+    *exclude* into *dest_dir*, if all the paths in *when* exist.
+
+    A pattern of *required* matching no file is an error.
+    """
+    src_dir: str
+    include: Tuple[str, ...]
+    exclude: Tuple[str, ...] = ()
+    dest_dir: str = ''
+    when: Tuple[str, ...] = ()
+    required: Tuple[str, ...] = ()
+
+
+class Pick(NamedTuple):
+    """Install the first existing file of *candidates* as *dest*, if all the
+    paths in *when* exist.
+
+    A *required* file missing is an error. Unless *replace* is set, a file
+    already selected for *dest* by an earlier rule is kept.
+    """
+    dest: str
+    candidates: Tuple[str, ...]
+    required: bool = False
+    replace: bool = True
+    when: Tuple[str, ...] = ()
+
+
+class Entry(NamedTuple):
+    src: str
+    size: int
+
+
+class Selection(NamedTuple):
+    files: Dict[str, Entry]     # destination -> source, in rule order
+    missing: List[Tuple[str, Tuple[str, ...]]]
+
+    @property
+    def size(self):
+        return sum(e.size for e in self.files.values())
+
+
+class DirIndex:
+    """Lazily populated listing of directories: name -> (is_file, size)."""
+
+    def __init__(self):
+        self._dirs = {}
+
+    def listdir(self, path):
+        path = os.path.normpath(path)
+        if path not in self._dirs:
+            entries = {}
+            try:
+                with os.scandir(path) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_file():
+                                entries[entry.name] = (True, entry.stat().st_size)
+                            else:
+                                entries[entry.name] = (False, 0)
+                        except FileNotFoundError:
+                            # Dangling symlink
+                            continue
+            except (FileNotFoundError, NotADirectoryError):
+                pass
+            self._dirs[path] = entries
+        return self._dirs[path]
+
+    def lookup(self, path):
+        """Return (is_file, size) of *path*, or None if it does not exist."""
+        path = os.path.normpath(path)
+        return self.listdir(os.path.dirname(path)).get(os.path.basename(path))
+
+    def exists(self, path):
+        return self.lookup(path) is not None
+
+    def files(self, path):
+        """Return the sorted (name, size) of the files directly in *path*."""
+        return sorted((name, size) for name, (is_file, size)
+                      in self.listdir(path).items() if is_file)
+
+
+def qcomflash_rules(getvar) -> List:
+    """Return the qcomflash manifest for the datastore accessor *getvar*
+    (e.g. d.getVar).
+
+    The variables read here are listed in create_qcomflash_pkg[vardeps].
+    """
+    def var(name):
+        return getvar(name) or ''
+
+    deploy = var("DEPLOY_DIR_IMAGE")
+    machine = var("MACHINE")
+    dtb_default = var("QCOM_DTB_DEFAULT")
+    dtb_file = var("QCOM_DTB_FILE")
+    cdt_file = var("QCOM_CDT_FILE")
+    capsule = var("QCOM_CAPSULE_FIRMWARE")
+    default_dtb = os.path.join(deploy, f"dtb-{dtb_default}-image.vfat")
+    rules = []
+
+    # esp image
+    if var("QCOM_ESP_FILE"):
+        rules.append(Pick("efi.bin", (var("QCOM_ESP_FILE"),), required=True))
+
+    # dtb image, plus all the DTB images so they ship in the same package
+    if dtb_default:
+        rules.append(Pick(dtb_file, (default_dtb,)))
+        rules.append(Select(deploy, ("dtb-*-image.vfat",), when=(default_dtb,)))
+
+    rules.append(Pick("vmlinux", (os.path.join(deploy, "vmlinux"),), replace=False))
+
+    # Legacy boot images
+    boot_images = (f"boot-initramfs-{dtb_default}-{machine}.img",
+                   f"boot-{dtb_default}-{machine}.img") if dtb_default else ()
+    boot_images += (f"boot-{machine}.img",)
+    rules.append(Pick("boot.img", tuple(os.path.join(deploy, b) for b in boot_images),
+                      replace=False))
+
+    rules.append(Pick("rootfs.img",
+                      (os.path.join(var("IMGDEPLOYDIR"), "%s.%s" % (
+                          var("IMAGE_LINK_NAME"), var("IMAGE_QCOMFLASH_FS_TYPE"))),),
+                      required=True))
+
+    # partition bins/xml files
+    if var("QCOM_PARTITION_FILES_SUBDIR"):
+        rules.append(Select(os.path.join(deploy, var("QCOM_PARTITION_FILES_SUBDIR")),
+                            PARTITION_FILES, required=PARTITION_FILES_REQUIRED))
+
+    boot_subdir = var("QCOM_BOOT_FILES_SUBDIR")
+    if boot_subdir:
+        boot_dir = os.path.join(deploy, boot_subdir)
+        spinor_dir = os.path.join(boot_dir, "spinor")
+
+        # For targets with spinor the CDT is in the spinor subfolder instead
+        if cdt_file:
+            rules.append(Pick("cdt.bin", (os.path.join(boot_dir, f"{cdt_file}.bin"),)))
+
+        # boot firmware
+        rules.append(Select(boot_dir, ("*.elf",),
+                            exclude=("abl2esp*.elf", "xbl_config*.elf", "uefi.elf")))
+        rules.append(Select(boot_dir, ("*.mbn*", "*.melf*", "*.fv", "*.img", "cdt_*.bin",
+                                       "logfs_*.bin", "qsahara_*.xml", "sec.dat",
+                                       "soccp*.bin", "xbl_config_devprg.elf")))
+
+        # Prefer the OEM-cert-injected xbl_config deployed by the capsule
+        # recipe when available.
+        xbl_configs = ()
+        if capsule:
+            xbl_configs += (os.path.join(deploy, "xbl_config-with-oem-cert.elf"),)
+        if var("QCOM_XBL_CONFIG"):
+            xbl_configs += (os.path.join(boot_dir, var("QCOM_XBL_CONFIG")),)
+        rules.append(Pick("xbl_config.elf", xbl_configs))
+
+        # bootloader selection
+        if var("PREFERRED_PROVIDER_virtual/bootloader").startswith("u-boot"):
+            bootloader = os.path.join(deploy, "u-boot-%s.mbn" % var("UBOOT_CONFIG_DEFAULT"))
+        else:
+            bootloader = os.path.join(boot_dir, "uefi.elf")
+        rules.append(Pick("uefi.elf", (bootloader,)))
+
+        # sail nor firmware
+        rules.append(Select(os.path.join(boot_dir, "sail_nor"), ("*",), dest_dir="sail_nor"))
+
+        # SPI-NOR firmware, partition bins, CDT etc.
+        spinor = (spinor_dir,)
+        rules.append(Select(spinor_dir, ("*.bin", "*.elf", "*.fv", "*.lzma", "*.mbn",
+                                         "*.melf", "*.xz", "qsahara_*.xml"),
+                            exclude=("uefi_dtbs*.xz",), dest_dir="spinor"))
+        if var("QCOM_PARTITION_FILES_SUBDIR_SPINOR"):
+            rules.append(Select(os.path.join(deploy, var("QCOM_PARTITION_FILES_SUBDIR_SPINOR")),
+                                PARTITION_FILES, dest_dir="spinor", when=spinor,
+                                required=PARTITION_FILES_REQUIRED))
+        if cdt_file:
+            rules.append(Pick("spinor/cdt.bin", (os.path.join(spinor_dir, f"{cdt_file}.bin"),),
+                              required=True, when=spinor))
+        if var("QCOM_UEFI_DTB"):
+            rules.append(Pick("spinor/uefi_dtbs.xz",
+                              (os.path.join(spinor_dir, var("QCOM_UEFI_DTB")),), when=spinor))
+        if dtb_file:
+            rules.append(Pick(f"spinor/{dtb_file}", (default_dtb,), required=True, when=spinor))
+
+        # programmer to support flashing the HLOS images
+        rules.append(Pick("xbl_s_devprg_ns.melf",
+                          (os.path.join(spinor_dir, "xbl_s_devprg_ns.melf"),)))
+
+    abl2esp = "abl2esp-%s.elf" % var("ABL_SIGNATURE_VERSION")
+    rules.append(Pick(abl2esp, (os.path.join(deploy, abl2esp),)))
+
+    # capsule image
+    if capsule:
+        rules.append(Pick(f"{capsule}.cap", (os.path.join(deploy, f"{capsule}.cap"),)))
+
+    return rules
+
+
+def resolve(rules: Sequence, index: DirIndex) -> Selection:
+    """Evaluate *rules* in order against *index*."""
+    files = {}
+    missing = []
+    for rule in rules:
+        if not all(index.exists(p) for p in rule.when):
+            continue
+        if isinstance(rule, Select):
+            matched = set()
+            for name, size in index.files(rule.src_dir):
+                if (any(fnmatch.fnmatchcase(name, p) for p in rule.include) and
+                        not any(fnmatch.fnmatchcase(name, p) for p in rule.exclude)):
+                    dest = os.path.normpath(os.path.join(rule.dest_dir, name))
+                    files[dest] = Entry(os.path.join(rule.src_dir, name), size)
+                    matched.update(p for p in rule.required if fnmatch.fnmatchcase(name, p))
+            for pattern in rule.required:
+                if pattern not in matched:
+                    missing.append((os.path.normpath(os.path.join(rule.dest_dir, pattern)),
+                                    (os.path.join(rule.src_dir, pattern),)))
+            continue
+
+        dest = os.path.normpath(rule.dest)
+        if dest in files and not rule.replace:
+            continue
+        for src in rule.candidates:
+            found = index.lookup(src)
+            if found and found[0]:
+                files[dest] = Entry(src, found[1])
+                break
+        else:
+            if rule.required:
+                missing.append((dest, rule.candidates))
+    return Selection(files, missing)
+
+
+def _install(src, dst):
+    # link() does not follow symlinks such as the IMAGE_LINK_NAME ones
+    src = os.path.realpath(src)
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+        copy_file(src, dst)
+
+
+def populate(selection: Selection, root, threads=1):
+    """Materialize *selection* below *root* as hardlinks of the sources.
+
+    Across filesystems the files are copied instead, keeping holes. The
+    archive writer normalizes the permissions, so hardlinks are used as-is
+    and the deployed files are never modified.
+    """
+    for dest in selection.files:
+        os.makedirs(os.path.join(root, os.path.dirname(dest)), exist_ok=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(_install, entry.src, os.path.join(root, dest))
+                   for dest, entry in selection.files.items()]
+        for future in futures:
+            future.result()
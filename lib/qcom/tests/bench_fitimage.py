@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Scaling benchmark of the DTB-only FIT image generation (QcomItsNodeRoot).
+#
+#   bench_fitimage.py [--case N:M:K]... [--dtb-size BYTES] [--mkimage PATH]
+#                     [--repeat N] [--output FILE]
+#                     [--compare FILE [--threshold RATIO] [--min-seconds S]]
+#
+# Each case synthesises N base DTBs, each with M overlay groups and K
+# compatibles per base and per overlay group, and times the phases of
+# dtb-fit-image.bbclass:
+#
+#   index        FitCompatIndex from KERNEL_DEVICETREE / FIT_DTB_COMPATIBLE
+#   emit-dtb     fitimage_emit_section_dtb for every DTB/DTBO
+#   emit-config  fitimage_emit_section_qcomconfig
+#   write-its    write_its_file
+#   fit-python   write_fit_file, in-process writer (-E -B 8)
+#   fit-mkimage  run_mkimage_assemble (-E -B 8), when mkimage is found
+#
+# The wall time and the peak RSS of each phase are reported along with the
+# ITS and FIT sizes. The RSS high-water mark is reset before every phase
+# through /proc/self/clear_refs; where that is not possible the peak of the
+# process so far is reported instead, and the results say so. Every run of
+# a case uses a fresh process. With --repeat, each case runs N times and
+# the minimum time (maximum peak RSS) of each phase is kept.
+#
+# The results are written as JSON; --compare prints the time ratios against
+# a previous result and fails when one exceeds --threshold. Phases shorter
+# than --min-seconds in both results are too noisy to compare and only
+# reported.
+#
+# Runs without BitBake, using the stand-ins of standins.py when `bb` and
+# `oe.fitimage` are not importable.
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+LIB_DIR = os.path.dirname(os.path.dirname(TESTS_DIR))
+
+DEFAULT_CASES = ["50:2:2", "200:4:3", "1000:4:3", "1000:12:3"]
+
+
+def synthesise(bases, groups, compats):
+    """Return (KERNEL_DEVICETREE, FIT_DTB_COMPATIBLE) for a case.
+
+    Overlay group g of a base combines the base with its overlay g and, for
+    odd groups, a shared overlay stacked on top (like camx + el2).
+    """
+    files = []
+    flags = {}
+    for b in range(bases):
+        base = f"soc{b % 16}-board{b}"
+        files.append(f"qcom/{base}.dtb")
+        if groups:
+            files.append(f"qcom/{base}-el2.dtbo")
+        for k in range(compats):
+            flags[f"qcom_soc{b}-iot-sku{k}"] = base
+        for g in range(groups):
+            files.append(f"qcom/{base}-ovl{g}.dtbo")
+            combo = [base, f"{base}-ovl{g}"] + ([f"{base}-el2"] if g % 2 else [])
+            for k in range(compats):
+                flags[f"qcom_soc{b}-iot-subtype{g}-sku{k}"] = " ".join(combo)
+    return files, flags
+
+
+def _reset_peak_rss():
+    """Reset the RSS high-water mark of the process, return whether it
+    could be reset."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_case(case, dtb_size, mkimage):
+    """Run one case, return its result dict."""
+    sys.path[:0] = [LIB_DIR, TESTS_DIR]
+    import standins
+    standins.install()
+    from qcom.dtb_only_fitimage import QcomItsNodeRoot
+    from qcom.fit_compat import FitCompatIndex, dt_id
+
+    bases, groups, compats = (int(x) for x in case.split(":"))
+    kernel_devicetree, flags = synthesise(bases, groups, compats)
+    phases = {}
+    rss_scope = "phase"
+
+    def phase(name, func, *args):
+        nonlocal rss_scope
+        if not _reset_peak_rss():
+            rss_scope = "process"
+        start = time.perf_counter()
+        ret = func(*args)
+        phases[name] = {"seconds": time.perf_counter() - start,
+                        "peak_rss_kib": _peak_rss_kib()}
+        return ret
+
+    with tempfile.TemporaryDirectory(prefix="bench-fitimage-") as work:
+        dtb_dir = os.path.join(work, "dtbs")
+        os.makedirs(dtb_dir)
+        payload = os.urandom(dtb_size)
+        for fname in ["qcom-metadata.dtb"] + [os.path.basename(f) for f in kernel_devicetree]:
+            with open(os.path.join(dtb_dir, fname), "wb") as f:
+                f.write(payload)
+
+        root = QcomItsNodeRoot("QCOM DTB-only FIT image benchmark", "1", "conf-",
+                               mkimage=mkimage)
+        root.set_extra_opts("-E -B 8")
+        index = phase("index", FitCompatIndex, kernel_devicetree, flags)
+
+        def emit_dtbs():
+            root.fitimage_emit_section_dtb("qcom-metadata.dtb",
+                                           os.path.join(dtb_dir, "qcom-metadata.dtb"),
+                                           compatible_str=None, dtb_type="qcom_metadata")
+            for fname in index.files:
+                dtb_id = dt_id(fname)
+                compatible = ""
+                if fname.endswith(".dtb"):
+                    compatible = " ".join(index.base_compatibles(dtb_id))
+                root.fitimage_emit_section_dtb(dtb_id, os.path.join(dtb_dir, fname),
+                                               compatible_str=compatible,
+                                               dtb_type="flat_dt")
+
+        phase("emit-dtb", emit_dtbs)
+        phase("emit-config", root.fitimage_emit_section_qcomconfig, index)
+        its = os.path.join(work, "fit.its")
+        phase("write-its", root.write_its_file, its)
+
+        sizes = {"its": os.path.getsize(its)}
+        fit = os.path.join(work, "fit-python.bin")
+        phase("fit-python", root.write_fit_file, its, fit)
+        sizes["fit-python"] = os.path.getsize(fit)
+        if mkimage:
+            fit = os.path.join(work, "fit-mkimage.bin")
+            phase("fit-mkimage", root.run_mkimage_assemble, its, fit)
+            sizes["fit-mkimage"] = os.path.getsize(fit)
+
+    return {
+        "case": case,
+        "bases": bases,
+        "overlay_groups": groups,
+        "compatibles": compats,
+        "dtbs": len(kernel_devicetree) + 1,
+        "configurations": len(root.configurations.sub_nodes),
+        "phases": phases,
+        "peak_rss_scope": rss_scope,
+        "sizes": sizes,
+    }
+
+
+def merge_runs(runs):
+    """Merge repeated results of a case: minimum time and maximum peak RSS
+    of each phase, with all the time samples."""
+    result = dict(runs[0])
+    result["phases"] = {}
+    for name in runs[0]["phases"]:
+        samples = [run["phases"][name] for run in runs]
+        result["phases"][name] = {
+            "seconds": min(p["seconds"] for p in samples),
+            "peak_rss_kib": max(p["peak_rss_kib"] for p in samples),
+            "samples": [p["seconds"] for p in samples],
+        }
+    if any(run["peak_rss_scope"] != "phase" for run in runs):
+        result["peak_rss_scope"] = "process"
+    return result
+
+
+def _revision():
+    try:
+        return subprocess.run(["git", "-C", LIB_DIR, "describe", "--always", "--dirty"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold, min_seconds):
+    """Print the time ratios of *new* to *old*, return the regressions.
+
+    Phases under *min_seconds* in both results are not checked.
+    """
+    regressions = []
+    old_cases = {c["case"]: c for c in old["cases"]}
+    for case in new["cases"]:
+        prev = old_cases.get(case["case"])
+        if not prev:
+            continue
+        for name, result in case["phases"].items():
+            before = prev["phases"].get(name, {}).get("seconds")
+            if not before:
+                continue
+            ratio = result["seconds"] / before
+            flag = ""
+            if max(before, result["seconds"]) < min_seconds:
+                flag = "  (below --min-seconds)"
+            elif ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append((case["case"], name, ratio))
+            print(f"{case['case']:>12} {name:<12} {before:9.3f}s -> "
+                  f"{result['seconds']:9.3f}s  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DTB-only FIT image scaling benchmark")
+    parser.add_argument("--case", action="append",
+                        help="N:M:K - base DTBs, overlay groups per base, compatibles "
+                             "per base and group (default: %s)" % " ".join(DEFAULT_CASES))
+    parser.add_argument("--dtb-size", type=int, default=64 * 1024,
+                        help="size of each synthesised DTB payload in bytes")
+    parser.add_argument("--mkimage", default=shutil.which("mkimage"),
+                        help="mkimage to time (default: from PATH, skipped if missing)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of each case, the fastest of which is kept")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="previous JSON results to compare with")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="time ratio reported as a regression by --compare")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="phases shorter than this in both results are not "
+                             "checked by --compare")
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    results = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "dtb_size": args.dtb_size,
+        "repeat": args.repeat,
+        "cases": [],
+    }
+    ctx = multiprocessing.get_context("spawn")
+    for case in args.case or DEFAULT_CASES:
+        runs = []
+        for _ in range(args.repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                runs.append(pool.submit(run_case, case, args.dtb_size, args.mkimage).result())
+        result = merge_runs(runs)
+        results["cases"].append(result)
+        print(f"{case:>12}: {result['dtbs']} DTBs, {result['configurations']} configurations, "
+              f"ITS {result['sizes']['its']} bytes")
+        for name, phase in result["phases"].items():
+            print(f"{'':>12}  {name:<12} {phase['seconds']:9.3f}s  "
+                  f"peak RSS {phase['peak_rss_kib'] // 1024} MiB")
+        if result["peak_rss_scope"] != "phase":
+            print(f"{'':>12}  (peak RSS of the process, not of each phase)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(json.load(f), results, args.threshold, args.min_seconds):
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# Plain pytest tier for the qcom python modules, runnable without a BitBake
+# build directory:
+#
+#   python3 -m pytest lib/qcom/tests
+#
+# The layer lib directory is put on sys.path and the stand-ins of
+# standins.py replace `bb` and `oe.fitimage` when they are not available.
+
+import os
+import sys
+
+LIB_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if LIB_DIR not in sys.path:
+    sys.path.insert(0, LIB_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import standins  # noqa: E402
+
+standins.install()
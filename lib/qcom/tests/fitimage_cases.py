@@ -0,0 +1,125 @@
+#
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Reference cases of the DTB-only FIT generator, shared by the plain pytest
+# tier (test_dtb_only_fitimage.py) and QcomFitImageTests
+# (lib/oeqa/selftest/cases/qcom_fitimage.py). Data only: each tier builds
+# and parses the ITS with its own helpers.
+
+# Reference cases: name -> (KERNEL_DEVICETREE, FIT_DTB_COMPATIBLE,
+# expected [(compatible, fdt)] in configuration order).
+CASES = {
+    "single_dtb_single_compat": (
+        "myboard.dtb",
+        {"qcom_myboard-idp": "myboard"},
+        [("qcom,myboard-idp", ("fdt-myboard.dtb",))]),
+    "single_dtb_multi_compat": (
+        "qcs6490-rb3gen2.dtb",
+        {"qcom_qcs5430-iot": "qcs6490-rb3gen2",
+         "qcom_qcs6490-iot": "qcs6490-rb3gen2"},
+        [("qcom,qcs5430-iot", ("fdt-qcs6490-rb3gen2.dtb",)),
+         ("qcom,qcs6490-iot", ("fdt-qcs6490-rb3gen2.dtb",))]),
+    "dtb_with_single_overlay": (
+        "qcs6490-rb3gen2.dtb qcs6490-rb3gen2-vision-mezzanine.dtbo",
+        {"qcom_qcs6490-iot": "qcs6490-rb3gen2",
+         "qcom_qcs6490-iot-subtype2": "qcs6490-rb3gen2 qcs6490-rb3gen2-vision-mezzanine"},
+        [("qcom,qcs6490-iot", ("fdt-qcs6490-rb3gen2.dtb",)),
+         ("qcom,qcs6490-iot-subtype2", ("fdt-qcs6490-rb3gen2.dtb",
+                                        "fdt-qcs6490-rb3gen2-vision-mezzanine.dtbo"))]),
+    "dtb_with_multiple_overlays": (
+        "lemans-evk.dtb lemans-evk-camx.dtbo lemans-el2.dtbo lemans-camx-el2.dtbo",
+        {"qcom_qcs9075-iot": "lemans-evk",
+         "qcom_qcs9075-iot-camx-el2kvm": "lemans-evk lemans-evk-camx lemans-el2 lemans-camx-el2",
+         "qcom_qcs9075-socv2.0-iot-camx-el2kvm":
+             "lemans-evk lemans-evk-camx lemans-el2 lemans-camx-el2"},
+        [("qcom,qcs9075-iot", ("fdt-lemans-evk.dtb",)),
+         ("qcom,qcs9075-iot-camx-el2kvm",
+          ("fdt-lemans-evk.dtb", "fdt-lemans-evk-camx.dtbo", "fdt-lemans-el2.dtbo",
+           "fdt-lemans-camx-el2.dtbo")),
+         ("qcom,qcs9075-socv2.0-iot-camx-el2kvm",
+          ("fdt-lemans-evk.dtb", "fdt-lemans-evk-camx.dtbo", "fdt-lemans-el2.dtbo",
+           "fdt-lemans-camx-el2.dtbo"))]),
+    "metadata_node_excluded_from_configs": (
+        "simple.dtb",
+        {"qcom_simple-evk": "simple"},
+        [("qcom,simple-evk", ("fdt-simple.dtb",))]),
+    "overlay_filtering_by_kernel_devicetree": (
+        # overlay DTBO not listed: the overlay combo is dropped
+        "base.dtb",
+        {"qcom_base-iot": "base",
+         "qcom_base-iot-subtype2": "base missing-overlay"},
+        [("qcom,base-iot", ("fdt-base.dtb",))]),
+    "fdt_linkage_validity": (
+        "board.dtb camx.dtbo el2.dtbo",
+        {"qcom_board-iot": "board",
+         "qcom_board-iot-subtype2": "board camx",
+         "qcom_board-iot-el2kvm": "board camx el2"},
+        [("qcom,board-iot", ("fdt-board.dtb",)),
+         ("qcom,board-iot-subtype2", ("fdt-board.dtb", "fdt-camx.dtbo")),
+         ("qcom,board-iot-el2kvm", ("fdt-board.dtb", "fdt-camx.dtbo", "fdt-el2.dtbo"))]),
+    "compatible_string_format": (
+        "qcs6490-rb3gen2.dtb qcs6490-rb3gen2-vision-mezzanine.dtbo",
+        {"qcom_qcs6490-iot": "qcs6490-rb3gen2",
+         "qcom_qcs5430-iot": "qcs6490-rb3gen2",
+         "qcom_qcs6490-iot-subtype2": "qcs6490-rb3gen2 qcs6490-rb3gen2-vision-mezzanine",
+         "qcom_qcs5430-iot-subtype2": "qcs6490-rb3gen2 qcs6490-rb3gen2-vision-mezzanine"},
+        [("qcom,qcs6490-iot", ("fdt-qcs6490-rb3gen2.dtb",)),
+         ("qcom,qcs5430-iot", ("fdt-qcs6490-rb3gen2.dtb",)),
+         ("qcom,qcs6490-iot-subtype2", ("fdt-qcs6490-rb3gen2.dtb",
+                                        "fdt-qcs6490-rb3gen2-vision-mezzanine.dtbo")),
+         ("qcom,qcs5430-iot-subtype2", ("fdt-qcs6490-rb3gen2.dtb",
+                                        "fdt-qcs6490-rb3gen2-vision-mezzanine.dtbo"))]),
+    "dtbo_no_standalone_config": (
+        "base.dtb overlay1.dtbo overlay2.dtbo",
+        {"qcom_base-iot": "base",
+         "qcom_base-iot-subtype1": "base overlay1",
+         "qcom_base-iot-subtype2": "base overlay2"},
+        [("qcom,base-iot", ("fdt-base.dtb",)),
+         ("qcom,base-iot-subtype1", ("fdt-base.dtb", "fdt-overlay1.dtbo")),
+         ("qcom,base-iot-subtype2", ("fdt-base.dtb", "fdt-overlay2.dtbo"))]),
+    "multiple_base_dtbs_with_overlays": (
+        "boardA.dtb boardA-cam.dtbo boardB.dtb boardB-cam.dtbo",
+        {"qcom_boardA-iot": "boardA",
+         "qcom_boardA-iot-subtype2": "boardA boardA-cam",
+         "qcom_boardB-idp": "boardB",
+         "qcom_boardB-idp-subtype2": "boardB boardB-cam"},
+        [("qcom,boardA-iot", ("fdt-boardA.dtb",)),
+         ("qcom,boardA-iot-subtype2", ("fdt-boardA.dtb", "fdt-boardA-cam.dtbo")),
+         ("qcom,boardB-idp", ("fdt-boardB.dtb",)),
+         ("qcom,boardB-idp-subtype2", ("fdt-boardB.dtb", "fdt-boardB-cam.dtbo"))]),
+    "base_dtb_only_in_overlay": (
+        # No standalone base entry, the DTB is only referenced via overlays
+        "base.dtb overlay.dtbo",
+        {"qcom_base-iot-subtype2": "base overlay"},
+        [("qcom,base-iot-subtype2", ("fdt-base.dtb", "fdt-overlay.dtbo"))]),
+    "comma_in_dtb_name": (
+        "qcom/vendor,board.dtb qcom/vendor,board-cam.dtbo",
+        {"qcom_board-iot": "vendor,board",
+         "qcom_board-iot-subtype1": "vendor,board vendor,board-cam"},
+        [("qcom,board-iot", ("fdt-vendor_board.dtb",)),
+         ("qcom,board-iot-subtype1", ("fdt-vendor_board.dtb", "fdt-vendor_board-cam.dtbo"))]),
+    "mkimage_compile": (
+        "testboard.dtb testboard-cam.dtbo",
+        {"qcom_testboard-iot": "testboard",
+         "qcom_testboard-iot-subtype2": "testboard testboard-cam"},
+        [("qcom,testboard-iot", ("fdt-testboard.dtb",)),
+         ("qcom,testboard-iot-subtype2", ("fdt-testboard.dtb", "fdt-testboard-cam.dtbo"))]),
+    "python_assemble_matches_mkimage": (
+        "boardA.dtb boardA-cam.dtbo boardA-el2.dtbo boardB.dtb boardB-cam.dtbo",
+        {"qcom_boardA-iot": "boardA",
+         "qcom_boardA-idp": "boardA",
+         "qcom_boardA-iot-subtype2": "boardA boardA-cam",
+         "qcom_boardA-iot-camx-el2kvm": "boardA boardA-cam boardA-el2",
+         "qcom_boardB-iot": "boardB",
+         "qcom_boardB-iot-subtype2": "boardB boardB-cam"},
+        [("qcom,boardA-iot", ("fdt-boardA.dtb",)),
+         ("qcom,boardA-idp", ("fdt-boardA.dtb",)),
+         ("qcom,boardA-iot-subtype2", ("fdt-boardA.dtb", "fdt-boardA-cam.dtbo")),
+         ("qcom,boardA-iot-camx-el2kvm",
+          ("fdt-boardA.dtb", "fdt-boardA-cam.dtbo", "fdt-boardA-el2.dtbo")),
+         ("qcom,boardB-iot", ("fdt-boardB.dtb",)),
+         ("qcom,boardB-iot-subtype2", ("fdt-boardB.dtb", "fdt-boardB-cam.dtbo"))]),
+}
+
@@ -0,0 +1,189 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+# Copyright OpenEmbedded Contributors
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# Minimal stand-ins for the BitBake `bb` module and OE-Core's `oe.fitimage`,
+# so the qcom FIT modules can be unit tested with plain pytest outside of a
+# build directory. The ItsNode classes reproduce the node tree and the ITS
+# text emitted by oe.fitimage for the subset used by QcomItsNodeRoot (no
+# hashing, signing or kernel/ramdisk nodes).
+#
+# install() only registers a stand-in for the modules that cannot be
+# imported, so the real ones are used when the tests run from a BitBake
+# environment.
+
+import fcntl
+import importlib
+import os
+import sys
+import types
+
+
+class BBFatal(Exception):
+    pass
+
+
+def _fatal(msg):
+    raise BBFatal(msg)
+
+
+class ItsNode:
+    INDENT_SIZE = 8
+
+    def __init__(self, name, parent_node, sub_nodes=None, properties=None):
+        self.name = name
+        self.parent_node = parent_node
+        self.sub_nodes = sub_nodes or []
+        self.properties = properties or {}
+        if parent_node:
+            parent_node.add_sub_node(self)
+
+    def add_sub_node(self, sub_node):
+        self.sub_nodes.append(sub_node)
+
+    def add_property(self, key, value):
+        self.properties[key] = value
+
+    def emit(self, f, indent):
+        indent_str_name = " " * indent
+        indent_str_props = " " * (indent + self.INDENT_SIZE)
+        f.write("%s%s {\n" % (indent_str_name, self.name))
+        for key, value in self.properties.items():
+            if isinstance(value, int):
+                f.write(indent_str_props + key + ' = <0x%x>;\n' % value)
+            elif isinstance(value, list):
+                if len(value) == 0:
+                    f.write(indent_str_props + key + ' = "";\n')
+                elif isinstance(value[0], int):
+                    list_entries = ' '.join('0x%x' % entry for entry in value)
+                    f.write(indent_str_props + key + ' = <%s>;\n' % list_entries)
+                else:
+                    list_entries = ', '.join('"%s"' % entry for entry in value)
+                    f.write(indent_str_props + key + ' = %s;\n' % list_entries)
+            elif isinstance(value, str):
+                if key == "data" and value.startswith('/incbin/('):
+                    f.write(indent_str_props + key + ' = %s;\n' % value)
+                elif value.startswith("<") and value.endswith(">"):
+                    f.write(indent_str_props + key + ' = %s;\n' % value)
+                else:
+                    f.write(indent_str_props + key + ' = "%s";\n' % value)
+            else:
+                _fatal("%s has unexpected data type." % str(value))
+        for sub_node in self.sub_nodes:
+            sub_node.emit(f, indent + self.INDENT_SIZE)
+        f.write(indent_str_name + '};\n')
+
+
+class ItsNodeImages(ItsNode):
+    def __init__(self, parent_node):
+        super().__init__("images", parent_node)
+
+
+class ItsNodeConfigurations(ItsNode):
+    def __init__(self, parent_node):
+        super().__init__("configurations", parent_node)
+
+
+class ItsNodeImage(ItsNode):
+    def __init__(self, name, parent_node, description, type, compression,
+                 sub_nodes=None, opt_props=None):
+        properties = {
+            "description": description,
+            "type": type,
+            "compression": compression,
+        }
+        if opt_props:
+            properties.update(opt_props)
+        super().__init__(name, parent_node, sub_nodes, properties)
+
+
+class ItsNodeDtb(ItsNodeImage):
+    def __init__(self, name, parent_node, description, type, compression,
+                 sub_nodes=None, opt_props=None, compatible=None):
+        super().__init__(name, parent_node, description, type, compression,
+                         sub_nodes, opt_props)
+        self.compatible = compatible
+
+
+class ItsNodeConfiguration(ItsNode):
+    def __init__(self, name, parent_node, description, sub_nodes=None, opt_props=None):
+        properties = {"description": description}
+        if opt_props:
+            properties.update(opt_props)
+        super().__init__(name, parent_node, sub_nodes, properties)
+
+
+class ItsNodeRootKernel(ItsNode):
+    def __init__(self, description, address_cells, host_prefix, arch, fit_os,
+                 conf_prefix, mkimage=None, mkimage_dtcopts=None, **kwargs):
+        props = {
+            "description": description,
+            "#address-cells": f"<{address_cells}>",
+        }
+        super().__init__("/", None, properties=props)
+        self.images = ItsNodeImages(self)
+        self.configurations = ItsNodeConfigurations(self)
+        self._host_prefix = host_prefix
+        self._arch = arch
+        self._fit_os = fit_os
+        self._conf_prefix = conf_prefix
+        self._mkimage = mkimage
+        self._mkimage_dtcopts = mkimage_dtcopts
+
+    def write_its_file(self, itsfile):
+        with open(itsfile, 'w') as f:
+            f.write("/dts-v1/;\n\n")
+            self.emit(f, 0)
+
+    def its_add_node_dtb(self, image_id, description, image_type, compression,
+                         opt_props, compatible):
+        return ItsNodeDtb(image_id, self.images, description, image_type,
+                          compression, opt_props=opt_props, compatible=compatible)
+
+
+def _lockfile(name, shared=False, retry=True, block=False):
+    f = open(name, "a+")
+    fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    return f
+
+
+def _unlockfile(lf):
+    fcntl.flock(lf.fileno(), fcntl.LOCK_UN)
+    lf.close()
+
+
+def _make_bb():
+    bb = types.ModuleType("bb")
+    bb.note = bb.plain = bb.warn = bb.error = lambda *args, **kwargs: None
+    bb.debug = lambda level, *args, **kwargs: None
+    bb.fatal = _fatal
+    bb.utils = types.ModuleType("bb.utils")
+    bb.utils.lockfile = _lockfile
+    bb.utils.unlockfile = _unlockfile
+    bb.utils.mkdirhier = lambda directory: os.makedirs(directory, exist_ok=True)
+    return bb
+
+
+def _make_oe():
+    oe = types.ModuleType("oe")
+    oe.__path__ = []
+    fitimage = types.ModuleType("oe.fitimage")
+    for cls in (ItsNode, ItsNodeImages, ItsNodeConfigurations, ItsNodeImage,
+                ItsNodeDtb, ItsNodeConfiguration, ItsNodeRootKernel):
+        setattr(fitimage, cls.__name__, cls)
+    oe.fitimage = fitimage
+    return {"oe": oe, "oe.fitimage": fitimage}
+
+
+def install():
+    """Register the stand-ins for `bb` and `oe.fitimage` where missing."""
+    try:
+        importlib.import_module("bb")
+    except ImportError:
+        bb = _make_bb()
+        sys.modules.update({"bb": bb, "bb.utils": bb.utils})
+    try:
+        importlib.import_module("oe.fitimage")
+    except ImportError:
+        sys.modules.update(_make_oe())
@@ -0,0 +1,201 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for qcom.android_sparse.
+#
+# The sparse images are expanded again by a reference decoder following the
+# format of libsparse, and by simg2img when it is on PATH, and compared with
+# the raw source.
+
+import os
+import random
+import shutil
+import struct
+import subprocess
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import qcom.android_sparse as android_sparse
+from qcom.android_sparse import (CHUNK_TYPE_DONT_CARE, CHUNK_TYPE_FILL, CHUNK_TYPE_RAW,
+                                 SPARSE_HEADER_MAGIC, mark_sparse_programs,
+                                 write_sparse_image)
+
+MiB = 1024 * 1024
+
+
+def decode_sparse(path):
+    """Return (raw bytes, [(chunk type, blocks)]) of an Android sparse image."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    (magic, major, minor, file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks,
+     total_chunks, _) = struct.unpack_from('<IHHHHIIII', data)
+    assert (magic, major, minor) == (SPARSE_HEADER_MAGIC, 1, 0)
+    assert (file_hdr_sz, chunk_hdr_sz) == (28, 12)
+    assert blk_sz % 4 == 0
+
+    out = bytearray()
+    chunks = []
+    off = file_hdr_sz
+    for _ in range(total_chunks):
+        chunk_type, _, blocks, total_sz = struct.unpack_from('<HHII', data, off)
+        payload = data[off + chunk_hdr_sz:off + total_sz]
+        if chunk_type == CHUNK_TYPE_RAW:
+            assert len(payload) == blocks * blk_sz
+            out += payload
+        elif chunk_type == CHUNK_TYPE_FILL:
+            assert len(payload) == 4
+            out += payload * (blocks * blk_sz // 4)
+        elif chunk_type == CHUNK_TYPE_DONT_CARE:
+            assert not payload
+            out += bytes(blocks * blk_sz)
+        else:
+            raise AssertionError(f"Unknown chunk type {chunk_type:#x}")
+        assert blocks
+        # Adjacent holes would have been merged
+        if chunks and chunk_type == CHUNK_TYPE_DONT_CARE:
+            assert chunks[-1][0] != CHUNK_TYPE_DONT_CARE
+        chunks.append((chunk_type, blocks))
+        off += total_sz
+    assert off == len(data)
+    assert len(out) == total_blks * blk_sz
+    return bytes(out), chunks
+
+
+def _supports_holes(path):
+    try:
+        with open(path, 'rb') as f:
+            return os.lseek(f.fileno(), 0, os.SEEK_DATA) > 0
+    except OSError:
+        return False
+
+
+def make_raw(path, block_size, tail):
+    """Write a raw image with holes, fill and raw blocks and a *tail* of
+    bytes after the last whole block, return its content."""
+    rng = random.Random(block_size + tail)
+    layout = [
+        ('hole', 3),
+        ('raw', 5),
+        ('fill', b'\xef\xbe\xad\xde', 4),
+        ('fill', b'\0\0\0\0', 2),       # written zeros, not a hole
+        ('raw', 1),
+        ('fill', b'\xef\xbe\xad\xde', 1),
+        ('hole', 7),
+        # Crosses the 1 MiB read batches of write_sparse_image
+        ('raw', (2 * MiB) // block_size + 3),
+        ('hole', (2 * MiB) // block_size),
+    ]
+    with open(path, 'wb') as f:
+        for kind, *args in layout:
+            if kind == 'hole':
+                f.seek(args[0] * block_size, os.SEEK_CUR)
+            elif kind == 'raw':
+                f.write(rng.randbytes(args[0] * block_size))
+            else:
+                f.write(args[0] * (args[1] * block_size // 4))
+        f.write(rng.randbytes(tail))
+        f.truncate()
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("block_size,tail", [(4096, 0), (4096, 1000), (512, 3)])
+def test_round_trip(tmp_path, block_size, tail):
+    raw = str(tmp_path / "rootfs.ext4")
+    content = make_raw(raw, block_size, tail)
+    simg = str(tmp_path / "rootfs.img")
+    stats = write_sparse_image(raw, simg, block_size)
+
+    decoded, chunks = decode_sparse(simg)
+    padded = content + bytes(-len(content) % block_size)
+    assert decoded == padded
+    assert stats.blocks == len(padded) // block_size
+    assert stats.size == os.path.getsize(simg)
+    assert stats.raw_blocks + stats.fill_blocks + stats.dont_care_blocks == stats.blocks
+
+    types = {t for t, _ in chunks}
+    assert {CHUNK_TYPE_RAW, CHUNK_TYPE_FILL} <= types
+    assert stats.fill_blocks >= 7
+    if _supports_holes(raw):
+        assert CHUNK_TYPE_DONT_CARE in types
+        assert stats.dont_care_blocks >= 3 + 7
+
+
+def test_only_hole(tmp_path):
+    raw = tmp_path / "empty.ext4"
+    with open(raw, 'wb') as f:
+        f.truncate(10 * 4096 + 1)
+    simg = str(tmp_path / "empty.img")
+    write_sparse_image(str(raw), simg)
+    decoded, _ = decode_sparse(simg)
+    assert decoded == bytes(11 * 4096)
+
+
+def test_raw_chunk_split(tmp_path, monkeypatch):
+    monkeypatch.setattr(android_sparse, "_MAX_RAW_CHUNK", 8 * 4096)
+    raw = tmp_path / "data.ext4"
+    raw.write_bytes(random.Random(1).randbytes(20 * 4096))
+    simg = str(tmp_path / "data.img")
+    write_sparse_image(str(raw), simg)
+    decoded, chunks = decode_sparse(simg)
+    assert decoded == raw.read_bytes()
+    assert chunks == [(CHUNK_TYPE_RAW, 8), (CHUNK_TYPE_RAW, 8), (CHUNK_TYPE_RAW, 4)]
+
+
+def test_invalid_block_size(tmp_path):
+    raw = tmp_path / "data.ext4"
+    raw.write_bytes(b'x')
+    with pytest.raises(ValueError):
+        write_sparse_image(str(raw), str(tmp_path / "data.img"), 4098)
+
+
+@pytest.mark.skipif(not shutil.which("simg2img"), reason="simg2img not found")
+def test_simg2img(tmp_path):
+    raw = str(tmp_path / "rootfs.ext4")
+    content = make_raw(raw, 4096, 1000)
+    simg = str(tmp_path / "rootfs.img")
+    write_sparse_image(raw, simg)
+    out = tmp_path / "rootfs.out"
+    subprocess.run(["simg2img", simg, str(out)], check=True)
+    assert out.read_bytes() == content + bytes(-len(content) % 4096)
+
+
+RAWPROGRAM = """\
+<?xml version="1.0" ?>
+<data>
+  <!--NOTE: This is an ** Autogenerated file **-->
+  <program SECTOR_SIZE_IN_BYTES="4096" file_sector_offset="0" filename="efi.bin" label="efi" num_partition_sectors="131072" physical_partition_number="0" start_sector="6"/>
+  <program SECTOR_SIZE_IN_BYTES="4096" file_sector_offset="0" filename="rootfs.img" label="system" num_partition_sectors="2621440" physical_partition_number="0" start_sector="131078"/>
+  <program SECTOR_SIZE_IN_BYTES="4096" filename="rootfs.img.bak" label="backup" sparse="false" start_sector="1"/>
+  <program SECTOR_SIZE_IN_BYTES="4096" filename="" label="misc" start_sector="2"/>
+  <program SECTOR_SIZE_IN_BYTES="4096" label="nofile" start_sector="3"/>
+  <program
+      SECTOR_SIZE_IN_BYTES="4096" filename="userdata.img" label="userdata"
+      sparse="false" start_sector="4"/>
+  <patch filename="rootfs.img" start_sector="5"/>
+</data>
+"""
+
+
+def test_mark_sparse_programs():
+    xml, changed = mark_sparse_programs(RAWPROGRAM, {"rootfs.img", "userdata.img"})
+    assert changed == 2
+
+    sparse = {p.get("label"): p.get("sparse") for p in ET.fromstring(xml).iter("program")}
+    assert sparse == {"efi": None, "system": "true", "backup": "false", "misc": None,
+                      "nofile": None, "userdata": "true"}
+    assert "sparse" not in ET.fromstring(xml).find("patch").attrib
+
+    # Only the matching tags are edited, the rest of the text is kept
+    changed_lines = [(a, b) for a, b in zip(RAWPROGRAM.splitlines(), xml.splitlines())
+                     if a != b]
+    assert len(xml.splitlines()) == len(RAWPROGRAM.splitlines())
+    assert [b.replace(' sparse="true"', '') for _, b in changed_lines] == \
+        [a.replace(' sparse="false"', '') for a, _ in changed_lines]
+    assert len(changed_lines) == 2
+
+
+def test_mark_sparse_programs_unchanged():
+    assert mark_sparse_programs(RAWPROGRAM, {"other.img"}) == (RAWPROGRAM, 0)
@@ -0,0 +1,79 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for qcom.content_cache.
+
+import os
+
+from qcom.content_cache import ContentCache, manifest_key
+
+
+def _write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_store_and_fetch_copy(tmp_path):
+    cache = ContentCache(str(tmp_path / "cache"), 0)
+    src = str(tmp_path / "out.bin")
+    _write(src, b"generated")
+    key = manifest_key({"input": 1})
+    cache.store(key, {"out.bin": src}, {"input": 1})
+
+    # An in-place write to the build output must not reach the entry
+    with open(src, 'r+b') as f:
+        f.write(b"G")
+    dst = str(tmp_path / "fetched.bin")
+    assert cache.fetch(key, {"out.bin": dst})
+    assert _read(dst) == b"generated"
+    assert os.stat(dst).st_ino != os.stat(src).st_ino
+
+    with open(dst, 'r+b') as f:
+        f.write(b"G")
+    assert cache.fetch(key, {"out.bin": dst})
+    assert _read(dst) == b"generated"
+
+
+def test_fetch_miss(tmp_path):
+    cache = ContentCache(str(tmp_path / "cache"), 0)
+    dst = str(tmp_path / "fetched.bin")
+    assert not cache.fetch(manifest_key({"input": 2}), {"out.bin": dst})
+    assert not os.path.lexists(dst)
+
+
+def test_fetch_incomplete_entry(tmp_path):
+    """An entry losing files (e.g. evicted by another build) is a miss and
+    leaves no partially populated destinations."""
+    cache = ContentCache(str(tmp_path / "cache"), 0)
+    a, b = str(tmp_path / "a"), str(tmp_path / "b")
+    _write(a, b"a")
+    _write(b, b"b")
+    key = manifest_key({"input": 3})
+    cache.store(key, {"a": a, "b": b}, {"input": 3})
+    os.unlink(os.path.join(str(tmp_path / "cache"), key, "b"))
+
+    dests = {"a": str(tmp_path / "a.out"), "b": str(tmp_path / "b.out")}
+    assert not cache.fetch(key, dests)
+    assert not any(os.path.lexists(p) for p in dests.values())
+    assert sorted(os.listdir(tmp_path)) == ["a", "b", "cache"]
+
+
+def test_evict_lru(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    cache = ContentCache(cache_dir, 2048)
+    keys = []
+    for i in range(3):
+        src = str(tmp_path / f"out{i}")
+        _write(src, bytes(1024))
+        keys.append(manifest_key({"input": i}))
+        cache.store(keys[-1], {"out": src}, {"input": i})
+        os.utime(os.path.join(cache_dir, keys[-1]), (i, i))
+    cache.evict()
+    assert not os.path.isdir(os.path.join(cache_dir, keys[0]))
+    assert os.path.isdir(os.path.join(cache_dir, keys[2]))
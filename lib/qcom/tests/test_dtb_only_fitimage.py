@@ -0,0 +1,244 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for QcomItsNodeRoot and FitCompatIndex.
+#
+# The reference cases of fitimage_cases.py, shared with QcomFitImageTests
+# (lib/oeqa/selftest/cases/qcom_fitimage.py), run here without BitBake,
+# plus generated KERNEL_DEVICETREE / FIT_DTB_COMPATIBLE sets of up to
+# thousands of DTBs, checked against an independent model of the expected
+# configurations. The generated sets are seeded, so every failure can be
+# reproduced from its test id.
+
+import os
+import random
+import re
+import struct
+import time
+
+import pytest
+
+from qcom.dtb_only_fitimage import QcomItsNodeRoot
+from qcom.fit_compat import FitCompatIndex, dt_id
+
+from fitimage_cases import CASES
+
+# Optional time budget in seconds for emitting the configurations of the
+# largest generated sets. Wall-clock limits are unreliable on loaded hosts,
+# so it is only checked when set, e.g. QCOM_FIT_SCALE_BUDGET=20.
+SCALE_BUDGET = os.environ.get("QCOM_FIT_SCALE_BUDGET")
+
+
+def build_its(test_dir, kernel_devicetree, fit_dtb_compatible, fit_name=None,
+              mkimage_extra_opts=None, timestamp=None, create_files=False):
+    """Run the dtb-fit-image.bbclass logic, return (its_path, parsed, seconds).
+
+    *seconds* is the time spent emitting the nodes, without file I/O.
+    """
+    dtb_dir = os.path.join(test_dir, 'dtbs')
+    its_path = os.path.join(test_dir, 'qclinux-fit-image.its')
+    os.makedirs(dtb_dir, exist_ok=True)
+
+    def dummy(path):
+        if create_files:
+            with open(path, 'wb') as f:
+                f.write(os.urandom(128))
+
+    start = time.perf_counter()
+    root_node = QcomItsNodeRoot("QCOM DTB-only FIT image for testing", "1", "conf-")
+
+    meta_path = os.path.join(dtb_dir, 'qcom-metadata.dtb')
+    dummy(meta_path)
+    root_node.fitimage_emit_section_dtb("qcom-metadata.dtb", meta_path,
+                                        compatible_str=None, dtb_type="qcom_metadata")
+
+    compat_index = FitCompatIndex(kernel_devicetree.split(), fit_dtb_compatible)
+    for fname in sorted(compat_index.files):
+        fpath = os.path.join(dtb_dir, fname)
+        dummy(fpath)
+        dtb_id = dt_id(fname)
+        compatible = ""
+        if fname.endswith(".dtb"):
+            compatible = " ".join(compat_index.base_compatibles(dtb_id))
+        root_node.fitimage_emit_section_dtb(dtb_id, fpath, compatible_str=compatible,
+                                            dtb_type="flat_dt")
+    root_node.fitimage_emit_section_qcomconfig(compat_index)
+    seconds = time.perf_counter() - start
+
+    root_node.write_its_file(its_path)
+    if fit_name:
+        root_node.set_extra_opts(mkimage_extra_opts)
+        root_node.write_fit_file(its_path, os.path.join(test_dir, fit_name),
+                                 timestamp=timestamp)
+    return its_path, parse_its(its_path), seconds
+
+
+def parse_its(its_path):
+    """Parse an ITS file into ``{images: {…}, configurations: {…}}``, keeping
+    the node order."""
+    images = {}
+    configs = {}
+    path = []
+    props = {}
+    with open(its_path) as f:
+        for line in f:
+            s = line.strip()
+            if not s or s == '/dts-v1/;':
+                continue
+            if s.endswith('{'):
+                path.append(s[:-1].strip())
+                if len(path) >= 3:
+                    props = {}
+            elif s == '};':
+                if len(path) == 3:
+                    parent, node = path[1], path[2]
+                    if parent == 'images':
+                        images[node] = dict(props)
+                    elif parent == 'configurations':
+                        configs[node] = dict(props)
+                path.pop()
+            elif '=' in s and s.endswith(';') and len(path) >= 3:
+                key, _, val = s.partition('=')
+                val = val.strip().rstrip(';').strip()
+                if '", "' in val:
+                    props[key.strip()] = re.findall(r'"([^"]*)"', val)
+                elif val.startswith('"') and val.endswith('"'):
+                    props[key.strip()] = val[1:-1]
+                else:
+                    props[key.strip()] = val
+    return {'images': images, 'configurations': configs}
+
+
+def config_list(parsed):
+    """Return [(compatible, fdt)] in configuration order, fdt as a tuple."""
+    result = []
+    for props in parsed['configurations'].values():
+        fdt = props['fdt']
+        result.append((props['compatible'], tuple(fdt) if isinstance(fdt, list) else (fdt,)))
+    return result
+
+
+def check_invariants(parsed):
+    images = parsed['images']
+    assert images['fdt-qcom-metadata.dtb']['type'] == 'qcom_metadata'
+    names = list(parsed['configurations'])
+    assert names == [f"conf-{i}" for i in range(1, len(names) + 1)]
+    for cname, (compat, fdt) in zip(names, config_list(parsed)):
+        assert compat.startswith("qcom,"), cname
+        assert fdt[0].endswith(".dtb"), f"{cname}: first fdt {fdt[0]} is not a .dtb"
+        assert all(ref.endswith(".dtbo") for ref in fdt[1:]), cname
+        assert 'fdt-qcom-metadata.dtb' not in fdt, cname
+        for ref in fdt:
+            assert ref in images, f"{cname}: fdt '{ref}' not found in images"
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_configurations(tmp_path, name):
+    kernel_devicetree, compat, expected = CASES[name]
+    _, parsed, _ = build_its(str(tmp_path), kernel_devicetree, compat)
+    check_invariants(parsed)
+    assert config_list(parsed) == expected
+    # metadata + one image per KERNEL_DEVICETREE entry
+    assert len(parsed['images']) == 1 + len(kernel_devicetree.split())
+
+
+def test_image_nodes(tmp_path):
+    _, parsed, _ = build_its(str(tmp_path), "board.dtb camx.dtbo",
+                             {"qcom_board-iot": "board"})
+    assert parsed['images']['fdt-board.dtb']['type'] == 'flat_dt'
+    assert parsed['images']['fdt-camx.dtbo']['type'] == 'flat_dt'
+    assert parsed['images']['fdt-board.dtb']['data'].startswith('/incbin/(')
+    # The compatible strings belong to the configurations only
+    assert 'compatible' not in parsed['images']['fdt-board.dtb']
+
+
+def test_python_assemble(tmp_path):
+    """The in-process writer produces an FDT with external data."""
+    its_path, parsed, _ = build_its(str(tmp_path), "board.dtb board-cam.dtbo",
+                                    {"qcom_board-iot": "board",
+                                     "qcom_board-iot-subtype2": "board board-cam"},
+                                    fit_name="fit.bin", mkimage_extra_opts="-E -B 8",
+                                    timestamp=1700000000, create_files=True)
+    with open(os.path.join(str(tmp_path), "fit.bin"), 'rb') as f:
+        data = f.read()
+    magic, totalsize = struct.unpack(">II", data[:8])
+    assert magic == 0xd00dfeed
+    # metadata + 2 DTBs of 128 bytes each follow the FDT, 8-byte aligned
+    assert len(data) >= ((totalsize + 7) & ~7) + 3 * 128
+    assert b"qcom,board-iot-subtype2" in data[:totalsize]
+
+
+# ----------------------------------------------------------------------
+# Generated sets
+# ----------------------------------------------------------------------
+
+def generate(seed, boards):
+    """Return (KERNEL_DEVICETREE, FIT_DTB_COMPATIBLE) for *boards* boards.
+
+    Boards have up to four overlays, some names contain commas, some
+    overlays are missing from KERNEL_DEVICETREE and some combinations name
+    unknown DTBs, so the filtering of FitCompatIndex is exercised too.
+    """
+    rng = random.Random(seed)
+    files = []
+    compat = {}
+    for b in range(boards):
+        base = f"soc{b % 7}-board{b}" if rng.random() < 0.9 else f"vendor,soc-board{b}"
+        files.append(f"qcom/{base}.dtb")
+        overlays = [f"{base}-ovl{o}" for o in range(rng.randint(0, 4))]
+        for ovl in overlays:
+            if rng.random() < 0.9:
+                files.append(f"qcom/{ovl}.dtbo")
+        for c in range(rng.randint(0, 3)):
+            compat[f"qcom_soc{b}-iot{c}"] = base
+        for c in range(rng.randint(0, 6)):
+            combo = rng.sample(overlays, rng.randint(1, len(overlays))) if overlays else []
+            compat[f"qcom_soc{b}-iot-subtype{c}"] = " ".join([base] + combo)
+        if rng.random() < 0.05:
+            compat[f"qcom_soc{b}-missing"] = f"unknown{b}"
+    rng.shuffle(files)
+    keys = list(compat)
+    rng.shuffle(keys)
+    return " ".join(files), {k: compat[k] for k in keys}
+
+
+def expected_configs(kernel_devicetree, compat):
+    """Model of the configurations QcomItsNodeRoot must emit, in order."""
+    files = {os.path.basename(f) for f in kernel_devicetree.split()}
+    known = {f.replace(',', '_') for f in files}
+    per_base = {}
+    for key, combo in compat.items():
+        parts = [os.path.basename(p).replace(',', '_') for p in combo.split()]
+        fdt = (parts[0] + ".dtb",) + tuple(p + ".dtbo" for p in parts[1:])
+        if not all(f in known for f in fdt):
+            continue
+        base_only, overlays = per_base.setdefault(fdt[0], ([], {}))
+        entry = ("qcom," + key[len("qcom_"):].replace('_', ','),
+                 tuple("fdt-" + f for f in fdt))
+        if len(fdt) == 1:
+            base_only.append(entry)
+        else:
+            overlays.setdefault(fdt[1:], []).append(entry)
+    result = []
+    for fname in sorted(files):
+        base_only, overlays = per_base.get(fname.replace(',', '_'), ([], {}))
+        result += base_only
+        for entries in overlays.values():
+            result += entries
+    return result
+
+
+@pytest.mark.parametrize("boards,seed",
+                         [(10, seed) for seed in range(25)]
+                         + [(200, seed) for seed in range(5)]
+                         + [(1000, 0), (3000, 1)])
+def test_generated(tmp_path, boards, seed):
+    kernel_devicetree, compat = generate(seed, boards)
+    _, parsed, seconds = build_its(str(tmp_path), kernel_devicetree, compat)
+    check_invariants(parsed)
+    assert config_list(parsed) == expected_configs(kernel_devicetree, compat)
+    assert len(parsed['images']) == 1 + len(kernel_devicetree.split())
+    if SCALE_BUDGET and boards >= 1000:
+        assert seconds < float(SCALE_BUDGET), \
+            f"emitting {len(parsed['configurations'])} configurations took {seconds:.1f}s"
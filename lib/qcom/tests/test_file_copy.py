@@ -0,0 +1,48 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for qcom.file_copy.
+
+import errno
+import os
+
+import pytest
+
+from qcom.file_copy import copy_file, data_extents
+
+
+def _write(path, data, hole=0):
+    with open(path, 'wb') as f:
+        f.write(data)
+        f.truncate(len(data) + hole)
+
+
+def test_data_extents_trailing_hole(tmp_path):
+    path = tmp_path / "img"
+    _write(path, b'x' * 4096, hole=1024 * 1024)
+    with open(path, 'rb') as f:
+        extents = data_extents(f.fileno(), os.fstat(f.fileno()).st_size)
+    # Filesystems without holes report the whole file as data
+    assert extents in ([(0, 4096)], [(0, 4096 + 1024 * 1024)])
+
+
+@pytest.mark.parametrize("err", [errno.EINVAL, errno.EOPNOTSUPP])
+def test_data_extents_no_seek_data(tmp_path, monkeypatch, err):
+    path = tmp_path / "img"
+    _write(path, b'x' * 8192)
+
+    def lseek(fd, pos, how):
+        if how in (os.SEEK_DATA, os.SEEK_HOLE):
+            raise OSError(err, os.strerror(err))
+        return real_lseek(fd, pos, how)
+
+    real_lseek = os.lseek
+    monkeypatch.setattr(os, "lseek", lseek)
+    with open(path, 'rb') as f:
+        assert data_extents(f.fileno(), 8192) == [(0, 8192)]
+
+    # The contents are copied, not replaced by holes
+    dst = tmp_path / "copy"
+    copy_file(str(path), str(dst))
+    assert dst.read_bytes() == b'x' * 8192
@@ -0,0 +1,204 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for the FvUpdate.xml generation of qcom.fvupdate.
+
+import hashlib
+import json
+import os
+
+import pytest
+
+from qcom.fvupdate import FwEntry, generate_fvupdate, lookup_digest, validate, write_fvupdate
+
+# CAPSULE_ENTRY_<name> flags, the dtb one as in firmware-qcom-capsule_%.bbappend
+FLAGS = {
+    "dtb": {
+        "binary": "dtb.bin",
+        "dest_disk": "SPINOR",
+        "dest_partition": "dtb",
+        "dest_guid": "{2A1A52FC-AA0B-401C-A808-5EA0F91068F8}",
+        "backup_disk": "SPINOR",
+        "backup_partition": "dtb_BACKUP",
+        "backup_guid": "{A166F11A-2B39-4FAA-B7E7-F8AA080D0587}",
+    },
+    "uefi": {
+        "binary": "uefi.elf",
+        "dest_disk": "UFS",
+        "dest_partition": "uefi_a",
+        "dest_guid": "400ffdcd-22e0-47e7-9a23-f16ed9382388",
+        "backup_disk": "UFS",
+        "backup_partition": "uefi_b",
+        "backup_guid": "",
+    },
+    # No backup, no GUID
+    "tz": {
+        "binary": "tz.mbn",
+        "dest_disk": "UFS",
+        "dest_partition": "tz_a",
+    },
+}
+
+
+def entries(flags=FLAGS):
+    return [FwEntry.from_flags(name, f.get) for name, f in flags.items()]
+
+
+def legacy_fvupdate(flash_type, names, flags):
+    """FvUpdate.xml as generated by qcom-capsule.bbclass before FwEntry,
+    from string fragments."""
+    lines = [
+        '<?xml version="1.0" encoding="utf-8"?>',
+        '<FVItems>',
+        '    <Metadata>',
+        '      <BreakingChangeNumber>0</BreakingChangeNumber>',
+        '      <FlashType>%s</FlashType>' % flash_type,
+        '    </Metadata>',
+        '',
+    ]
+
+    for name in names:
+        def flag(f):
+            return flags[name].get(f) or ''
+
+        binary = flag('binary')
+        dest_disk = flag('dest_disk')
+        dest_part = flag('dest_partition')
+        dest_guid = flag('dest_guid')
+        bkup_disk = flag('backup_disk')
+        bkup_part = flag('backup_partition')
+        bkup_guid = flag('backup_guid')
+
+        lines += [
+            '  <FwEntry>',
+            '    <InputBinary>%s</InputBinary>' % binary,
+            '    <InputPath>Images</InputPath>',
+            '    <Operation>UPDATE</Operation>',
+            '    <UpdateType>UPDATE_PARTITION</UpdateType>',
+            '    <BackupType>BACKUP_PARTITION</BackupType>',
+            '    <Dest>',
+            '      <DiskType>%s</DiskType>' % dest_disk,
+            '      <PartitionName>%s</PartitionName>' % dest_part,
+            '      <PartitionTypeGUID>%s</PartitionTypeGUID>' % dest_guid,
+            '    </Dest>',
+        ]
+
+        if bkup_part:
+            lines += [
+                '    <Backup>',
+                '      <DiskType>%s</DiskType>' % bkup_disk,
+                '      <PartitionName>%s</PartitionName>' % bkup_part,
+                '      <PartitionTypeGUID>%s</PartitionTypeGUID>' % bkup_guid,
+                '    </Backup>',
+            ]
+
+        lines += ['  </FwEntry>', '']
+
+    lines.append('</FVItems>')
+    return '\n'.join(lines)
+
+
+@pytest.mark.parametrize("names", [["dtb"], ["dtb", "uefi", "tz"], ["tz", "uefi"], []])
+def test_write_fvupdate_legacy(tmp_path, names):
+    out = tmp_path / "FvUpdate.xml"
+    write_fvupdate(str(out), "SPINOR", entries({n: FLAGS[n] for n in names}))
+    assert out.read_bytes() == legacy_fvupdate("SPINOR", names, FLAGS).encode()
+
+
+def test_write_fvupdate_escape(tmp_path):
+    out = tmp_path / "FvUpdate.xml"
+    flags = {"fw": dict(FLAGS["tz"], binary="a&b<c>.mbn")}
+    write_fvupdate(str(out), "UFS", entries(flags))
+    assert "<InputBinary>a&amp;b&lt;c&gt;.mbn</InputBinary>" in out.read_text()
+
+
+def _resolve(name):
+    return f"/bootbins/{name}" if name in ("dtb.bin", "uefi.elf", "tz.mbn") else None
+
+
+def test_validate_ok():
+    assert validate(entries(), _resolve) == []
+
+
+@pytest.mark.parametrize("flag", ["binary", "dest_disk", "dest_partition"])
+def test_validate_missing_flag(flag):
+    flags = {"tz": dict(FLAGS["tz"], **{flag: ""})}
+    assert validate(entries(flags), _resolve) == [f"CAPSULE_ENTRY_tz: missing [{flag}]"]
+
+
+def test_validate_missing_flags():
+    flags = {"tz": {"binary": "tz.mbn"}}
+    assert validate(entries(flags), _resolve) == [
+        "CAPSULE_ENTRY_tz: missing [dest_disk], [dest_partition]"]
+
+
+def test_validate_missing_binary():
+    flags = {"tz": dict(FLAGS["tz"], binary="tz.elf")}
+    assert validate(entries(flags), _resolve) == [
+        "CAPSULE_ENTRY_tz: binary 'tz.elf' is not among the boot binaries"]
+
+
+@pytest.mark.parametrize("field,value", [
+    ("dest_guid", "2A1A52FC-AA0B-401C-A808"),
+    ("dest_guid", "{2A1A52FC-AA0B-401C-A808-5EA0F91068FG}"),
+    ("backup_guid", "not-a-guid"),
+])
+def test_validate_guid(field, value):
+    flags = {"dtb": dict(FLAGS["dtb"], **{field: value})}
+    assert validate(entries(flags), _resolve) == [
+        f"CAPSULE_ENTRY_dtb: [{field}] '{value}' is not a GUID"]
+
+
+def test_validate_backup_without_disk():
+    flags = {"uefi": dict(FLAGS["uefi"], backup_disk="")}
+    assert validate(entries(flags), _resolve) == [
+        "CAPSULE_ENTRY_uefi: [backup_partition] set without [backup_disk]"]
+
+
+def test_validate_duplicate_destination():
+    flags = dict(FLAGS, tz2=dict(FLAGS["tz"]))
+    assert validate(entries(flags), _resolve) == [
+        "CAPSULE_ENTRY_tz2: destination UFS/tz_a is also used by CAPSULE_ENTRY_tz"]
+
+
+def test_validate_all_errors():
+    flags = {"a": {"binary": "missing.bin", "dest_disk": "UFS", "dest_partition": "x",
+                   "dest_guid": "bad"},
+             "b": {"dest_disk": "UFS", "dest_partition": "x"}}
+    assert len(validate(entries(flags), _resolve)) == 4
+
+
+def test_generate_fvupdate(tmp_path):
+    bootbins = tmp_path / "bootbins"
+    bootbins.mkdir()
+    for name in ("dtb.bin", "uefi.elf", "tz.mbn"):
+        (bootbins / name).write_bytes(name.encode() * 1000)
+
+    def resolve(name):
+        path = bootbins / name
+        return str(path) if path.exists() else None
+
+    out = tmp_path / "FvUpdate.xml"
+    digests = tmp_path / "capsule-digests.json"
+    assert generate_fvupdate(str(out), "UFS", entries(), resolve, str(digests), 2) == []
+    assert out.read_bytes() == legacy_fvupdate("UFS", list(FLAGS), FLAGS).encode()
+
+    dtb = str(bootbins / "dtb.bin")
+    assert sorted(json.loads(digests.read_text())) == sorted(
+        os.path.realpath(bootbins / n) for n in ("dtb.bin", "uefi.elf", "tz.mbn"))
+    assert lookup_digest(str(digests), dtb) == \
+        hashlib.sha256(b"dtb.bin" * 1000).hexdigest()
+
+    # A changed binary is no longer looked up
+    (bootbins / "dtb.bin").write_bytes(b"changed")
+    assert lookup_digest(str(digests), dtb) is None
+    assert lookup_digest(str(tmp_path / "missing.json"), dtb) is None
+
+
+def test_generate_fvupdate_invalid(tmp_path):
+    out = tmp_path / "FvUpdate.xml"
+    digests = tmp_path / "capsule-digests.json"
+    errors = generate_fvupdate(str(out), "UFS", entries(), lambda name: None, str(digests))
+    assert len(errors) == len(FLAGS)
+    assert not out.exists() and not digests.exists()
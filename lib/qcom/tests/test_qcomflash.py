@@ -0,0 +1,332 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for the qcomflash archive writers of qcom.qcomflash.
+#
+# The archives of a tree with hard links, a symlink, empty and sparse files
+# are listed and extracted with GNU tar and compared with the source tree.
+# The seek table of seekable zstd archives is checked against the frames
+# and against zstd -l. Incremental archives must not depend on the state
+# of their member cache.
+
+import io
+import json
+import os
+import random
+import re
+import shutil
+import stat
+import struct
+import subprocess
+
+import pytest
+
+from qcom.qcomflash import (DIR_MODE, FILE_MODE, ZSTD_SEEKABLE_MAGIC, ZSTD_SKIPPABLE_MAGIC,
+                             plan_tar, write_archive, write_incremental_archive, write_member,
+                             write_seekable_archive, write_tar)
+
+MiB = 1024 * 1024
+MTIME = 1700000000
+PREFIX = "qcom-multimedia-image-rb3gen2"
+
+ZSTD = ["zstd", "-q", "-c", "-3"]
+
+needs_gzip = pytest.mark.skipif(not shutil.which("gzip"), reason="gzip not found")
+needs_zstd = pytest.mark.skipif(not shutil.which("zstd"), reason="zstd not found")
+
+
+def _sparse(path, layout, rng):
+    """Write a file of data and holes, [(is_data, length)]."""
+    with open(path, 'wb') as f:
+        for is_data, length in layout:
+            if is_data:
+                f.write(rng.randbytes(length))
+            else:
+                f.seek(length, os.SEEK_CUR)
+        f.truncate()
+
+
+def _has_holes(path):
+    return os.stat(path).st_blocks * 512 < os.path.getsize(path)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """Return the root of a qcomflash-like tree."""
+    rng = random.Random(0)
+    root = tmp_path / "qcomflash"
+    (root / "spinor").mkdir(parents=True)
+    (root / "sail_nor").mkdir()
+    (root / "efi.bin").write_bytes(rng.randbytes(100000))
+    (root / "contents.xml").write_bytes(b"")
+    (root / "patch0.xml").write_bytes(rng.randbytes(511))
+    (root / "rawprogram0.xml").write_bytes(rng.randbytes(512))
+    (root / "spinor" / "cdt.bin").write_bytes(rng.randbytes(513))
+    # Sparse, ending in data and ending in a hole
+    _sparse(root / "dtb-rb3gen2-image.vfat",
+            [(True, 4096), (False, 2 * MiB), (True, 10000)], rng)
+    _sparse(root / "rootfs.img",
+            [(False, MiB), (True, 3 * 4096), (False, MiB), (True, 1), (False, 3 * MiB)], rng)
+    os.link(root / "dtb-rb3gen2-image.vfat", root / "dtb.bin")
+    os.link(root / "efi.bin", root / "spinor" / "efi.bin")
+    os.symlink("rootfs.img", root / "system.img")
+    return root
+
+
+def check_extracted(out, root):
+    """Compare the tree extracted into *out* with *root*."""
+    top = out / PREFIX
+    assert sorted(os.listdir(out)) == [PREFIX]
+    assert stat.S_IMODE(os.lstat(top).st_mode) == DIR_MODE
+    seen = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            src = os.path.join(dirpath, name)
+            dst = top / os.path.relpath(src, root)
+            st = os.lstat(dst)
+            if os.path.islink(src):
+                assert os.readlink(dst) == os.readlink(src)
+                continue
+            assert int(st.st_mtime) == MTIME
+            if os.path.isdir(src):
+                assert stat.S_IMODE(st.st_mode) == DIR_MODE
+                continue
+            assert stat.S_IMODE(st.st_mode) == FILE_MODE
+            with open(src, 'rb') as a, open(dst, 'rb') as b:
+                assert a.read() == b.read()
+            # Hard links are kept
+            key = (os.lstat(src).st_dev, os.lstat(src).st_ino)
+            if key in seen:
+                assert os.path.samefile(seen[key], dst)
+            seen[key] = dst
+        # Nothing else, e.g. GNUSparseFile.0 directories
+        rel = os.path.relpath(dirpath, root)
+        assert sorted(os.listdir(top / rel)) == sorted(dirnames + filenames)
+
+
+def tar_extract(archive, out, *options):
+    """List and extract *archive* with GNU tar, return the member names."""
+    listing = subprocess.run(["tar", *options, "-tf", str(archive)], check=True,
+                             capture_output=True, text=True).stdout.split()
+    os.makedirs(out)
+    subprocess.run(["tar", *options, "-xf", str(archive), "-C", str(out)], check=True)
+    return listing
+
+
+def test_tar(tmp_path, tree):
+    archive = tmp_path / "qcomflash.tar"
+    with open(archive, 'wb') as f:
+        stats = write_tar(f, str(tree), PREFIX, MTIME)
+    names = tar_extract(archive, tmp_path / "out")
+    check_extracted(tmp_path / "out", tree)
+
+    assert names[0] == PREFIX + "/"
+    assert not any("GNUSparseFile" in n for n in names)
+    assert (stats.files, stats.links) == (7, 2)
+    # The archive is a whole number of records
+    assert os.path.getsize(archive) % 10240 == 0
+    if _has_holes(tree / "rootfs.img"):
+        assert stats.stored < stats.size
+        assert os.path.getsize(archive) < stats.size
+
+
+def test_tar_reproducible(tmp_path, tree):
+    archives = []
+    for n in range(2):
+        archives.append(tmp_path / f"qcomflash{n}.tar")
+        with open(archives[-1], 'wb') as f:
+            write_tar(f, str(tree), PREFIX, MTIME)
+        # The timestamps of the sources are not recorded
+        os.utime(tree / "efi.bin")
+    assert archives[0].read_bytes() == archives[1].read_bytes()
+
+
+def test_tar_changed_file(tmp_path, tree):
+    members, _ = plan_tar(str(tree), PREFIX, MTIME)
+    os.truncate(tree / "efi.bin", 10)
+    with open(tmp_path / "qcomflash.tar", 'wb') as f:
+        with pytest.raises(OSError):
+            for member in members:
+                write_member(f, member)
+
+
+@needs_gzip
+def test_archive_gzip(tmp_path, tree):
+    archive = tmp_path / "qcomflash.tar.gz"
+    write_archive(str(archive), str(tree), PREFIX, MTIME, ["gzip", "-n", "-c"])
+    tar_extract(archive, tmp_path / "out", "-z")
+    check_extracted(tmp_path / "out", tree)
+
+
+def test_archive_compressor_failure(tmp_path, tree):
+    with pytest.raises(subprocess.CalledProcessError):
+        write_archive(str(tmp_path / "qcomflash.tar.gz"), str(tree), PREFIX, MTIME,
+                      ["sh", "-c", "cat >/dev/null; exit 3"])
+
+
+def tar_stream(root):
+    """Return the uncompressed tar stream of *root*."""
+    f = io.BytesIO()
+    write_tar(f, str(root), PREFIX, MTIME)
+    return f.getvalue()
+
+
+def read_seek_table(path):
+    """Return the [(compressed size, decompressed size)] of the seek table
+    ending the seekable zstd archive *path*, and the table frame size."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    count, descriptor, magic = struct.unpack_from('<IBI', data, len(data) - 9)
+    assert magic == ZSTD_SEEKABLE_MAGIC
+    assert descriptor == 0      # no checksums
+    table_size = 8 + count * 8 + 9
+    skippable, length = struct.unpack_from('<II', data, len(data) - table_size)
+    assert (skippable, length) == (ZSTD_SKIPPABLE_MAGIC, table_size - 8)
+    frames = [struct.unpack_from('<II', data, len(data) - table_size + 8 + n * 8)
+              for n in range(count)]
+    return frames, table_size
+
+
+def check_seekable(path, stream, frame_size, uniform=True):
+    """Check the seekable zstd archive *path* of the tar *stream*.
+
+    Unless *uniform*, frames may end early, as in incremental archives.
+    """
+    frames, table_size = read_seek_table(path)
+    assert sum(c for c, _ in frames) + table_size == os.path.getsize(path)
+    assert all(0 < d <= frame_size for _, d in frames)
+    if uniform:
+        assert all(d == frame_size for _, d in frames[:-1])
+
+    # Every frame decompresses on its own to its recorded size
+    with open(path, 'rb') as f:
+        data = f.read()
+    offset = 0
+    out = b''
+    for compressed, decompressed in frames:
+        frame = subprocess.run(["zstd", "-q", "-d", "-c"], input=data[offset:offset + compressed],
+                               stdout=subprocess.PIPE, check=True).stdout
+        assert len(frame) == decompressed
+        out += frame
+        offset += compressed
+    assert out == stream
+
+    info = subprocess.run(["zstd", "-l", "-v", str(path)], check=True, capture_output=True,
+                          text=True).stdout
+    assert re.search(r"# Zstandard Frames: (\d+)", info).group(1) == str(len(frames))
+    assert re.search(r"# Skippable Frames: (\d+)", info).group(1) == "1"
+    assert re.search(r"Compressed Size: .*\((\d+) B\)", info).group(1) == \
+        str(os.path.getsize(path))
+
+
+@needs_zstd
+def test_archive_zstd(tmp_path, tree):
+    archive = tmp_path / "qcomflash.tar.zst"
+    write_archive(str(archive), str(tree), PREFIX, MTIME, ZSTD + ["-T2"])
+    tar_extract(archive, tmp_path / "out", "--zstd")
+    check_extracted(tmp_path / "out", tree)
+
+
+@needs_zstd
+@pytest.mark.parametrize("frame_size", [64 * 1024, 100000, 64 * MiB])
+def test_archive_seekable(tmp_path, tree, frame_size):
+    archive = tmp_path / "qcomflash.tar.zst"
+    write_seekable_archive(str(archive), str(tree), PREFIX, MTIME, ZSTD, frame_size, 4)
+    check_seekable(archive, tar_stream(tree), frame_size)
+    tar_extract(archive, tmp_path / "out", "--zstd")
+    check_extracted(tmp_path / "out", tree)
+
+
+@needs_zstd
+def test_archive_seekable_reproducible(tmp_path, tree):
+    archives = []
+    for threads in (1, 4):
+        archives.append(tmp_path / f"qcomflash{threads}.tar.zst")
+        write_seekable_archive(str(archives[-1]), str(tree), PREFIX, MTIME, ZSTD,
+                               64 * 1024, threads)
+    assert archives[0].read_bytes() == archives[1].read_bytes()
+
+
+def test_archive_seekable_failure(tmp_path, tree):
+    with pytest.raises(subprocess.CalledProcessError):
+        write_seekable_archive(str(tmp_path / "qcomflash.tar.zst"), str(tree), PREFIX, MTIME,
+                               ["sh", "-c", "cat >/dev/null; exit 3"], 64 * 1024, 2)
+
+
+INCREMENTAL_MODES = {
+    "gz": (lambda n: ["gzip", "-n", "-c"], 0, ["gzip", "-d", "-c"], "-z"),
+    "zst": (lambda n: ZSTD + ["-T%d" % n], 0, ["zstd", "-q", "-d", "-c"], "--zstd"),
+    "zst-seekable": (lambda n: ZSTD + ["-T%d" % n], 64 * 1024, ["zstd", "-q", "-d", "-c"],
+                     "--zstd"),
+}
+
+
+@needs_gzip
+@needs_zstd
+@pytest.mark.parametrize("mode", INCREMENTAL_MODES)
+def test_incremental(tmp_path, tree, mode):
+    compressor, frame_size, decompressor, tar_option = INCREMENTAL_MODES[mode]
+    cache = str(tmp_path / "cache")
+
+    def write(name, cache_dir=cache):
+        archive = tmp_path / name
+        stats = write_incremental_archive(str(archive), str(tree), PREFIX, MTIME,
+                                          compressor, cache_dir, 4, frame_size)
+        stream = subprocess.run(decompressor + [str(archive)], check=True,
+                                stdout=subprocess.PIPE).stdout
+        # A concatenation of runs, read as a single stream
+        assert stream == tar_stream(tree)
+        if frame_size:
+            check_seekable(archive, stream, frame_size, uniform=False)
+        return archive, stats
+
+    members, _ = plan_tar(str(tree), PREFIX, MTIME)
+    total = sum(m.stream_size for m in members)
+
+    cold, stats = write("cold")
+    assert stats.reused == 0
+    warm, stats = write("warm")
+    assert stats.reused == total
+    assert warm.read_bytes() == cold.read_bytes()
+    entries = sorted(os.listdir(cache))
+
+    # Only the run of the changed file is compressed again
+    with open(tree / "rootfs.img", 'r+b') as f:
+        f.seek(MiB)
+        f.write(b"changed")
+    # Files are identified by size and mtime, whose granularity may be coarse
+    st = os.stat(tree / "rootfs.img")
+    os.utime(tree / "rootfs.img", ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    changed, stats = write("changed")
+    assert 0 < stats.reused < total
+    tar_extract(changed, tmp_path / "out", tar_option)
+    check_extracted(tmp_path / "out", tree)
+
+    # Unused entries are dropped from the cache
+    assert len(os.listdir(cache)) == len(entries)
+    assert sorted(os.listdir(cache)) != entries
+    # So are the digests of the files no longer deployed, like the old rootfs
+    with open(os.path.join(cache, "index.json")) as f:
+        digests = json.load(f)["digests"]
+    idents = set()
+    for m in members:
+        if m.path is not None:
+            st = os.stat(m.path)
+            idents.add(f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}")
+    assert set(digests) == idents
+
+    # The same input gives the same archive whatever the cache state
+    fresh, _ = write("fresh", str(tmp_path / "cache-fresh"))
+    assert fresh.read_bytes() == changed.read_bytes()
+
+
+@needs_zstd
+def test_incremental_settings(tmp_path, tree):
+    cache = str(tmp_path / "cache")
+    for level, reused in (("-3", 0), ("-3", True), ("-5", 0)):
+        stats = write_incremental_archive(str(tmp_path / "qcomflash.tar.zst"), str(tree),
+                                          PREFIX, MTIME, lambda n: ["zstd", "-q", "-c", level],
+                                          cache, 2)
+        # A compression level change invalidates the cache
+        assert bool(stats.reused) == bool(reused)
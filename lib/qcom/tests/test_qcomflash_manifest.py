@@ -0,0 +1,51 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for qcom.qcomflash_manifest.
+
+import os
+
+from qcom.qcomflash_manifest import (PARTITION_FILES, PARTITION_FILES_REQUIRED,
+                                     DirIndex, Pick, Select, resolve)
+
+
+def _touch(top, *names):
+    os.makedirs(top, exist_ok=True)
+    for name in names:
+        with open(os.path.join(top, name), 'wb') as f:
+            f.write(b'x')
+
+
+def _partition_rule(top, **kwargs):
+    return Select(str(top), PARTITION_FILES, required=PARTITION_FILES_REQUIRED, **kwargs)
+
+
+def test_partition_files(tmp_path):
+    _touch(tmp_path, "gpt_main0.bin", "gpt_backup0.bin", "rawprogram0.xml",
+           "rawprogram1.xml", "patch0.xml", "contents.xml", "other.xml")
+    selection = resolve([_partition_rule(tmp_path)], DirIndex())
+    assert not selection.missing
+    assert sorted(selection.files) == ["contents.xml", "gpt_backup0.bin", "gpt_main0.bin",
+                                       "patch0.xml", "rawprogram0.xml", "rawprogram1.xml"]
+
+
+def test_partition_files_required(tmp_path):
+    _touch(tmp_path, "gpt_main0.bin", "contents.xml")
+    selection = resolve([_partition_rule(tmp_path, dest_dir="spinor")], DirIndex())
+    assert selection.missing == [
+        ("spinor/rawprogram[0-9].xml", (str(tmp_path / "rawprogram[0-9].xml"),)),
+        ("spinor/patch*.xml", (str(tmp_path / "patch*.xml"),)),
+    ]
+
+
+def test_partition_files_missing_dir(tmp_path):
+    selection = resolve([_partition_rule(tmp_path / "nonexistent")], DirIndex())
+    assert [dest for dest, _ in selection.missing] == list(PARTITION_FILES_REQUIRED)
+
+
+def test_when_skips_required(tmp_path):
+    rules = [_partition_rule(tmp_path, when=(str(tmp_path / "spinor"),)),
+             Pick("cdt.bin", (str(tmp_path / "cdt.bin"),), required=True,
+                  when=(str(tmp_path / "spinor"),))]
+    assert resolve(rules, DirIndex()) == ({}, [])
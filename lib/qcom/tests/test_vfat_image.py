@@ -0,0 +1,237 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for qcom.vfat_image.
+#
+# The images are read back by an independent FAT12/16 reader written after
+# the Microsoft FAT specification, and by fsck.vfat and mtools when they are
+# on PATH. The sizes cover every FAT type and cluster size transition of
+# FatLayout, each checked on both sides.
+
+import os
+import random
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from qcom.vfat_image import FAT12_MAX_CLUSTERS, FatLayout, write_vfat_image
+
+TIMESTAMP = 1700000000
+
+needs_fsck = pytest.mark.skipif(not shutil.which("fsck.vfat"), reason="fsck.vfat not found")
+needs_mtools = pytest.mark.skipif(not (shutil.which("mdir") and shutil.which("mcopy")),
+                                  reason="mtools not found")
+
+
+def read_fat(path):
+    """Return ({name: data}, fat_bits) of a FAT12/16 image, checking its
+    structure on the way."""
+    with open(path, 'rb') as f:
+        img = f.read()
+
+    (bps, spc, reserved, nfats, root_entries, total16, media,
+     fat_size) = struct.unpack_from('<HBHBHHBH', img, 11)
+    total32, = struct.unpack_from('<I', img, 32)
+    assert img[510:512] == b'\x55\xaa'
+    assert nfats == 2 and media == 0xf8
+    total = total16 or total32
+    assert total * bps == len(img)
+
+    root_sectors = -(-root_entries * 32 // bps)
+    data_sectors = total - (reserved + nfats * fat_size + root_sectors)
+    clusters = data_sectors // spc
+    # The FAT type is determined by the cluster count alone
+    fat_bits = 12 if clusters <= FAT12_MAX_CLUSTERS else 16
+    assert img[54:62] == f"FAT{fat_bits}".ljust(8).encode()
+    assert clusters < 65525
+
+    fat_off = reserved * bps
+    fats = [img[fat_off + n * fat_size * bps:fat_off + (n + 1) * fat_size * bps]
+            for n in range(nfats)]
+    assert fats[0] == fats[1]
+    fat = fats[0]
+    assert (clusters + 2) * fat_bits <= len(fat) * 8
+
+    def entry(n):
+        if fat_bits == 16:
+            return struct.unpack_from('<H', fat, n * 2)[0]
+        v = struct.unpack_from('<H', fat, n * 3 // 2)[0]
+        return v >> 4 if n & 1 else v & 0xfff
+
+    eoc = 0xff8 if fat_bits == 12 else 0xfff8
+    assert entry(0) & 0xff == media and entry(1) >= eoc
+
+    root_off = fat_off + nfats * fat_size * bps
+    data_off = root_off + root_sectors * bps
+    cluster_size = spc * bps
+
+    files = {}
+    used = set()
+    lfn = {}
+    for n in range(root_entries):
+        raw = img[root_off + n * 32:root_off + (n + 1) * 32]
+        if raw[0] == 0:
+            break
+        if raw[11] == 0x0f:
+            order = raw[0] & 0x3f
+            lfn[order] = (raw[13], raw[1:11] + raw[14:26] + raw[28:32])
+            continue
+
+        short = raw[:11]
+        first, size = struct.unpack_from('<HI', raw, 26)
+        if lfn:
+            csum = 0
+            for b in short:
+                csum = (((csum & 1) << 7) + (csum >> 1) + b) & 0xff
+            assert all(c == csum for c, _ in lfn.values())
+            assert sorted(lfn) == list(range(1, len(lfn) + 1))
+            units = b''.join(lfn[i][1] for i in sorted(lfn)).decode('utf-16-le')
+            name = units.split('\0')[0]
+            lfn = {}
+        else:
+            base, ext = short[:8].decode().rstrip(), short[8:].decode().rstrip()
+            name = f"{base}.{ext}" if ext else base
+
+        data = b''
+        cluster = first
+        chain = 0
+        while size and cluster < eoc:
+            assert 2 <= cluster < clusters + 2 and cluster not in used
+            used.add(cluster)
+            off = data_off + (cluster - 2) * cluster_size
+            data += img[off:off + cluster_size]
+            chain += 1
+            cluster = entry(cluster)
+        assert chain == -(-size // cluster_size)
+        assert name not in files
+        files[name] = data[:size]
+
+    # Every cluster not in a chain is free
+    for n in range(2, clusters + 2):
+        assert (entry(n) != 0) == (n in used)
+    return files, fat_bits
+
+
+def _layout_key(size, sector_size):
+    try:
+        layout = FatLayout(size, sector_size)
+    except ValueError:
+        return None
+    return layout.fat_bits, layout.sectors_per_cluster
+
+
+def layout_boundaries(sector_size, start, limit):
+    """Return the sizes on both sides of every (FAT type, cluster size)
+    change of FatLayout between *start* and *limit*."""
+    sizes = []
+    lo = start
+    while True:
+        key = _layout_key(lo, sector_size)
+        hi = lo + sector_size
+        while _layout_key(hi, sector_size) == key:
+            if hi >= limit:
+                return sizes
+            hi = min(limit, lo + (hi - lo) * 2)
+        # Smallest size with another layout, in whole sectors
+        while hi - lo > sector_size:
+            mid = (lo + hi) // 2 // sector_size * sector_size
+            if _layout_key(mid, sector_size) == key:
+                lo = mid
+            else:
+                hi = mid
+        sizes += [lo, hi]
+        lo = hi
+
+
+BOUNDARIES = ([(512, s) for s in layout_boundaries(512, 256 * 1024, 80 * 1024 * 1024)] +
+              [(4096, s) for s in layout_boundaries(4096, 1024 * 1024, 80 * 1024 * 1024)])
+
+
+def _files(cluster_size, seed):
+    rng = random.Random(seed)
+    return [
+        # A DTB larger than a cluster, not ending on a cluster boundary
+        ("qcs6490-rb3gen2.dtb", rng.randbytes(2 * cluster_size + 123)),
+        ("EXACT.DTB", rng.randbytes(cluster_size)),
+        ("empty.txt", b""),
+        # Long names sharing their 8.3 prefix
+        ("combined-dtb-rb3gen2-vision-kit.dtb", rng.randbytes(100)),
+        ("combined-dtb-rb3gen2-industrial-kit.dtb", rng.randbytes(cluster_size + 1)),
+    ]
+
+
+def test_layout_boundaries():
+    keys = {_layout_key(size, sector) for sector, size in BOUNDARIES}
+    assert {bits for bits, _ in keys} == {12, 16}
+    assert len({spc for bits, spc in keys if bits == 12}) > 2
+    assert len({spc for bits, spc in keys if bits == 16}) > 2
+
+
+@pytest.mark.parametrize("sector_size,size", BOUNDARIES)
+def test_boundaries(tmp_path, sector_size, size):
+    layout = FatLayout(size, sector_size)
+    files = _files(layout.cluster_size, size)
+    image = str(tmp_path / "dtb.vfat")
+    write_vfat_image(image, size, files, sector_size=sector_size, timestamp=TIMESTAMP)
+
+    read, fat_bits = read_fat(image)
+    assert fat_bits == layout.fat_bits
+    assert read == dict(files)
+
+
+def test_source_paths(tmp_path):
+    dtb = tmp_path / "sa8775p-ride.dtb"
+    dtb.write_bytes(os.urandom(10000))
+    image = str(tmp_path / "dtb.vfat")
+    write_vfat_image(image, 4 * 1024 * 1024, [("combined-dtb.dtb", str(dtb))],
+                     timestamp=TIMESTAMP)
+    assert read_fat(image)[0] == {"combined-dtb.dtb": dtb.read_bytes()}
+
+
+def test_reproducible(tmp_path):
+    files = _files(2048, 1)
+    images = []
+    for n in range(2):
+        images.append(tmp_path / f"dtb{n}.vfat")
+        write_vfat_image(str(images[-1]), 4 * 1024 * 1024, files, timestamp=TIMESTAMP)
+    assert images[0].read_bytes() == images[1].read_bytes()
+
+
+def test_full(tmp_path):
+    layout = FatLayout(1024 * 1024)
+    too_big = b'x' * (layout.clusters * layout.cluster_size + 1)
+    with pytest.raises(ValueError):
+        write_vfat_image(str(tmp_path / "dtb.vfat"), 1024 * 1024, [("big.dtb", too_big)])
+
+
+def _tool_images(tmp_path):
+    """Yield (image, files) for a FAT12 and a FAT16 image."""
+    for sector_size, size in (BOUNDARIES[0], BOUNDARIES[-1]):
+        files = _files(FatLayout(size, sector_size).cluster_size, size)
+        image = str(tmp_path / f"dtb-{sector_size}-{size}.vfat")
+        write_vfat_image(image, size, files, sector_size=sector_size, timestamp=TIMESTAMP)
+        yield image, files
+
+
+@needs_fsck
+def test_fsck(tmp_path):
+    for image, _ in _tool_images(tmp_path):
+        subprocess.run(["fsck.vfat", "-n", image], check=True, capture_output=True)
+
+
+@needs_mtools
+def test_mtools(tmp_path):
+    env = dict(os.environ, MTOOLS_SKIP_CHECK="1")
+    for image, files in _tool_images(tmp_path):
+        listing = subprocess.run(["mdir", "-b", "-i", image, "::"], check=True,
+                                 capture_output=True, text=True, env=env).stdout
+        assert sorted(os.path.basename(p) for p in listing.split()) == \
+            sorted(name for name, _ in files)
+        for name, data in files:
+            out = tmp_path / "out"
+            subprocess.run(["mcopy", "-o", "-i", image, f"::{name}", str(out)],
+                           check=True, env=env)
+            assert out.read_bytes() == data
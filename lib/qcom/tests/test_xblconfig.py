@@ -0,0 +1,47 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: BSD-3-Clause-Clear
+#
+# Plain pytest tests for the parse-config dump parsing of qcom.xblconfig.
+
+import bb
+import pytest
+import standins
+
+from qcom.xblconfig import ConfigItem, find_post_ddr_dtb, parse_dump
+
+# Raised by bb.fatal(), real or stand-in
+FATAL = getattr(bb, "BBHandledException", standins.BBFatal)
+
+DUMP = """\
+Parsing xbl_config.elf
+[+] config_item[0] -> PH# 3 -> './xbl_config.cfg' (1024 bytes)
+[+] config_item[5] -> PH# 8 -> './pre-ddr-kodiak-1.0.dtb' (40960 bytes)
+[+] config_item[6] -> PH# 8 -> './post-ddr-kodiak-1.0.dtb' (90280 bytes)
+Done
+"""
+
+
+def test_parse_dump():
+    items = parse_dump(DUMP)
+    assert items == [
+        ConfigItem(0, 3, "xbl_config.cfg", 1024),
+        ConfigItem(5, 8, "pre-ddr-kodiak-1.0.dtb", 40960),
+        ConfigItem(6, 8, "post-ddr-kodiak-1.0.dtb", 90280),
+    ]
+    assert find_post_ddr_dtb(items) == items[2]
+
+
+def test_no_post_ddr_dtb():
+    assert find_post_ddr_dtb(parse_dump(DUMP.splitlines()[1])) is None
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Parsing xbl_config.elf\nDone\n",
+    # Format change of the item lines
+    "config_item[6]: PH 8, post-ddr-kodiak-1.0.dtb, 90280 bytes\n",
+])
+def test_parse_dump_fails(text):
+    with pytest.raises(FATAL):
+        parse_dump(text)
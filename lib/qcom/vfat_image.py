@@ -0,0 +1,282 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains a small FAT12/FAT16 image writer used to build the
+# dtb-*-image.vfat partition images without spawning mkfs.vfat and mcopy.
+#
+# The images only ever hold a handful of files in the root directory, so the
+# writer lays them out contiguously after the root directory and produces the
+# whole image in a single sequential pass, leaving holes for the unused
+# areas so the sparse output takes little disk space. All timestamps and
+# the volume id are derived from SOURCE_DATE_EPOCH so the output is
+# reproducible.
+
+import os
+import shutil
+import struct
+import time
+from typing import Iterable, Tuple, Union
+
+FAT12_MAX_CLUSTERS = 4084
+FAT16_MAX_CLUSTERS = 65524
+
+DEFAULT_ROOT_ENTRIES = 512
+DIR_ENTRY_SIZE = 32
+ATTR_ARCHIVE = 0x20
+ATTR_LFN = 0x0f
+MEDIA_FIXED = 0xf8
+
+# Characters allowed in 8.3 short names besides A-Z and 0-9
+_SHORT_NAME_CHARS = set("$%'-_@~`!(){}^#&")
+
+
+def _fat_datetime(timestamp):
+    """Return (date, time) in FAT encoding, clamped to the FAT epoch."""
+    tm = time.gmtime(max(timestamp, 315532800))  # 1980-01-01
+    fat_date = ((tm.tm_year - 1980) << 9) | (tm.tm_mon << 5) | tm.tm_mday
+    fat_time = (tm.tm_hour << 11) | (tm.tm_min << 5) | (tm.tm_sec // 2)
+    return fat_date, fat_time
+
+
+def _short_name(name, taken):
+    """Return the 11-byte 8.3 name for *name* and whether it needs LFN entries."""
+    base, _, ext = name.rpartition('.')
+    if not base:
+        base, ext = ext, ''
+
+    def clean(s):
+        return ''.join(c if c.isalnum() or c in _SHORT_NAME_CHARS else '_'
+                       for c in s.upper() if c not in ' .')
+
+    sbase, sext = clean(base), clean(ext)[:3]
+    exact = (name.upper() == name and sbase == base and sext == ext
+             and len(base) <= 8 and len(ext) <= 3)
+    if exact:
+        short = (sbase.ljust(8) + sext.ljust(3)).encode('ascii')
+        if short not in taken:
+            return short, False
+
+    # Numeric tail generation, as done by Windows and mtools
+    for n in range(1, 1000000):
+        tail = f"~{n}"
+        short = (sbase[:8 - len(tail)] + tail).ljust(8) + sext.ljust(3)
+        short = short.encode('ascii')
+        if short not in taken:
+            return short, True
+    raise ValueError(f"No short name available for '{name}'")
+
+
+def _lfn_checksum(short):
+    csum = 0
+    for b in short:
+        csum = (((csum & 1) << 7) + (csum >> 1) + b) & 0xff
+    return csum
+
+
+def _lfn_entries(name, short):
+    """Return the VFAT long file name entries preceding a short entry."""
+    units = name.encode('utf-16-le')
+    chars = [units[i:i + 2] for i in range(0, len(units), 2)]
+    # NUL-terminate and pad with 0xffff unless the name fills the entries
+    if len(chars) % 13:
+        chars.append(b'\0\0')
+        chars += [b'\xff\xff'] * (-len(chars) % 13)
+
+    csum = _lfn_checksum(short)
+    count = len(chars) // 13
+    entries = []
+    for seq in range(count, 0, -1):
+        part = chars[(seq - 1) * 13:seq * 13]
+        order = seq | (0x40 if seq == count else 0)
+        entries.append(struct.pack('<B10sBBB12sH4s', order, b''.join(part[0:5]),
+                                   ATTR_LFN, 0, csum, b''.join(part[5:11]), 0,
+                                   b''.join(part[11:13])))
+    return entries
+
+
+class _Entry:
+    def __init__(self, name, content):
+        if '/' in name or not name:
+            raise ValueError(f"Invalid FAT file name '{name}'")
+        self.name = name
+        if isinstance(content, (bytes, bytearray)):
+            self.data = bytes(content)
+            self.path = None
+            self.size = len(self.data)
+        else:
+            self.data = None
+            self.path = content
+            self.size = os.path.getsize(content)
+
+    def write_to(self, f):
+        if self.path is None:
+            f.write(self.data)
+            return
+        with open(self.path, 'rb') as src:
+            shutil.copyfileobj(src, f)
+
+
+class FatLayout:
+    """Geometry of a FAT12/FAT16 volume of *size* bytes."""
+
+    def __init__(self, size, sector_size=512, root_entries=DEFAULT_ROOT_ENTRIES):
+        if sector_size not in (512, 1024, 2048, 4096):
+            raise ValueError(f"Unsupported FAT sector size {sector_size}")
+        self.sector_size = sector_size
+        self.total_sectors = size // sector_size
+        self.reserved_sectors = 1
+        self.num_fats = 2
+        # Round the root directory up to whole sectors
+        per_sector = sector_size // DIR_ENTRY_SIZE
+        self.root_entries = -(-root_entries // per_sector) * per_sector
+        self.root_sectors = self.root_entries // per_sector
+
+        # Prefer FAT12 with small clusters like mkfs.fat does for small
+        # volumes, then FAT16 with clusters of up to 32 KiB. The FAT type is
+        # defined by the cluster count alone, so it must fit the type limits.
+        for bits, low, high, max_cluster in (
+                (12, 1, FAT12_MAX_CLUSTERS, max(4096, sector_size)),
+                (16, FAT12_MAX_CLUSTERS + 1, FAT16_MAX_CLUSTERS, 32768)):
+            spc = 1
+            while spc * sector_size <= max_cluster:
+                clusters, fat_sectors = self._fit(spc, bits)
+                if low <= clusters <= high:
+                    self.fat_bits = bits
+                    self.sectors_per_cluster = spc
+                    self.clusters = clusters
+                    self.fat_sectors = fat_sectors
+                    return
+                spc *= 2
+        raise ValueError(f"Cannot lay out a FAT12/16 volume of {size} bytes")
+
+    def _fit(self, spc, bits):
+        fat_sectors = 1
+        while True:
+            data = (self.total_sectors - self.reserved_sectors
+                    - self.num_fats * fat_sectors - self.root_sectors)
+            clusters = data // spc
+            needed = -(-((clusters + 2) * bits // 8 + 1) // self.sector_size)
+            if needed <= fat_sectors:
+                return clusters, fat_sectors
+            fat_sectors = needed
+
+    @property
+    def cluster_size(self):
+        return self.sectors_per_cluster * self.sector_size
+
+    @property
+    def root_offset(self):
+        return (self.reserved_sectors + self.num_fats * self.fat_sectors) * self.sector_size
+
+    @property
+    def data_offset(self):
+        return self.root_offset + self.root_sectors * self.sector_size
+
+
+def _boot_sector(layout, volume_id, label):
+    total16 = layout.total_sectors if layout.total_sectors < 0x10000 else 0
+    total32 = 0 if total16 else layout.total_sectors
+    bpb = struct.pack('<3s8sHBHBHHBHHHII', b'\xeb\x3c\x90', b'mkfs.fat',
+                      layout.sector_size, layout.sectors_per_cluster,
+                      layout.reserved_sectors, layout.num_fats,
+                      layout.root_entries, total16, MEDIA_FIXED,
+                      layout.fat_sectors, 32, 64, 0, total32)
+    ext = struct.pack('<BBBI11s8s', 0x80, 0, 0x29, volume_id,
+                      label.upper().ljust(11)[:11].encode('ascii'),
+                      f"FAT{layout.fat_bits}".ljust(8).encode('ascii'))
+    sector = bytearray(layout.sector_size)
+    sector[:len(bpb) + len(ext)] = bpb + ext
+    sector[510:512] = b'\x55\xaa'
+    return bytes(sector)
+
+
+def _fat_table(layout, chains):
+    """Return one FAT copy for the contiguous cluster *chains* [(first, count)]."""
+    eoc = (1 << layout.fat_bits) - 1
+    values = [(eoc & ~0xff) | MEDIA_FIXED, eoc]
+    for first, count in chains:
+        values += list(range(first + 1, first + count)) + [eoc]
+
+    table = bytearray(layout.fat_sectors * layout.sector_size)
+    if layout.fat_bits == 16:
+        struct.pack_into(f'<{len(values)}H', table, 0, *values)
+    else:
+        for n, v in enumerate(values):
+            off = n * 3 // 2
+            if n & 1:
+                table[off] |= (v & 0xf) << 4
+                table[off + 1] = v >> 4
+            else:
+                table[off] = v & 0xff
+                table[off + 1] |= v >> 8
+    return bytes(table)
+
+
+def write_vfat_image(path, size, entries: Iterable[Tuple[str, Union[bytes, str]]],
+                     sector_size=512, timestamp=None, volume_id=None,
+                     label="NO NAME"):
+    """Write a FAT12/16 image of *size* bytes holding *entries*.
+
+    Args:
+        path: Output image path.
+        size: Image size in bytes.
+        entries: (file name, bytes or source path) pairs placed in the root
+            directory, in order.
+        sector_size: Logical sector size (QCOM_VFAT_SECTOR_SIZE).
+        timestamp: File and volume creation time, defaults to
+            SOURCE_DATE_EPOCH.
+        volume_id: Volume serial number, derived from *timestamp* by
+            default like mkfs.fat does.
+        label: Volume label stored in the boot sector.
+    """
+    if timestamp is None:
+        timestamp = int(os.environ.get('SOURCE_DATE_EPOCH', 0))
+    if volume_id is None:
+        volume_id = (timestamp << 20) & 0xffffffff
+
+    layout = FatLayout(size, sector_size)
+    files = [_Entry(name, content) for name, content in entries]
+    fat_date, fat_time = _fat_datetime(timestamp)
+
+    root = bytearray()
+    chains = []
+    placed = []
+    taken = set()
+    next_cluster = 2
+    for entry in files:
+        short, needs_lfn = _short_name(entry.name, taken)
+        taken.add(short)
+        count = -(-entry.size // layout.cluster_size)
+        first = next_cluster if count else 0
+        if count:
+            chains.append((first, count))
+            placed.append((entry, first))
+            next_cluster += count
+        if needs_lfn:
+            root += b''.join(_lfn_entries(entry.name, short))
+        root += struct.pack('<11sBBBHHHHHHHI', short, ATTR_ARCHIVE, 0, 0,
+                            fat_time, fat_date, fat_date, 0, fat_time,
+                            fat_date, first, entry.size)
+
+    if len(root) > layout.root_entries * DIR_ENTRY_SIZE:
+        raise ValueError("Too many files for the FAT root directory")
+    if next_cluster - 2 > layout.clusters:
+        raise ValueError(f"Files do not fit in a {size} byte FAT image")
+
+    # Only the non-zero head of each metadata area is written. The image
+    # size is set up front, so everything never written (FAT and root
+    # directory tails, cluster padding and free clusters) stays a hole.
+    fat = _fat_table(layout, chains).rstrip(b'\0')
+    fat_size = layout.fat_sectors * layout.sector_size
+    with open(path, 'wb') as f:
+        f.truncate(layout.total_sectors * layout.sector_size)
+        f.write(_boot_sector(layout, volume_id, label))
+        for n in range(layout.num_fats):
+            f.seek(layout.reserved_sectors * layout.sector_size + n * fat_size)
+            f.write(fat)
+        f.seek(layout.root_offset)
+        f.write(root)
+        for entry, first in placed:
+            f.seek(layout.data_offset + (first - 2) * layout.cluster_size)
+            entry.write_to(f)
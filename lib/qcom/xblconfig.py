@@ -0,0 +1,162 @@
+# Copyright (c) Qualcomm Technologies, Inc. and/or its subsidiaries.
+#
+# SPDX-License-Identifier: GPL-2.0-only
+#
+# This file contains the injection of the capsule root certificate into
+# xbl_config.elf used by qcom-capsule.bbclass.
+#
+# qcom-capsule-tool dumps the XBLConfig items of the ELF, the certificate
+# is written into the QcCapsuleRootCert property of the post-DDR DTB and
+# the updated DTB is packed back into the ELF. The dump output is parsed
+# into ConfigItem records, saved as JSON next to the text log, and the DTB
+# to patch is picked from those records.
+#
+# parse-config dump has no machine-readable output mode, so the records are
+# scraped from its text listing. Any change of that format fails the task
+# rather than being taken for an ELF without a post-DDR DTB, which would
+# silently ship the capsule without the root certificate (and cache that).
+#
+# The result only depends on the ELF, the root certificate, the DTB and
+# section selection and the tool, so it is kept in a content-addressed
+# cache (see qcom.content_cache) and rebuilds with the same inputs skip the
+# dump/patch/repack round trip.
+
+import json
+import os
+import re
+import subprocess
+from typing import List, NamedTuple, Optional
+
+import bb
+
+TOOL = "qcom-capsule-tool"
+
+# [+] config_item[6] -> PH# 8 -> './post-ddr-kodiak-1.0.dtb' (90280 bytes)
+_ITEM_RE = re.compile(r"config_item\[(\d+)\]\s*->\s*PH#\s*(\d+)\s*->\s*'([^']*)'"
+                      r"\s*\((\d+) bytes\)")
+
+_POST_DDR_RE = re.compile(r"post-ddr.*\.dtb")
+
+
+class ConfigItem(NamedTuple):
+    index: int      # config_item index
+    section: int    # ELF program header holding the item
+    name: str       # file name of the dumped item
+    size: int
+
+
+def parse_dump(text) -> List[ConfigItem]:
+    """Return the config items listed in the output of parse-config dump.
+
+    Fails when no item is found or an item line cannot be parsed.
+    """
+    items = []
+    for line in text.splitlines():
+        if "config_item[" not in line:
+            continue
+        m = _ITEM_RE.search(line)
+        if not m:
+            bb.fatal(f"Unexpected {TOOL} parse-config dump line: {line.strip()}")
+        items.append(ConfigItem(int(m.group(1)), int(m.group(2)),
+                                os.path.basename(m.group(3)), int(m.group(4))))
+    if not items:
+        bb.fatal(f"{TOOL} parse-config dump listed no config items:\n{text}")
+    return items
+
+
+def find_post_ddr_dtb(items) -> Optional[ConfigItem]:
+    """Return the first post-DDR DTB item, if any."""
+    for item in items:
+        if _POST_DDR_RE.search(item.name):
+            return item
+    return None
+
+
+def _run(cmd, cwd=None):
+    try:
+        return subprocess.run(cmd, check=True, capture_output=True, text=True,
+                              cwd=cwd).stdout
+    except subprocess.CalledProcessError as e:
+        bb.fatal(f"Command '{' '.join(cmd)}' failed with return code {e.returncode}\n"
+                 f"stdout: {e.stdout}\n"
+                 f"stderr: {e.stderr}")
+
+
+def dump_config(elf, out_dir, log_path, json_path) -> List[ConfigItem]:
+    """Dump the config items of *elf* into *out_dir*.
+
+    The tool output is saved to *log_path* and the parsed items to
+    *json_path*.
+    """
+    text = _run([TOOL, "parse-config", elf, "dump", "--out-dir", out_dir])
+    with open(log_path, 'w') as f:
+        f.write(text)
+    items = parse_dump(text)
+    with open(json_path, 'w') as f:
+        json.dump({"elf": os.path.basename(elf),
+                   "items": [item._asdict() for item in items]}, f, indent=2)
+    return items
+
+
+def patch_root_cert(elf, root_cer, work_dir, dtb="", section="") -> Optional[str]:
+    """Inject the DER root certificate *root_cer* into *elf*.
+
+    The post-DDR DTB is detected from the dump unless *dtb* names it, and
+    *section* overrides its section index. *elf* is replaced by the patched
+    ELF. Returns the name of the patched DTB, or None when there is none.
+    """
+    items = dump_config(elf, work_dir, os.path.join(work_dir, "xbl_dump.log"),
+                        os.path.join(work_dir, "xbl_dump.json"))
+    if not dtb:
+        item = find_post_ddr_dtb(items)
+        if item is None:
+            return None
+        dtb = item.name
+        section = section or str(item.section)
+    elif not section:
+        item = next((i for i in items if i.name == dtb), None)
+        if item is None:
+            bb.fatal(f"XBLCONFIG_DTB '{dtb}' is not an item of {elf}; "
+                     f"set XBLCONFIG_DTB_SECTION")
+        section = str(item.section)
+
+    root_inc = os.path.join(work_dir, "QcFMPRoot.inc")
+    _run([TOOL, "bin-to-hex", root_cer, root_inc])
+    orig_dtb = os.path.join(work_dir, dtb)
+    updated_dtb = os.path.join(work_dir, os.path.splitext(dtb)[0] + "-updated.dtb")
+    patched = os.path.join(work_dir, "xbl_config_patched.elf")
+    _run([TOOL, "set-dtb-property", orig_dtb, "/sw/uefi/uefiplat",
+          "QcCapsuleRootCert", f"@list:{root_inc}", updated_dtb])
+    _run([TOOL, "parse-config", elf, "replace", section, updated_dtb, patched])
+    os.replace(patched, elf)
+    return dtb
+
+
+def patch_root_cert_cached(elf, root_cer, work_dir, cache, manifest, dtb="",
+                           section="") -> Optional[str]:
+    """patch_root_cert() through *cache* (a ContentCache, or None), keyed on
+    *manifest*, which must describe the ELF, the certificate, *dtb*,
+    *section* and the tool."""
+    from qcom.content_cache import manifest_key
+
+    result = os.path.join(work_dir, "xbl_config_result.json")
+    files = {"xbl_config.elf": elf + ".cached", "result.json": result,
+             "xbl_dump.json": os.path.join(work_dir, "xbl_dump.json")}
+    key = None
+    if cache:
+        key = manifest_key(manifest)
+        if cache.fetch(key, files):
+            with open(result) as f:
+                patched_dtb = json.load(f)["patched_dtb"]
+            os.replace(elf + ".cached", elf)
+            bb.note(f"Reusing cached xbl_config.elf {key}")
+            return patched_dtb
+
+    patched_dtb = patch_root_cert(elf, root_cer, work_dir, dtb, section)
+    with open(result, 'w') as f:
+        json.dump({"patched_dtb": patched_dtb}, f)
+
+    if cache:
+        # Cache the outcome even when there is nothing to patch
+        cache.store(key, dict(files, **{"xbl_config.elf": elf}), manifest)
+    return patched_dtb